@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+bench_glossary.py
+
+Compares the old per-key re.sub glossary expansion with the compiled
+single-pass Glossary on a synthetic blog page.
+
+    ./bench/bench_glossary.py [macros] [page_kb] [pages]
+
+Defaults to 200 macros, a 64KB page and 50 pages.
+"""
+
+import sys, os, re, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fargo2html
+
+def legacySubData(d,glossary):
+    for k,v in glossary.items():
+        k = re.sub('\(','\\(',k)
+        k = re.sub('\)','\\)',k)
+        d = re.sub(k,v,d)
+    return d
+
+def makeGlossary(macros):
+    glossary = fargo2html.DEFAULT_GLOSSARY.copy()
+    for i in range(macros):
+        glossary['<%%macro%d%%>' % i] = '<span class="m%d">macro %d</span>' % (i, i)
+    return glossary
+
+def makePage(glossary, page_kb):
+    keys = sorted(glossary)
+    parts, size, i = [], 0, 0
+    while size < page_kb * 1024:
+        part = '<p class="divOutlineItem">Paragraph %d of the post %s</p>\n' % (i, keys[i % len(keys)])
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return ''.join(parts)
+
+def timeIt(func, pages):
+    start = time.time()
+    for page in pages:
+        result = func(page)
+    return time.time() - start, result
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    macros, page_kb, count = ([int(a) for a in argv] + [200, 64, 50][len(argv):])[:3]
+    glossary = makeGlossary(macros)
+    pages = [makePage(glossary, page_kb)] * count
+
+    legacy_time, legacy = timeIt(lambda page: legacySubData(page, glossary), pages)
+    start = time.time()
+    compiled = fargo2html.Glossary(glossary)
+    compile_time = time.time() - start
+    compiled_time, result = timeIt(compiled.expand, pages)
+
+    if result != legacy:
+        print >> sys.stderr, "output differs from legacy subData"
+        return 1
+    print "%d macros, %dKB page, %d pages" % (len(glossary), page_kb, count)
+    print "legacy subData:    %8.3fs" % legacy_time
+    print "compiled Glossary: %8.3fs (+ %.3fs to compile)" % (compiled_time, compile_time)
+    print "speedup:            %8.1fx" % (legacy_time / max(compiled_time + compile_time, 1e-9))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
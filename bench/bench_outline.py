@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+bench_outline.py
+
+Compares the old closings-stack grabData with the single-pass outline
+emitter on a synthetic outline.
+
+    ./bench/bench_outline.py [depth] [width] [runs]
+
+Defaults to an outline 6 levels deep with 6 children per node, 3 runs.
+"""
+
+import sys, os, time
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fargo2html
+import opml
+
+def legacyGrabData(outline,base_rules=None,format=''):
+    FORMATS = fargo2html.FORMATS
+    data = [node.get('text') for node in outline._root.iterdescendants()]
+    rules = fargo2html.processRules(base_rules,[])
+    level = 1
+    closings = [None]
+    content = [FORMATS[format]['body_open'] % rules[level],FORMATS[format]['list_open'] % rules[level]]
+    for i,node in enumerate(outline._root.iterdescendants()):
+        count = len(node)
+        for c in range(level):
+            closing = closings.pop()
+            if closing is not None:
+                level -= 1
+                content.append(level*"\t" + closing % rules[level])
+        if count > 0:
+            rules[level]['ID'] = "T%s" % i
+            content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['list_header_open'] % rules[level], node.get('text'), FORMATS[format]['list_header_close']))
+            show = 'show' if rules[level]['expanded'] else 'hide'
+            content.append('''<div class="%s" id="T%s" name="T%s">''' % (show, i, i))
+            content.append(level*"\t" + FORMATS[format]['list_open'] % rules[level])
+            closings.append(level*"\t" + "%s\n%s" % (FORMATS[format]['list_close'] % rules[level], "</div>"))
+            for c in range(count*level):
+                closings.append(None)
+            if count: closings.append(None)
+            level += 1
+        else:
+            content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['item_open'] % rules[level], node.get('text'), FORMATS[format]['item_close']))
+            closings.append(None)
+    for closing in closings:
+        if closing:
+            content.append(closing)
+    content.append(FORMATS[format]['body_close'] % rules[level])
+    return rules, content
+
+def makeOutline(depth, width):
+    root = etree.Element('outline', text='page')
+    def grow(parent, level):
+        for i in range(width):
+            node = etree.SubElement(parent, 'outline', text='level %d item %d' % (level, i))
+            if level < depth:
+                grow(node, level + 1)
+    grow(root, 1)
+    return opml.OutlineElement(root)
+
+def timeIt(func, outline, runs):
+    start = time.time()
+    for i in range(runs):
+        result = func(outline, None, 'outline')[1]
+    return time.time() - start, result
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    depth, width, runs = ([int(a) for a in argv] + [6, 6, 3][len(argv):])[:3]
+    outline = makeOutline(depth, width)
+
+    legacy_time, legacy = timeIt(legacyGrabData, outline, runs)
+    emitter_time, result = timeIt(fargo2html.grabData, outline, runs)
+
+    if result != legacy:
+        print >> sys.stderr, "output differs from legacy grabData"
+        return 1
+    print "%d nodes, %d levels, %d runs" % (len(outline._root.xpath('.//outline')), depth, runs)
+    print "legacy grabData: %8.3fs" % legacy_time
+    print "outline emitter: %8.3fs" % emitter_time
+    print "speedup:          %8.1fx" % (legacy_time / max(emitter_time, 1e-9))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
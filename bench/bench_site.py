@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+bench_site.py
+
+Builds a synthetic site (see synthetic.py) served from a local HTTP server
+and times each phase of the build. The site is built twice: cold, into an
+empty folder, and warm, again with nothing changed.
+
+    ./bench/bench_site.py [--output=results.json] [--compare=old.json] [--runs=3] [--memory] [name=value ...]
+
+name=value settings go to synthetic.py, e.g. pages=500 posts=4 glossary=300.
+Results are printed and, with --output, saved as JSON. --compare prints
+them next to an earlier results file. --memory builds into a MemoryOutput
+instead of a folder, which leaves disk I/O out of the timings.
+
+Phases are timed by wrapping the functions that do the work, and a phase
+called from inside another only counts towards itself:
+
+    fetch     the outline and its includes
+    parse     reading the OPML and the #glossary/#templates settings
+    render    turning outline nodes into html (grabData)
+    glossary  expanding templates and glossary macros
+    write     comparing and writing output files
+    feed      building rss.xml
+    index     joining listings into archive pages
+    manifest  digesting what each page is built from, saving the manifest
+    other     everything else in parse()
+"""
+
+import sys, os, time, json, getopt, shutil, tempfile, threading, platform, hashlib
+import SimpleHTTPServer, SocketServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+import fargo2html
+import opml
+import synthetic
+
+PHASES = ['fetch', 'parse', 'render', 'glossary', 'write', 'feed', 'index', 'manifest']
+
+class Timer(object):
+    # Collects exclusive time per phase. Calls on threads other than the one
+    # that started the build (include fetches) are timed by their caller.
+    def __init__(self):
+        self.totals = dict((phase, 0.0) for phase in PHASES)
+        self.stack = []
+        self.thread = threading.current_thread()
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            if threading.current_thread() is not self.thread:
+                return func(*args, **kwargs)
+            start = time.time()
+            self.stack.append(0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                inner = self.stack.pop()
+                elapsed = time.time() - start
+                self.totals[phase] += elapsed - inner
+                if self.stack:
+                    self.stack[-1] += elapsed
+        return timed
+
+def instrument(timer):
+    # swaps timed versions in for the functions parse() calls; returns a
+    # function that puts the originals back
+    targets = [
+        (fargo2html, 'fetchOutline', 'fetch'), (fargo2html, 'fetchIncludes', 'fetch'),
+        (opml, 'from_string', 'parse'), (fargo2html, 'readSettings', 'parse'),
+        (fargo2html, 'grabData', 'render'),
+        (fargo2html.Glossary, 'expand', 'glossary'),
+        (fargo2html.OutputWriter, 'write', 'write'), (fargo2html.OutputWriter, 'stream', 'write'),
+        (fargo2html, 'buildFeed', 'feed'),
+        (fargo2html, 'archivePage', 'index'),
+        (fargo2html, 'unitDigest', 'manifest'), (fargo2html.Manifest, 'save', 'manifest'),
+    ]
+    originals = []
+    for owner, name, phase in targets:
+        original = owner.__dict__[name]
+        originals.append((owner, name, original))
+        setattr(owner, name, timer.wrap(phase, original))
+    def restore():
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+    return restore
+
+class QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(folder):
+    # a local stand-in for Dropbox, serving folder on a free port
+    class Handler(QuietHandler):
+        def translate_path(self, path):
+            return os.path.join(folder, path.split('?')[0].lstrip('/'))
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+def build(url, folder, output=None):
+    timer = Timer()
+    restore = instrument(timer)
+    writer = fargo2html.OutputWriter(output=output)
+    fargo2html.COMPILED.clear()
+    start, cpu = time.time(), time.clock()
+    try:
+        fargo2html.parse(url, folder, None, writer=writer, jobs=1)
+    finally:
+        restore()
+    total = time.time() - start
+    phases = dict(timer.totals)
+    phases['other'] = max(0.0, total - sum(phases.values()))
+    return {'total': total, 'cpu': time.clock() - cpu, 'phases': phases,
+            'written': len(writer.changed), 'unchanged': writer.unchanged}
+
+def best(results):
+    # the fastest of several runs, which is the least disturbed by noise
+    return min(results, key=lambda result: result['total'])
+
+def version():
+    source = open(fargo2html.__file__.replace('.pyc', '.py'), 'rb').read()
+    return hashlib.sha1(source).hexdigest()[:12]
+
+def benchmark(overrides, runs=1, memory=False):
+    work = tempfile.mkdtemp(prefix='fargobench')
+    try:
+        site = os.path.join(work, 'site')
+        server, base_url = serve(site)
+        overrides = dict(overrides, base_url=base_url)
+        values = synthetic.makeSite(site, **overrides)
+        cold, warm = [], []
+        for i in range(runs):
+            folder = os.path.join(work, 'out%d' % i, 'site')
+            output = None
+            if memory:
+                output = fargo2html.MemoryOutput()
+            cold.append(build(base_url + '/main.opml', folder, output))
+            warm.append(build(base_url + '/main.opml', folder, output))
+        server.shutdown()
+        del values['base_url']
+        return {
+            'version': version(),
+            'python': platform.python_version(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': values,
+            'runs': runs,
+            'output': memory and 'memory' or 'folder',
+            'cold': best(cold),
+            'warm': best(warm),
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def report(results, old=None):
+    for run in ('cold', 'warm'):
+        result = results[run]
+        print "%s build: %.3fs wall, %.3fs cpu, %d files written, %d unchanged" % (
+            run, result['total'], result['cpu'], result['written'], result['unchanged'])
+        for phase in PHASES + ['other', 'total']:
+            seconds = timing(result, phase)
+            line = "    %-9s %8.3fs" % (phase, seconds)
+            if old is not None:
+                before = timing(old[run], phase)
+                if before is None:
+                    line += "   was        -"
+                else:
+                    line += "   was %8.3fs  %s" % (before, ratio(before, seconds))
+            print line
+
+def timing(result, phase):
+    if phase == 'total':
+        return result['total']
+    return result['phases'].get(phase)
+
+def ratio(before, after):
+    if after <= 0 or before <= 0:
+        return ''
+    return "%.2fx" % (before / after)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "", ["output=", "compare=", "runs=", "memory"])
+    output, compare, runs, memory = None, None, 1, False
+    for option, value in opts:
+        if option == "--output": output = value
+        if option == "--compare": compare = value
+        if option == "--runs": runs = int(value)
+        if option == "--memory": memory = True
+    overrides = dict(arg.split('=', 1) for arg in args)
+    results = benchmark(overrides, runs, memory)
+    old = None
+    if compare:
+        old = json.load(open(compare))
+        if old['settings'] != results['settings'] or old.get('output', 'folder') != results['output']:
+            print >> sys.stderr, "warning: %s was run with different settings" % compare
+    report(results, old)
+    if output:
+        fh = open(output, 'w')
+        json.dump(results, fh, indent=2, sort_keys=True)
+        fh.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+synthetic.py
+
+Writes a synthetic Fargo outline, and the outlines it includes, to a folder
+so fargo2html can be measured on sites of any shape.
+
+    ./bench/synthetic.py folder [name=value ...]
+
+For example
+
+    ./bench/synthetic.py /tmp/site pages=200 years=3 posts=4 glossary=500
+
+Every setting in DEFAULTS can be changed this way. base_url is where the
+folder will be served from, since includes are fetched by URL.
+"""
+
+import sys, os, random, datetime
+from lxml import etree
+
+DEFAULTS = {
+    'pages': 20,        # top level pages
+    'years': 2,         # calendar years in the blog
+    'months': 12,       # months per year
+    'days': 4,          # days per month
+    'posts': 2,         # posts per day
+    'depth': 3,         # nesting depth of a page or post body
+    'fanout': 4,        # children per node in a body
+    'glossary': 50,     # glossary macros
+    'template_kb': 4,   # size of each template
+    'includes': 2,      # included outlines, each with pages/includes pages
+    'seed': 1,
+    'base_url': 'http://127.0.0.1:8000',
+}
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+def settings(**overrides):
+    values = DEFAULTS.copy()
+    for key, value in overrides.items():
+        if key not in DEFAULTS:
+            raise KeyError("unknown setting %s" % key)
+        values[key] = type(DEFAULTS[key])(value)
+    return values
+
+def node(parent, text, **attrs):
+    element = etree.SubElement(parent, 'outline', text=text)
+    for key, value in sorted(attrs.items()):
+        element.set(key, value)
+    return element
+
+def sentence(rand, macros):
+    words = [rand.choice(WORDS) for i in range(rand.randint(4, 12))]
+    if macros and rand.random() < 0.3:
+        words.insert(rand.randint(0, len(words)), rand.choice(macros))
+    return ' '.join(words)
+
+def body(parent, rand, macros, depth, fanout):
+    if depth == 0:
+        return
+    for i in range(fanout):
+        child = node(parent, sentence(rand, macros))
+        # not every node has children, like a real outline
+        if rand.random() < 0.6:
+            body(child, rand, macros, depth - 1, fanout)
+
+def template(parent, name, kb, lines):
+    element = node(parent, name)
+    filler = '<div class="filler">%s</div>' % ' '.join(WORDS)
+    size = sum(len(line) for line in lines)
+    head, tail = lines[:-1], lines[-1:]
+    while size < kb * 1024:
+        head.append(filler)
+        size += len(filler)
+    for line in head + tail:
+        node(element, line)
+
+def document(nodes_parent):
+    opml = etree.Element('opml', version='2.0')
+    head = etree.SubElement(opml, 'head')
+    etree.SubElement(head, 'title').text = 'synthetic'
+    opml.append(nodes_parent)
+    return etree.tostring(opml, xml_declaration=True, encoding='UTF-8')
+
+def makeSite(folder, **overrides):
+    # writes main.opml and includeN.opml to folder; returns the settings used
+    values = settings(**overrides)
+    rand = random.Random(values['seed'])
+    macros = ['<%%macro%d%%>' % i for i in range(values['glossary'])]
+
+    root = etree.Element('body')
+    glossary = node(root, '#glossary')
+    for i, macro in enumerate(macros):
+        # some macros use others, which the glossary has to resolve
+        value = '<span class="m%d">%s</span>' % (i, sentence(rand, macros[:i][-5:]))
+        node(node(glossary, macro), value)
+    # #templates can't directly follow #glossary
+    node(root, '#blogHomeTitle "Synthetic"')
+    templates = node(root, '#templates')
+    kb = values['template_kb']
+    template(templates, 'outline', kb, ['<html><head><title><%pageTitle%></title><%useBootstrap%></head><body>',
+        '<h1><%pageTitle%></h1><p><%pageDescription%></p><%bodytext%></body></html>'])
+    template(templates, 'bloghome', kb, ['<html><head><title><%blogHomeTitle%></title><%rssLink ()%></head><body>',
+        '<h1><%blogHomeTitle%></h1><p><%blogHomeDescription%></p><%bodytext%></body></html>'])
+    for option in ['#rssTitle "Synthetic"', '#feedCount 20', '#domainName example.com', '#bloghomeItemCount 20']:
+        node(root, option)
+
+    for i in range(values['pages']):
+        page = node(root, 'Page %d %s' % (i, rand.choice(WORDS)), pageDescription=sentence(rand, []))
+        body(page, rand, macros, values['depth'], values['fanout'])
+
+    start = datetime.datetime(2013, 1, 1)
+    for y in range(values['years']):
+        year = node(root, str(2013 - y), icon='calendar', name='blog%d' % (2013 - y))
+        for m in range(1, values['months'] + 1):
+            month_name = datetime.date(2013, m, 1).strftime("%B")
+            month = node(year, '%s %d' % (month_name, 2013 - y))
+            for d in range(1, values['days'] + 1):
+                day = node(month, '%s %d' % (month_name, d))
+                for p in range(values['posts']):
+                    created = datetime.datetime(2013 - y, m, d, 8 + p)
+                    post = node(day, 'Post %d %d %d %d' % (2013 - y, m, d, p),
+                                created=created.strftime("%a, %d %b %Y %H:%M:%S GMT"), isFeedItem='true')
+                    body(post, rand, macros, values['depth'] - 1, values['fanout'])
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    per_include = max(1, values['pages'] / max(1, values['includes']))
+    for i in range(values['includes']):
+        name = 'include%d.opml' % i
+        node(root, 'Include %d' % i, type='include', url='%s/%s' % (values['base_url'], name))
+        included = etree.Element('body')
+        for j in range(per_include):
+            page = node(included, 'Included %d %d' % (i, j))
+            body(page, rand, macros, values['depth'], values['fanout'])
+        open(os.path.join(folder, name), 'wb').write(document(included))
+    open(os.path.join(folder, 'main.opml'), 'wb').write(document(root))
+    return values
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        print >> sys.stderr, __doc__
+        return 2
+    overrides = dict(arg.split('=', 1) for arg in argv[1:])
+    values = makeSite(argv[0], **overrides)
+    print "wrote %s/main.opml with %d pages and %d posts" % (argv[0], values['pages'],
+        values['years'] * values['months'] * values['days'] * values['posts'])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
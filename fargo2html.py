@@ -23,10 +23,115 @@ To specify a folder to render to, use
 
     ./fargo2html.py -f/path/to/folder http://dl.dropbox.com/s/ran/myoutline.opml
 
+To parse the outline as it downloads instead of loading it all first, use --stream.
+This keeps memory down for very large outlines and gives the same site. Pages are then
+rendered as they arrive, so one with #glossary, #templates or #blogHomeTitle below it is
+rendered again once the outline is in; putting those first saves the extra work.
+
+    ./fargo2html.py --stream http://dl.dropbox.com/s/ran/myoutline.opml
+
+Includes are downloaded up front, eight at a time over shared connections, or with
+--stream while the outline streams in. To change how many are fetched at once, use
+--fetch-jobs
+
+    ./fargo2html.py --fetch-jobs=16 http://dl.dropbox.com/s/ran/myoutline.opml
+
+To keep a copy of the outline and its includes between runs, use --cache. Later runs
+send conditional requests and only download what changed. If the outline and its includes
+are what the folder was last built from, every file that run wrote is still there (and was
+uploaded and zipped if asked for) and the options that change every page (like --minify or
+-i) are the same, the run stops there with "nothing to do"; --force always renders.
+A new copy is only kept once the site has been built from it, so a run that fails or is
+stopped is built again next time. The cache
+lives in ~/.fargo2html/cache; use --cache-dir=/path/to/cache to put it somewhere else.
+The cache also keeps each outline already parsed, with its glossary and templates, so an
+outline whose bytes have not changed is not parsed again when another one has.
+
+    ./fargo2html.py --cache http://dl.dropbox.com/s/ran/myoutline.opml
+
+Each run leaves a .fargo2html.json manifest in the folder. It records what every
+page and post was built from, so the next run only renders the ones whose outline
+node, template, rules, glossary or settings changed, and only the archive pages whose
+posts changed: editing one post rebuilds just its day, month and year pages and the page
+of the blog home it is listed on. Beside it, .fargo2html.posts keeps
+the listing of every post for the archive pages and the feed, so they are read back from
+disk a page at a time instead of all being held in memory. To render everything anyway,
+use --force
+
+    ./fargo2html.py --force http://dl.dropbox.com/s/ran/myoutline.opml
+
+Files are written as UTF-8, and only when their contents change. To print the path
+of every file that was written, use --changed
+
+    ./fargo2html.py --changed http://dl.dropbox.com/s/ran/myoutline.opml
+
+To render pages, posts and archive pages on several processes at once, use --jobs.
+The output is the same as with one process.
+
+    ./fargo2html.py --jobs=16 http://dl.dropbox.com/s/ran/myoutline.opml
+
+To keep running and rebuild the site whenever the outline or one of its includes changes,
+use --watch. The outline and includes are checked with conditional requests every second,
+or every --interval seconds, and only what changed is rendered again. Stop it with Ctrl-C.
+
+    ./fargo2html.py --watch --interval=5 http://dl.dropbox.com/s/ran/myoutline.opml
+
+To see where a build spends its time, use --stats. It saves a JSON report with the wall
+and CPU time of each phase (fetch, settings, pages, posts, feed, archives, compress,
+manifest, zip and upload), the time spent rendering every page, post and archive with the ten slowest
+of them (or --stats-top of them), how much was downloaded (not what --cache already had),
+how many files were written or left as they were and how many bytes were written, and
+the peak memory. With --stats=- the report is printed instead. --stats-memory also traces
+Python allocations when tracemalloc is available.
+
+    ./fargo2html.py --stats=stats.json --stats-top=20 http://dl.dropbox.com/s/ran/myoutline.opml
+
+To send the site somewhere other than a folder, use --output. --output=tar writes it to
+stdout as a tar archive, each file added as soon as it is rendered, and --output=tar:FILE
+writes the archive to FILE. Names in the archive are relative to the site folder. Nothing is
+read back from a tar, so every page is rendered each time and the manifest is left out of
+it, and --zip, --watch and uploading need a folder. Anything else the build prints goes to stderr.
+
+    ./fargo2html.py --output=tar http://dl.dropbox.com/s/ran/myoutline.opml | tar -x -C /var/www/mysite
+
+The ZIP is updated in place. Files that have not changed since the last ZIP are
+copied over as they are and only new or changed files are compressed, on as many
+threads as --jobs. Files are stored without compression unless you pick a level
+from 1 (fastest) to 9 (smallest) with --zip-level, which implies --zip
+
+    ./fargo2html.py --zip-level=6 http://dl.dropbox.com/s/ran/myoutline.opml
+
+For a static server that can send files already compressed, like nginx with gzip_static,
+use --precompress. Every file written gets a gzipped copy beside it, index.html.gz next to
+index.html, and a brotli one (index.html.br) too when the brotli module is installed. They
+are compressed on as many threads as --jobs while the rest of the site renders, and only
+for files that changed or have no copies yet.
+
+    ./fargo2html.py --precompress http://dl.dropbox.com/s/ran/myoutline.opml
+
+To make pages smaller, use --minify. Comments (other than IE's conditional ones) go, as do
+the indenting and blank lines after every line break, the line breaks and the white space
+between tags in front of block tags like <div> and <p>, and any other run of white space
+between two tags comes down to one space. Whatever is inside <pre>, <script>, <style> and <textarea> is left
+as it is. Each run prints how many bytes of HTML it minified and how much smaller they got,
+and --stats reports the same. Turning it on or off renders every page again once.
+
+    ./fargo2html.py --minify --precompress http://dl.dropbox.com/s/ran/myoutline.opml
+
+For big outlines whose nodes start collapsed, use --lazy to keep the collapsed parts out of
+the page. The hidden subtree of every node at that level or deeper (1 is the top level of a
+page) is written to its own file beside the page, named after the page and the node's ec-id
+(aboutMe.T12.html), and is loaded the first time the node is expanded. --lazy-size does the same
+for hidden subtrees with at least that many nodes in them, at any level. Only pages are split,
+not posts, since their text also goes into the archive pages and the feed. Turning either on
+or off renders every page again once.
+
+    ./fargo2html.py --lazy=2 --lazy-size=200 http://dl.dropbox.com/s/ran/myoutline.opml
+
 To upload to S3
     ./fargo2html.py --us3 -f/path/to/folder http://dl.dropbox.com/s/ran/myoutline.opml
 
-This will upload to a bucket named folder for the default s3 profile. NOTE: Requires folder2s3.py and boto and a valid boto config file. See the readme for folder2s3.py for more info.
+This will upload to a bucket named folder for the default s3 profile. NOTE: Requires boto and a valid boto config file.
 
 To specify a profile and/or bucket use ...
 
@@ -34,25 +139,70 @@ To specify a profile and/or bucket use ...
 
 This will upload to bucket mybucket for profile me.
 
+Files are uploaded while the rest of the site is still rendering, as soon as each one
+is written, four at a time. To change how many are uploaded at once, use --upload-jobs.
+To upload to an S3-compatible server instead of Amazon, give its address with --s3endpoint
+
+    ./fargo2html.py --upload-jobs=16 --s3endpoint=http://localhost:9000 -bmybucket http://dl.dropbox.com/s/ran/myoutline.opml
+
+To copy the site into another folder instead, like a web server's document root, use
+
+    ./fargo2html.py --upload=folder:/var/www/mysite http://dl.dropbox.com/s/ran/myoutline.opml
+
 NOTES:
 * -us3 is not necessary when specifying either a bucket of profile.
 * If you specify a bucket or profile along with a different upload method ( which are not supported yet ), s3 will be assumed.
-* Only files newer than on S3 will be uploaded. To change this behavior, you have three options
+* Only files that changed since they were last uploaded will be uploaded. The manifest in the folder keeps track of what was uploaded. To upload everything again, either
 1. Delete the local folder before you start.
-2. Empty the S3 bucket before you start
-3. Don't use the S3 option and then call folder2s3.upload() yourself with a replaceAll=True
+2. Use --force
 
 
 """
 
-import sys, os, shutil, getopt, re, datetime, random, errno, itertools, operator
-import opml, requests, zipfile, PyRSS2Gen
+import sys, os, shutil, getopt, re, datetime, time, random, errno, itertools, operator, hashlib, json, heapq, bisect
+import zlib, struct, threading, mimetypes, urlparse, StringIO, signal, resource, array, marshal, sqlite3, tempfile
+import opml, requests, zipfile, tarfile, gzip, PyRSS2Gen, multiprocessing
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from multiprocessing.pool import ThreadPool
+from lxml import etree
 from ConfigParser import ConfigParser
 
 DEBUG = False
 
+# how many outlines (the main one and its includes) are downloaded at once
+FETCH_JOBS = 8
+UPLOAD_JOBS = 4
+
+# kept in the output folder to tell which pages and posts need rendering;
+# bump the version whenever a change alters rendered output
+MANIFEST_NAME = ".fargo2html.json"
+MANIFEST_VERSION = "5"
+# and beside it, the listing of every post (see PostStore)
+POSTS_NAME = ".fargo2html.posts"
+# what --precompress adds to a file's name for its compressed copies
+SIDECARS = (".gz", ".br")
+
+# where --cache keeps the last copy of each outline
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".fargo2html", "cache")
+# and the parsed copy (see ParsedOutline); bump the version whenever what it
+# keeps changes. It holds nodes down to UNIT_DEPTH, which reaches the posts
+# of a blog kept under a top level node.
+PARSED_VERSION = "1"
+UNIT_DEPTH = 4
+
 MONTHS = dict([(datetime.date(2013,i,1).strftime("%B"),"%02d" % i) for i in range(1,13)])
 
+TOKEN = re.compile('<%([^%<>]*)%>')
+# what a glossary macro may grow to once the macros it uses are expanded
+GLOSSARY_LIMIT = 1024 * 1024
+
 DEFAULT_RULES = [
     None,
     {
@@ -139,6 +289,10 @@ class Usage(Exception):
     def __init__(self, msg):
         self.message = msg
 
+class NothingToDo(Exception):
+    def __init__(self, msg):
+        self.message = msg
+
 class Ruleset(object):
     def __init__(self,rules):
         self.rules = rules
@@ -188,12 +342,160 @@ def mkdir_p(path):
             pass
         else: raise
 
+def stronglyConnected(graph):
+    # Tarjan's algorithm, without recursion so long chains of macros are
+    # fine. graph maps each key to the keys it has edges to; the groups come
+    # back as lists, each after every group it has edges to.
+    index, low, stack, on_stack, groups = {}, {}, [], set(), []
+    def visit(key):
+        index[key] = low[key] = len(index)
+        stack.append(key)
+        on_stack.add(key)
+        return (key, iter(sorted(graph[key])))
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [visit(root)]
+        while work:
+            key, edges = work[-1]
+            for child in edges:
+                if child not in index:
+                    work.append(visit(child))
+                    break
+                if child in on_stack:
+                    low[key] = min(low[key], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[key])
+                if low[key] == index[key]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == key:
+                            break
+                    groups.append(group)
+    return groups
+
+class Glossary(object):
+    # All glossary keys are folded into one alternation so a page is expanded
+    # in a single scan instead of one re.sub per key. Longer keys are tried
+    # first so "<%rssLink ()%>" wins over any key that is a prefix of it.
+    def __init__(self, glossary):
+        self.values = dict(glossary)
+        keys = [re.escape(k) for k in sorted(self.values, key=lambda k: (-len(k), k))]
+        if keys:
+            self.pattern = re.compile('|'.join(keys))
+        else:
+            self.pattern = None
+        # same scan, but also stops on any other <%token%> so per-page values
+        # like <%BRAND%> can be filled in without another pass
+        self.token_pattern = re.compile('|'.join(keys + [TOKEN.pattern]))
+        self.values = self.resolve()
+        self.digest = hashlib.sha1(json.dumps(sorted(self.values.items()))).hexdigest()
+
+    def resolve(self):
+        # Macros may use other macros, so each is expanded here once, after
+        # the ones it uses, rather than relying on the order the keys happen
+        # to be substituted in. One that uses itself, directly or through
+        # others, or would grow past GLOSSARY_LIMIT is left as it is, and so
+        # are the uses of it in other macros. Resolving the result again
+        # gives the same values.
+        if self.pattern is None:
+            return self.values
+        uses = dict((k, set(self.pattern.findall(v))) for k, v in self.values.items())
+        resolved, kept = {}, set()
+        def lookup(m):
+            token = m.group(0)
+            if token in kept:
+                return token
+            return resolved[token]
+        for group in stronglyConnected(uses):
+            key = group[0]
+            if len(group) > 1 or key in uses[key]:
+                kept.update(group)
+                for key in group:
+                    resolved[key] = self.values[key]
+                continue
+            value = self.pattern.sub(lookup, self.values[key])
+            if len(value) > GLOSSARY_LIMIT:
+                kept.add(key)
+                value = self.values[key]
+            resolved[key] = value
+        return resolved
+
+    def expand(self, d, extra=None):
+        values = self.values
+        if extra:
+            filled = {}
+            def fill(m):
+                return extra.get(m.group(0), m.group(0))
+            def lookup(m):
+                token = m.group(0)
+                if token in values:
+                    # macros such as a navbar can hold <%BRANDMENU%> themselves
+                    if token not in filled:
+                        filled[token] = TOKEN.sub(fill, values[token])
+                    return filled[token]
+                return extra.get(token, token)
+            return self.token_pattern.sub(lookup, d)
+        if self.pattern is None:
+            return d
+        return self.pattern.sub(lambda m: values[m.group(0)], d)
+
+    def updated(self, glossary):
+        values = self.values.copy()
+        values.update(glossary)
+        return Glossary(values)
+
+class Template(object):
+    # A template is split once into literal text and <%name%> slots, so
+    # filling it in for a page is a single join. Slots without a value are
+    # left as they are for the glossary pass.
+    def __init__(self, text):
+        self.text = text
+        self.segments = TOKEN.split(text)
+        self.slots = [(i, self.segments[i]) for i in range(1, len(self.segments), 2)]
+        for i, name in self.slots:
+            self.segments[i] = '<%%%s%%>' % name
+
+    def render(self, values):
+        parts = self.segments[:]
+        for i, name in self.slots:
+            if name in values:
+                parts[i] = values[name]
+        return ''.join(parts)
+
+# compiled templates and glossaries by their source, shared by every site
+# built in this process and by the processes it forks
+COMPILED = {}
+
+def compileTemplate(text):
+    key = ('template', text)
+    if key not in COMPILED:
+        COMPILED[key] = Template(text)
+    return COMPILED[key]
+
+def compileGlossary(values):
+    key = ('glossary', hashlib.sha1(json.dumps(sorted(values.items()))).hexdigest())
+    if key not in COMPILED:
+        COMPILED[key] = Glossary(values)
+    return COMPILED[key]
+
+def brandValues(brand, brandLink):
+    return {
+        '<%BRANDMENU%>': '<a class="brand" href="%s">%s</a>' % (brandLink, brand),
+        '<%BRAND%>': brand,
+        '<%BRANDLINK%>': brandLink
+    }
+
 def subData(d,glossary):
-    for k,v in glossary.items():
-        k = re.sub('\(','\\(',k)
-        k = re.sub('\)','\\)',k)
-        d = re.sub(k,v,d)
-    return d
+    if not isinstance(glossary, Glossary):
+        glossary = Glossary(glossary)
+    return glossary.expand(d)
 
 def removePunc(data):
     for punc in '!:&/#,"':
@@ -203,7 +505,8 @@ def removePunc(data):
     return data
 
 def processRules(template_rules,specific_rules):
-    rules = DEFAULT_RULES[:]
+    # copy the defaults, changing them in place leaks rules into later pages
+    rules = [None] + [r.copy() for r in DEFAULT_RULES[1:]]
     for ruleset in [template_rules,specific_rules]:
         if ruleset:
             rules_to_change = [0,0]
@@ -230,11 +533,138 @@ def processRules(template_rules,specific_rules):
     return Ruleset(rules)
 
 
-def grabData(outline,base_rules=None,format=''):
+# added to a page with subtrees split out of it (see emitOutline). The
+# first click on a header starts loading its div's data-src, before the
+# outliner's own handler shows the div.
+LAZY_SCRIPT = """
+<script>document.addEventListener('click', function (e) { for (var p = e.target; p && p.getAttribute; p = p.parentNode) { var id = p.getAttribute('ec-id'); if (id) { var div = document.getElementById(id), src = div && div.getAttribute('data-src'); if (src) { div.removeAttribute('data-src'); var xhr = new XMLHttpRequest(); xhr.open('GET', src); xhr.onload = function () { if (xhr.status == 200) div.innerHTML = xhr.responseText; else div.setAttribute('data-src', src); }; xhr.onerror = function () { div.setAttribute('data-src', src); }; xhr.send(); } return; } } }, true);</script>
+"""
+
+# formatted fragments by (format, ruleset), see outlineFragments
+FRAGMENTS = {}
+
+def outlineFragments(format, rule):
+    key = (format, tuple(sorted((k, v) for k, v in rule.items() if k != 'ID')))
+    if key not in FRAGMENTS:
+        f = FORMATS[format]
+        # ec-id changes for every node so split the header around it
+        header = f['list_header_open'] % dict(rule, ID='\0')
+        FRAGMENTS[key] = {
+            'header': header.split('\0', 1),
+            'header_close': f['list_header_close'],
+            'list_open': f['list_open'] % rule,
+            'list_close': "%s\n%s" % (f['list_close'] % rule, "</div>"),
+            # the same without the hidden div's close, for a split out subtree
+            'list_end': f['list_close'] % rule,
+            'item_open': f['item_open'] % rule,
+            'item_close': f['item_close'],
+            'show': 'show' if rule['expanded'] else 'hide',
+        }
+    return FRAGMENTS[key]
+
+def outlineNodes(outline):
+    # every descendant with its level, in one walk of the tree
+    nodes, level = [], 0
+    for event, node in etree.iterwalk(outline._root, events=('start', 'end')):
+        if event == 'end':
+            level -= 1
+        else:
+            if level:
+                nodes.append((level, node))
+            level += 1
+    return nodes
+
+def subtreeSizes(nodes):
+    # how many nodes are under each of nodes, by index, worked out in one
+    # pass: a node's subtree ends where the next node at its level or above is
+    sizes, opened = [0] * len(nodes), []
+    for i, (level, node) in enumerate(nodes):
+        while opened and nodes[opened[-1]][0] >= level:
+            start = opened.pop()
+            sizes[start] = i - start - 1
+        opened.append(i)
+    for start in opened:
+        sizes[start] = len(nodes) - start - 1
+    return sizes
+
+def emitOutline(nodes, rules, format, end=0, lazy=None, split=None):
+    # With lazy, a (depth, size, prefix) triple, a hidden subtree whose node
+    # is at depth or deeper, or has at least size nodes under it, is left out
+    # of the page and added to split as (ec-id, html). Its div is left empty
+    # with prefix + ec-id + .html as its data-src, to be loaded on expand.
+    # A split out subtree keeps everything under it.
+    yield FORMATS[format]['body_open'] % rules[1]
+    yield FORMATS[format]['list_open'] % rules[1]
+    fragments = {}
+    opened = []
+    sizes = None
+    if lazy and lazy[1]:
+        sizes = subtreeSizes(nodes)
+    # the subtree being split out, as (level, ec-id, its html so far)
+    held = None
+    for i, (level, node) in enumerate(nodes):
+        try:
+            if node.get('type')== 'link':
+                    if '<a' not in node.get('text'):
+                        node.set('text','<a href="%s">%s</a>' % (node.get('url'), node.get('text')))
+        except:
+            pass
+        if i < end: continue
+        if level not in fragments:
+            fragments[level] = outlineFragments(format, rules[level])
+        f = fragments[level]
+        tabs = level * "\t"
+        while opened and opened[-1] >= level:
+            closed = opened.pop()
+            if held and held[0] == closed:
+                held[2].append(2 * closed * "\t" + fragments[closed]['list_end'])
+                split.append((held[1], ''.join(held[2])))
+                held = None
+            elif held:
+                held[2].append(2 * closed * "\t" + fragments[closed]['list_close'])
+            else:
+                yield 2 * closed * "\t" + fragments[closed]['list_close']
+        if len(node) > 0:
+            ec_id = "T%s" % i
+            header = "%s%s%s%s%s%s" % (tabs, f['header'][0], ec_id, f['header'][1], node.get('text'), f['header_close'])
+            if held:
+                held[2].extend([header, '''<div class="%s" id="%s" name="%s">''' % (f['show'], ec_id, ec_id), tabs + f['list_open']])
+            elif lazy and f['show'] == 'hide' and ((lazy[0] and level >= lazy[0]) or (sizes and sizes[i] >= lazy[1])):
+                yield header
+                yield '''<div class="hide" id="%s" name="%s" data-src="%s%s.html"></div>''' % (ec_id, ec_id, lazy[2], ec_id)
+                held = (level, ec_id, [tabs + f['list_open']])
+            else:
+                yield header
+                yield '''<div class="%s" id="%s" name="%s">''' % (f['show'], ec_id, ec_id)
+                yield tabs + f['list_open']
+            opened.append(level)
+        else:
+            item = "%s%s%s%s" % (tabs, f['item_open'], node.get('text'), f['item_close'])
+            if held:
+                held[2].append(item)
+            else:
+                yield item
+    # whatever is still open is closed outermost first
+    if held:
+        inner = [closed for closed in opened if closed >= held[0]]
+        opened = opened[:len(opened) - len(inner)]
+        for closed in inner:
+            held[2].append(closed * "\t" + fragments[closed]['list_end' if closed == held[0] else 'list_close'])
+        split.append((held[1], ''.join(held[2])))
+    for closed in opened:
+        yield closed * "\t" + fragments[closed]['list_close']
+    yield FORMATS[format]['body_close'] % rules[1]
+
+def grabData(outline,base_rules=None,format='',lazy=None,split=None):
     global DEBUG
     if len(outline) == 0:
+        # a page with nothing under it, like an include that could not be
+        # fetched, has no rules and an empty body
+        if format:
+            return [], []
         return []
-    data = [node.get('text') for node in outline._root.iterdescendants()]
+    nodes = outlineNodes(outline)
+    data = [node.get('text') for level, node in nodes]
     if '<rules>' in data:
         start,end = data.index('<rules>'),data.index('</rules>')
         rules = data[start+1:end]
@@ -248,53 +678,575 @@ def grabData(outline,base_rules=None,format=''):
             content = data
     else:
         rules = processRules(base_rules,rules)
-        level = 1
-        closings = [None]
-        content = [FORMATS[format]['body_open'] % rules[level],FORMATS[format]['list_open'] % rules[level]]
-        for i,node in enumerate(outline._root.iterdescendants()):
-            try:
-                if node.get('type')== 'link':
-                        if '<a' not in node.get('text'):
-                            node.set('text','<a href="%s">%s</a>' % (node.get('url'), node.get('text')))
-            except:
-                pass
-            if i < end: continue
-            count = len(node)
-            for c in range(level):
-                closing = closings.pop()
-                if closing is not None:
-                    level -= 1
-                    try:
-                        this_closing = level*"\t" + closing % rules[level]
-                    except:
-                        this_closing = level*"\t" + closing
-                    content.append(this_closing)
-            if count > 0:
-                rules[level]['ID'] = "T%s" % i
-                content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['list_header_open'] % rules[level], node.get('text'), FORMATS[format]['list_header_close']))
-                if rules[level]['expanded']:
-                    show = 'show'
-                else:
-                    show = 'hide'
-                content.append('''<div class="%s" id="T%s" name="T%s">''' % (show, i, i)) #'recommendedBloggingT86928'
-                content.append(level*"\t" + FORMATS[format]['list_open'] % rules[level])
-                closings.append(level*"\t" + "%s\n%s" % (FORMATS[format]['list_close'] % rules[level], "</div>"))
-                for c in range(count*level):
-                    closings.append(None)
-                if count: closings.append(None)
-                level += 1
-            else:
-                content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['item_open'] % rules[level], node.get('text'), FORMATS[format]['item_close']))
-                closings.append(None)
-        for closing in closings:
-            if closing:
-                content.append(closing)
-        content.append(FORMATS[format]['body_close'] % rules[level])
+        content = list(emitOutline(nodes, rules, format, end, lazy, split))
     return rules, content
 
 def grabChildren(outline):
     return dict([(node.text,grabData(node)) for node in outline])
 
+def readGlossary(outline):
+    return dict([(k, ''.join(v[1])) for k, v in grabChildren(outline).items()])
+
+def readTemplates(outline):
+    return dict([(k, (v[0], compileTemplate(''.join(v[1])))) for k, v in grabChildren(outline).items()])
+
+def readSettings(outline):
+    # Pulls #glossary and #templates out of a fetched outline and applies the
+    # glossary options. Returns the glossary values and the templates.
+    glossary, templates = DEFAULT_GLOSSARY.copy(), {}
+    for i, node in enumerate(outline):
+        if node.text == '#glossary':
+            glossary.update(readGlossary(outline.pop(i)))
+        elif node.text == '#templates':
+            templates.update(readTemplates(outline.pop(i)))
+        else:
+            first_word = node.text.split(' ')[0]
+            if first_word in GLOSSARY_OPTIONS:
+                glossary.update(GLOSSARY_FUNCTIONS[first_word](node.text))
+    return glossary, templates
+
+def makeSession(jobs=FETCH_JOBS):
+    # one keep-alive connection pool per host, big enough for every fetcher
+    jobs = max(1, jobs)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class OutlineCache(object):
+    # Keeps the last copy of every outline it has fetched, along with the
+    # ETag and Last-Modified headers that came with it, so the next fetch can
+    # be a conditional GET. changed collects the URLs whose content differed
+    # from the cached copy since the last reset(), and served those that came
+    # from the cached copy without being downloaded. A copy that changed is
+    # only staged beside the old one until commit(), once the site has been
+    # built from it, so a build that fails is built again next time.
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder
+        mkdir_p(folder)
+        self.reset()
+
+    def reset(self):
+        self.changed = set()
+        self.fetched = set()
+        self.served = set()
+        self.outlines = []
+
+    def commit(self):
+        # puts the staged copy of everything fetched since reset() in place
+        for url in self.fetched:
+            for path in self.paths(url):
+                if os.path.exists(path + ".new"):
+                    os.rename(path + ".new", path)
+
+    def paths(self, url):
+        key = os.path.join(self.folder, hashlib.sha1(url).hexdigest())
+        return key + ".opml", key + ".json"
+
+    def parsed(self, url, content):
+        # what storeParsed() kept for url, if it was kept for this content
+        path = os.path.join(self.folder, hashlib.sha1(url).hexdigest() + ".parsed")
+        try:
+            entry = marshal.load(open(path, "rb"))
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        if entry.get('key') != parsedKey(content):
+            return None
+        return entry
+
+    def storeParsed(self, url, content, entry):
+        path = os.path.join(self.folder, hashlib.sha1(url).hexdigest() + ".parsed")
+        entry['key'] = parsedKey(content)
+        fh = open(path + ".tmp", "wb")
+        marshal.dump(entry, fh)
+        fh.close()
+        os.rename(path + ".tmp", path)
+
+    def saveParsed(self):
+        # keeps the outlines read since the last reset(), with any digests
+        # worked out for them along the way
+        for outline in self.outlines:
+            if outline.dirty:
+                self.storeParsed(outline.url, outline.content, outline.entry)
+                outline.dirty = False
+
+    def headers(self, url):
+        body_path, meta_path = self.paths(url)
+        headers = {}
+        if os.path.exists(body_path) and os.path.exists(meta_path):
+            try:
+                meta = json.load(open(meta_path))
+            except ValueError:
+                meta = {}
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last-modified'):
+                headers['If-Modified-Since'] = meta['last-modified']
+        return headers
+
+    def store(self, url, response, temp_path):
+        body_path, meta_path = self.paths(url)
+        old_digest = None
+        if os.path.exists(body_path):
+            old_digest = fileDigest(body_path)
+        new_digest = fileDigest(temp_path)
+        # the same copy with new headers can go straight in
+        suffix = ""
+        if old_digest != new_digest:
+            suffix = ".new"
+            self.changed.add(url)
+        else:
+            for path in (body_path, meta_path):
+                if os.path.exists(path + ".new"):
+                    os.remove(path + ".new")
+        os.rename(temp_path, body_path + suffix)
+        meta = {'etag': response.headers.get('etag'), 'last-modified': response.headers.get('last-modified')}
+        fh = open(meta_path + ".tmp", "w")
+        json.dump(meta, fh)
+        fh.close()
+        os.rename(meta_path + ".tmp", meta_path + suffix)
+
+    def fetch(self, url, session=requests):
+        self.fetched.add(url)
+        body_path, meta_path = self.paths(url)
+        response = session.get(url, headers=self.headers(url))
+        if response.status_code == 304:
+            self.served.add(url)
+            return open(body_path, 'rb').read()
+        content = response.content
+        if response.status_code == 200:
+            temp_path = "%s.%s.tmp" % (body_path, os.getpid())
+            fh = open(temp_path, 'wb')
+            fh.write(content)
+            fh.close()
+            self.store(url, response, temp_path)
+        else:
+            self.changed.add(url)
+        return content
+
+    def open(self, url, session=requests):
+        # same as fetch, but hands back a file to parse as it is read; a new
+        # body is copied into the cache on the way through
+        self.fetched.add(url)
+        body_path, meta_path = self.paths(url)
+        response = session.get(url, headers=self.headers(url), stream=True)
+        if response.status_code == 304:
+            self.served.add(url)
+            return open(body_path, 'rb')
+        response.raw.decode_content = True
+        if response.status_code != 200:
+            self.changed.add(url)
+            return response.raw
+        return CachingReader(self, url, response)
+
+def parsedKey(content):
+    return hashlib.sha1(PARSED_VERSION + content).hexdigest()
+
+def flattenNode(elem, depth=0):
+    # an outline node as [attributes, digest, children], see CachedNode. The
+    # digest is filled in when it is first asked for.
+    children = None
+    if depth < UNIT_DEPTH:
+        children = [flattenNode(child, depth + 1) for child in elem.iterchildren('outline')]
+    return [tuple(elem.items()), None, children]
+
+def nodeDigest(node):
+    if isinstance(node, CachedNode):
+        return node.digest()
+    return hashlib.sha1(etree.tostring(node._root)).hexdigest()
+
+def nodeItems(node):
+    if isinstance(node, CachedNode):
+        return list(node.record[0])
+    return node._root.items()
+
+def nodeElement(node):
+    # something the renderer can take
+    if isinstance(node, CachedNode):
+        return node.element()
+    return node
+
+class CachedNode(object):
+    # An outline node read back from the parsed copy in the cache. parse()
+    # walks it like an opml.OutlineElement, its attributes looked up and
+    # its children wrapped as they are asked for, but the outline's XML is
+    # only parsed if the node has to be rendered or goes below UNIT_DEPTH.
+    __slots__ = ('record', 'outline', 'path')
+
+    def __init__(self, record, outline, path):
+        self.record, self.outline, self.path = record, outline, path
+
+    def __getattr__(self, attr):
+        for key, value in self.record[0]:
+            if key == attr:
+                return value
+        raise AttributeError(attr)
+
+    def __len__(self):
+        if self.record[2] is None:
+            return len(self.element())
+        return len(self.record[2])
+
+    def __getitem__(self, index):
+        children = self.record[2]
+        if children is None:
+            return self.element()[index]
+        if index < 0:
+            index += len(children)
+        return CachedNode(children[index], self.outline, self.path + (index,))
+
+    def digest(self):
+        if self.record[1] is None:
+            self.record[1] = nodeDigest(self.element())
+            self.outline.dirty = True
+        return self.record[1]
+
+    def element(self):
+        return self.outline.element(self.path)
+
+class ParsedOutline(object):
+    # The top level nodes of an outline and, for the main one, its glossary
+    # and templates, kept in the cache by URL and used as long as the
+    # outline's bytes are the same. The XML is parsed for the first node
+    # that needs it, if any. dirty is set until the entry has been saved.
+    def __init__(self, url, content, entry, parsed=None):
+        self.url, self.content, self.entry = url, content, entry
+        self.parsed = parsed
+        self.dirty = parsed is not None
+
+    def nodes(self):
+        return [CachedNode(record, self, (i,)) for i, record in enumerate(self.entry['nodes'])]
+
+    def element(self, path):
+        if self.parsed is None:
+            self.parsed = list(opml.from_string(self.content))
+        node = self.parsed[path[0]]
+        for index in path[1:]:
+            node = node[index]
+        return node
+
+def readOutline(url, content, cache=None):
+    # the top level nodes of an include, from the cache's parsed copy when
+    # it has one for these bytes
+    if cache is None:
+        return list(opml.from_string(content))
+    entry = cache.parsed(url, content)
+    if entry is not None:
+        outline = ParsedOutline(url, content, entry)
+    else:
+        parsed = list(opml.from_string(content))
+        outline = ParsedOutline(url, content, {'nodes': [flattenNode(node._root) for node in parsed]}, parsed)
+    cache.outlines.append(outline)
+    return outline.nodes()
+
+def readMainOutline(url, content, cache=None):
+    # The top level nodes of the main outline less #glossary and #templates,
+    # with the glossary values and templates readSettings() found in them.
+    # Kept in the cache like an include.
+    if cache is not None:
+        entry = cache.parsed(url, content)
+        if entry is not None and 'settings' in entry:
+            glossary, templates, remaining = entry['settings']
+            outline = ParsedOutline(url, content, entry)
+            cache.outlines.append(outline)
+            nodes = outline.nodes()
+            templates = dict((key, (rules, compileTemplate(text))) for key, (rules, text) in templates.items())
+            return [nodes[i] for i in remaining], glossary, templates
+    parsed = list(opml.from_string(content))
+    outline = list(parsed)
+    glossary, templates = readSettings(outline)
+    if cache is None:
+        return outline, glossary, templates
+    positions = dict((id(node), i) for i, node in enumerate(parsed))
+    remaining = [positions[id(node)] for node in outline]
+    texts = dict((key, (rules, template.text)) for key, (rules, template) in templates.items())
+    entry = {'nodes': [flattenNode(node._root) for node in parsed], 'settings': (glossary, texts, remaining)}
+    outline = ParsedOutline(url, content, entry, parsed)
+    cache.outlines.append(outline)
+    nodes = outline.nodes()
+    return [nodes[i] for i in remaining], glossary, templates
+
+class CachingReader(object):
+    def __init__(self, cache, url, response):
+        self.cache, self.url, self.response = cache, url, response
+        self.temp_path = "%s.%s.tmp" % (cache.paths(url)[0], os.getpid())
+        self.fh = open(self.temp_path, 'wb')
+
+    def read(self, size=-1):
+        data = self.response.raw.read(size)
+        if data:
+            self.fh.write(data)
+        elif self.fh is not None:
+            self.fh.close()
+            self.fh = None
+            self.cache.store(self.url, self.response, self.temp_path)
+        return data
+
+def fileDigest(path):
+    digest = hashlib.sha1()
+    fh = open(path, 'rb')
+    for block in iter(lambda: fh.read(65536), ''):
+        digest.update(block)
+    fh.close()
+    return digest.hexdigest()
+
+def sourcesDigest(content, includes):
+    # what a site is built from: its outline and every include, with None
+    # for one that could not be fetched
+    digest = hashlib.sha1(content)
+    for url in sorted(includes):
+        include = includes[url]
+        if include is not None:
+            include = hashlib.sha1(include).hexdigest()
+        digest.update(json.dumps([url, include]))
+    return digest.hexdigest()
+
+def outlineUrl(url):
+    url = re.sub('www','dl',url)
+    if 'usercontent' not in url:
+        url = re.sub('dropbox','dropboxusercontent', url)
+    return url
+
+# outlines and includes fetched once for several sites, see prefetch
+PREFETCHED = {}
+
+def fetchOutline(url, session=requests, cache=None):
+    shared = PREFETCHED.get((cache and cache.folder, url))
+    if shared is not None:
+        content, changed = shared
+        if cache is not None:
+            cache.fetched.add(url)
+            # downloaded by whoever shared it, if at all
+            cache.served.add(url)
+            if changed:
+                cache.changed.add(url)
+        return content
+    if cache is not None:
+        return cache.fetch(url, session)
+    return session.get(url).content
+
+def prefetch(sites, jobs=FETCH_JOBS):
+    # Fetches the outline of every site, then every include in them, once
+    # however many sites share it, keyed by cache folder and URL so each
+    # cache still sees its own changes. Templates and glossaries are
+    # compiled on the way so sites forked after this start with them.
+    session = makeSession(jobs)
+    def fetch(key):
+        cache_dir, url = key
+        cache = None
+        if cache_dir:
+            cache = OutlineCache(cache_dir)
+        try:
+            content = fetchOutline(url, session, cache)
+        except Exception:
+            return key, None
+        return key, (content, cache is None or url in cache.changed)
+    def fetchAll(keys):
+        if not keys:
+            return
+        pool = ThreadPool(max(1, min(jobs, len(keys))))
+        try:
+            for key, result in pool.map(fetch, keys):
+                if result is not None:
+                    PREFETCHED[key] = result
+        finally:
+            pool.close()
+
+    outlines = []
+    for settings in sites:
+        # streamed sites are read as they download instead
+        if settings.get('stream'):
+            continue
+        key = (cacheFolder(settings.get('cache')), outlineUrl(settings['url']))
+        if key not in outlines:
+            outlines.append(key)
+    fetchAll(outlines)
+    includes = []
+    for cache_dir, url in outlines:
+        if (cache_dir, url) not in PREFETCHED:
+            continue
+        try:
+            outline = list(opml.from_string(PREFETCHED[(cache_dir, url)][0]))
+        except Exception:
+            continue
+        for include in includeUrls(outline):
+            if (cache_dir, include) not in includes:
+                includes.append((cache_dir, include))
+        glossary, templates = readSettings(outline)
+        compileGlossary(glossary)
+    fetchAll(includes)
+
+def includeUrl(node):
+    real_url = re.sub('dropbox','dropboxusercontent',node.url)
+    return re.sub('https','http',real_url)
+
+def includeUrls(outline):
+    urls = []
+    for node in outline:
+        try:
+            if node.type == 'include' and includeUrl(node) not in urls:
+                urls.append(includeUrl(node))
+        except AttributeError:
+            pass
+    return urls
+
+def fetchIncludes(outline, session, jobs=FETCH_JOBS, cache=None):
+    # Fetch every include in the outline at once rather than one at a time
+    # as the render loop reaches them. A failed fetch maps to None and the
+    # node is rendered like any other, as before.
+    urls = includeUrls(outline)
+    if not urls:
+        return {}
+    def fetch(url):
+        try:
+            return fetchOutline(url, session, cache)
+        except Exception:
+            return None
+    pool = ThreadPool(max(1, min(jobs, len(urls))))
+    try:
+        return dict(zip(urls, pool.map(fetch, urls)))
+    finally:
+        pool.close()
+
+def prefetchIncludes(nodes, session, jobs=FETCH_JOBS, cache=None):
+    # The --stream side of fetchIncludes: yields (position, node, include)
+    # for each top level node, include being the fetched outline of an
+    # include node (None if the fetch failed) and None for anything else.
+    # Includes are fetched jobs at a time while the outline goes on
+    # streaming in, and each is yielded as soon as it is in, so a slow one
+    # does not hold up the nodes after it.
+    def fetch(url):
+        try:
+            return fetchOutline(url, session, cache)
+        except Exception:
+            return None
+    pool = ThreadPool(max(1, jobs))
+    pending = []
+    try:
+        for position, node in enumerate(nodes):
+            try:
+                is_include = node.type == 'include'
+            except AttributeError:
+                is_include = False
+            if is_include:
+                pending.append((position, node, pool.apply_async(fetch, (includeUrl(node),))))
+            else:
+                yield position, node, None
+            for fetched in [fetched for fetched in pending if fetched[2].ready()]:
+                pending.remove(fetched)
+                yield fetched[0], fetched[1], fetched[2].get()
+        for position, node, result in pending:
+            yield position, node, result.get()
+    finally:
+        pool.close()
+
+def openOutline(url, session=requests, cache=None):
+    if (cache and cache.folder, url) in PREFETCHED:
+        return StringIO.StringIO(fetchOutline(url, session, cache))
+    if cache is not None:
+        return cache.open(url, session)
+    response = session.get(url, stream=True)
+    response.raw.decode_content = True
+    return response.raw
+
+class CountingReader(object):
+    # passes reads through, adding how much came back to stats unless it
+    # was not received, being the cached copy
+    def __init__(self, source, stats, received=True):
+        self.source, self.stats, self.received = source, stats, received
+        stats.sources += 1
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if self.received:
+            self.stats.fetched += len(data)
+        return data
+
+def streamOutline(source):
+    # Yields each top level outline node as soon as its closing tag has been
+    # parsed, then drops it from the tree so only the node being rendered
+    # (and anything the caller keeps, like calendars) stays in memory.
+    depth = 0
+    for event, elem in etree.iterparse(source, events=('start', 'end'), tag='outline'):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield opml.OutlineElement(elem)
+            parent = elem.getparent()
+            if parent is not None:
+                parent.remove(elem)
+
+class BottomUp(object):
+    # --stream reads the outline from the top down, but it has always been
+    # rendered from the bottom up (each include from its own top down) and
+    # the site has to come out the same. So the top-most value of an option
+    # is the one that stands, a page sees the blogHomeTitle set below it,
+    # the top-most of two pages with one name is kept and calendars are
+    # added bottom first. Each is settled by where its node sits, its top
+    # level position and its place in an include, not by when it arrives.
+    def __init__(self):
+        self.options = {}
+        self.titles = {}
+        self.positions = None
+        self.pages = {}
+        self.calendars = []
+
+    def option(self, position, place, key, value, options):
+        # sets options[key] unless a node that stands over it already has
+        order = (-position, place)
+        if key not in self.options or self.options[key] < order:
+            self.options[key] = order
+            options[key] = value
+        if key == 'blogHomeTitle' and self.titles.get(position, (-1,))[0] < place:
+            self.titles[position] = (place, value)
+            self.positions = None
+
+    def title(self, position, default):
+        # the blogHomeTitle a page at position sees from the nodes below it
+        if self.positions is None:
+            self.positions = sorted(self.titles)
+        i = bisect.bisect_right(self.positions, position)
+        if i == len(self.positions):
+            return default
+        return self.titles[self.positions[i]][1]
+
+    def keep(self, name, position, place):
+        # whether this is the page named name to keep, of those seen so far
+        order = (-position, place)
+        if self.pages.get(name, order) > order:
+            return False
+        self.pages[name] = order
+        return True
+
+    def calendar(self, position, place, args):
+        self.calendars.append(((-position, place), args))
+
+    def orderedCalendars(self):
+        return [args for order, args in sorted(self.calendars, key=lambda calendar: calendar[0])]
+
+def readOption(text):
+    # "#key value" as (key, value), with the value a number or bool if it
+    # looks like one, or one picked at random from "[a, b]"; "#key" alone
+    # is (key, True)
+    option = text[1:].rstrip().lstrip()
+    parts = option.split(' ')
+    if len(parts) < 2:
+        return option, True
+    key, value = parts[0], ' '.join(parts[1:])
+    if value[0] == '[':
+        value = random.choice([v.strip() for v in value[1:-1].split(',')])
+    elif value[0] == '"':
+        value = value[1:-1]
+    if value.lower() in ['true','false']:
+        return key, bool(value)
+    try:
+        return key, int(value)
+    except:
+        return key, value
+
 def getPrevNextLinks(next, prev):
     # TODO
     # next = prev_path_name
@@ -312,15 +1264,1079 @@ def makeName(name):
     name = ''.join([namepart.lower().capitalize() for namepart in name.split(' ')])
     return removePunc(name[0].lower() + name[1:])
 
-def getFileName(proposed_name, filenames):
-    # TODO - I could probably do this with path_name
-    # but since this was already working, I changed behavior for now
-    # it replaces existing files
-    i = 2
-    while proposed_name in filenames:
-        proposed_name += str(i)
-        i += 1
-    return proposed_name
+class FileNames(object):
+    # Hands out output paths. A path that is already taken gets the next free
+    # number for that name (foo, foo2, foo3 ...), so allocating is a set
+    # lookup rather than a scan of every name handed out so far.
+    def __init__(self):
+        self.taken = set()
+        self.counters = {}
+
+    def __contains__(self, file_name):
+        return file_name in self.taken
+
+    def __len__(self):
+        return len(self.taken)
+
+    def allocate(self, proposed_name):
+        if proposed_name not in self.taken:
+            self.taken.add(proposed_name)
+            return proposed_name
+        i = self.counters.get(proposed_name, 2)
+        while "%s%s" % (proposed_name, i) in self.taken:
+            i += 1
+        self.counters[proposed_name] = i + 1
+        file_name = "%s%s" % (proposed_name, i)
+        self.taken.add(file_name)
+        return file_name
+
+def renderUnit(job, templates, glossary, timings=None):
+    # Renders one page, calendar post or archive frame. Returns its bodytext
+    # (None for archives) and the finished html, which for an archive is
+    # split where the listings go. A page's extra is the lazy setting of
+    # emitOutline or None, and instead of its bodytext it returns the
+    # subtrees split out of it as (ec-id, html). timings, if given, gets the
+    # seconds spent in grabData and in the glossary.
+    if timings is None:
+        timings = {}
+    kind, node, this_type, values, brand, brandLink, extra = job
+    rules, template = templates[this_type]
+    if kind == 'index':
+        # bodytext is filled in after the glossary so listings are not expanded
+        start = time.time()
+        data = glossary.expand(template.render(values), brandValues(brand, brandLink))
+        timings['glossary'] = time.time() - start
+        return None, data.split('<%bodytext%>')
+    if isinstance(node, basestring):
+        node = opml.OutlineElement(etree.fromstring(node))
+    lazy, split = None, []
+    if kind == 'page':
+        lazy = extra
+    start = time.time()
+    waste, bodytext = grabData(node, rules, this_type, lazy, split)
+    timings['outline'] = time.time() - start
+    if kind == 'page':
+        if split:
+            bodytext.append(LAZY_SCRIPT)
+        bodytext.append('</div>') # not sure why we need this - something's not right
+        bodytext = ''.join(bodytext)
+    else:
+        bodytext.append('</div><!--FIX-->') # not sure why we need this - something's not right
+        bodytext = '\n'.join(bodytext)
+    values = dict(values)
+    values['bodytext'] = bodytext
+    values.update(node._root.items())
+    start = time.time()
+    data = glossary.expand(template.render(values), brandValues(brand, brandLink))
+    if kind == 'page':
+        bodytext = [(ec_id, glossary.expand(html, brandValues(brand, brandLink))) for ec_id, html in split]
+    timings['glossary'] = time.time() - start
+    if kind == 'post':
+        trail_links, commentsString = extra
+        data = data.replace('</h1>', '</h1>%s' % trail_links)
+        data = data.replace('<!-- COMMENTS -->', commentsString)
+    return bodytext, data
+
+WORKER = {}
+
+def initWorker(templates, glossary):
+    WORKER['templates'] = dict([(k, (rules, compileTemplate(text))) for k, (rules, text) in templates.items()])
+    WORKER['glossary'] = compileGlossary(glossary)
+
+def timedRender(job, templates, glossary):
+    # renderUnit, along with how long it took
+    timings = {}
+    start = time.time()
+    result = renderUnit(job, templates, glossary, timings)
+    timings['total'] = time.time() - start
+    return result, timings
+
+def workerRender(job):
+    return timedRender(job, WORKER['templates'], WORKER['glossary'])
+
+def unitLabel(job):
+    kind, node, this_type, values = job[:4]
+    return "%s %s" % (kind, values.get('pageTitle', ''))
+
+def packJob(job):
+    # outline nodes travel to the workers as xml
+    if job[1] is None:
+        return job
+    return job[:1] + (etree.tostring(job[1]._root),) + job[2:]
+
+class Rendered(object):
+    # a render result that reports its time to stats when it is picked up
+    def __init__(self, result, stats, label):
+        self.result, self.stats, self.label = result, stats, label
+
+    def get(self):
+        result, timings = self.result.get() if hasattr(self.result, 'get') else self.result
+        if self.stats is not None:
+            self.stats.rendered(self.label, timings)
+            self.stats = None
+        return result
+
+class Renderer(object):
+    # Runs renderUnit here, or with jobs > 1 on a pool of processes that are
+    # each handed the templates and glossary once when the pool starts. A new
+    # pool is started if they change part way through a streamed outline.
+    def __init__(self, jobs=1, stats=None):
+        self.jobs = jobs
+        self.stats = stats
+        self.pool = None
+        self.pools = []
+        self.templates, self.glossary = {}, None
+
+    def setup(self, templates, glossary):
+        self.templates, self.glossary = templates, glossary
+        self.pool = None
+
+    def start(self):
+        if self.pool is None:
+            templates = dict([(k, (rules, template.text)) for k, (rules, template) in self.templates.items()])
+            self.pool = multiprocessing.Pool(self.jobs, initWorker, (templates, self.glossary.values))
+            self.pools.append(self.pool)
+        return self.pool
+
+    def submit(self, job):
+        if self.jobs <= 1:
+            return Rendered(timedRender(job, self.templates, self.glossary), self.stats, unitLabel(job))
+        return Rendered(self.start().apply_async(workerRender, (packJob(job),)), self.stats, unitLabel(job))
+
+    def map(self, jobs):
+        # results come back lazily and in order
+        jobs = list(jobs)
+        if self.jobs <= 1:
+            results = itertools.imap(lambda job: timedRender(job, self.templates, self.glossary), jobs)
+        else:
+            results = self.start().imap(workerRender, itertools.imap(packJob, jobs), 4)
+        return itertools.imap(lambda job, result: Rendered(result, self.stats, unitLabel(job)).get(), jobs, results)
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+            pool.join()
+        self.pools = []
+
+    def terminate(self):
+        # after a failure, without waiting for what is still rendering
+        for pool in self.pools:
+            pool.terminate()
+            pool.join()
+        self.pools = []
+
+class Manifest(object):
+    # Remembers a digest of everything that went into each page and post on
+    # the last run (its subtree, template, rules, glossary and settings) so
+    # unchanged ones can skip rendering and writing. The listings of posts
+    # are kept in the PostStore. settings are options that change every
+    # file, like --minify; when they differ from the last run's every unit
+    # is rendered again.
+    def __init__(self, folder, force=False, output=None, settings=None):
+        self.folder = folder
+        self.output = output or FolderOutput()
+        self.settings = settings or {}
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.units = {}
+        self.seen = {}
+        self.files = {}
+        self.seen_files = {}
+        self.uploaded = {}
+        # the digest of each file when its compressed copies were made
+        self.compressed = {}
+        self.seen_compressed = {}
+        # what the site was built from (see sourcesDigest) and whether the
+        # zip was made from it
+        self.sources, self.seen_sources = None, None
+        self.zipped, self.seen_zipped = False, False
+        # the split out fragments the last run left, whatever its settings
+        self.fragments = set()
+        data = None
+        if not force:
+            data = self.output.readState(self.path)
+        if data is not None:
+            try:
+                manifest = json.loads(data)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    if manifest.get('settings', {}) == self.settings:
+                        self.units = manifest['units']
+                    self.fragments = splitFragments(manifest['units'])
+                    self.files = manifest['files']
+                    self.uploaded = manifest.get('uploaded', {})
+                    self.compressed = manifest.get('compressed', {})
+                    self.sources = manifest.get('sources')
+                    self.zipped = manifest.get('zipped', False)
+            except (ValueError, KeyError):
+                pass
+
+    def relative(self, file_name):
+        return os.path.relpath(file_name, self.folder)
+
+    def current(self, compressing=False, sources=None, target=None, zipping=False):
+        # whether the last run was built from the same sources with these
+        # settings and left every file it wrote still there, compressed too
+        # if compressing, uploaded to target if given and zipped if zipping,
+        # so there is nothing to do
+        if not self.units or self.sources != sources:
+            return False
+        if zipping and not (self.zipped and os.path.exists(zipPath(self.folder))):
+            return False
+        uploaded = self.uploaded.get(target, {})
+        for name, digest in self.files.items():
+            if not self.output.exists(os.path.join(self.folder, name)):
+                return False
+            if compressing and os.path.splitext(name)[1] not in SIDECARS and self.compressed.get(name) != digest:
+                return False
+            if target is not None and uploaded.get(name) != digest:
+                return False
+        return True
+
+    def get(self, key, digest, file_name):
+        unit = self.units.get(key)
+        if unit is None or unit.get('digest') != digest:
+            return None
+        if unit.get('file') != self.relative(file_name) or not self.output.exists(file_name):
+            return None
+        # something else may have written over it this run, like the home
+        # page's copy of itself over the blog's index.html
+        if self.fileDigest(file_name) != self.files.get(unit['file']):
+            return None
+        return unit
+
+    def add(self, key, unit, file_name):
+        unit = dict(unit)
+        unit['file'] = self.relative(file_name)
+        self.seen[key] = unit
+        # a skipped unit's files are still there, so keep their digests too
+        for name in [unit['file']] + unit.get('split', []):
+            if name not in self.seen_files and name in self.files:
+                self.seen_files[name] = self.files[name]
+
+    def fileDigest(self, file_name):
+        # what is there now, which may have been written this run
+        name = self.relative(file_name)
+        return self.seen_files.get(name, self.files.get(name))
+
+    def setFileDigest(self, file_name, digest):
+        self.seen_files[self.relative(file_name)] = digest
+
+    def compressedDigest(self, file_name):
+        return self.compressed.get(self.relative(file_name))
+
+    def setCompressed(self, file_name, digest):
+        self.seen_compressed[self.relative(file_name)] = digest
+
+    def setSources(self, digest):
+        self.seen_sources = digest
+
+    def setZipped(self):
+        self.seen_zipped = True
+
+    def following(self):
+        # the manifest for another run in the same process, without reading
+        # back the file this one saved
+        manifest = Manifest(self.folder, True, self.output, self.settings)
+        manifest.units, manifest.files, manifest.uploaded = self.seen, self.seen_files, self.uploaded
+        manifest.compressed = self.seen_compressed
+        manifest.sources, manifest.zipped = self.seen_sources, self.seen_zipped
+        manifest.fragments = splitFragments(self.seen)
+        return manifest
+
+    def prune(self):
+        # Removes the fragments the last run split out that this one did
+        # not, of pages that are gone, renamed or no longer split, with
+        # their compressed copies. Pages themselves have always been left.
+        for name in self.fragments - splitFragments(self.seen):
+            for stale in [name] + [name + suffix for suffix in SIDECARS]:
+                self.output.remove(os.path.join(self.folder, stale))
+
+    def uploadedDigest(self, target, file_name):
+        return self.uploaded.get(target, {}).get(self.relative(file_name))
+
+    def setUploaded(self, target, done):
+        # forget files that are gone, then add what was just uploaded
+        uploaded = dict((key, digest) for key, digest in self.uploaded.get(target, {}).items() if key in self.seen_files)
+        uploaded.update(done)
+        self.uploaded[target] = uploaded
+
+    def save(self):
+        self.output.putState(self.path, json.dumps({'version': MANIFEST_VERSION, 'settings': self.settings, 'units': self.seen,
+            'files': self.seen_files, 'uploaded': self.uploaded, 'compressed': self.seen_compressed,
+            'sources': self.seen_sources, 'zipped': self.seen_zipped}))
+
+def splitFragments(units):
+    fragments = set()
+    for unit in units.values():
+        fragments.update(unit.get('split', []))
+    return fragments
+
+class FolderOutput(object):
+    # Where the site goes. This one writes it to its folder, as fargo2html
+    # always has; see MemoryOutput and TarOutput for the others. Every path
+    # is the full path parse() built on the site folder. A new file is
+    # written to create(), then either commit()ed in place or discard()ed.
+    local = True
+
+    def start(self, folder):
+        # returns whether there is already a site there
+        had_output = os.path.isdir(folder) and bool(os.listdir(folder))
+        mkdir_p(folder)
+        return had_output
+
+    def openPosts(self, folder):
+        # the database for the PostStore
+        return sqlite3.connect(os.path.join(folder, POSTS_NAME))
+
+    def readState(self, path):
+        # the manifest, which lives in the folder with the site
+        return self.read(path)
+
+    def putState(self, path, data):
+        self.put(path, data)
+
+    def finish(self):
+        pass
+
+    def makedirs(self, path):
+        mkdir_p(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def digest(self, path):
+        return fileDigest(path)
+
+    def read(self, path):
+        try:
+            return open(path, "rb").read()
+        except IOError:
+            return None
+
+    def create(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            mkdir_p(folder)
+        return open("%s.%s.tmp" % (path, os.getpid()), "wb")
+
+    def commit(self, fh, path):
+        # the temp file is renamed over the old one, so a reader never sees
+        # half a page
+        os.rename(fh.name, path)
+
+    def discard(self, fh):
+        os.remove(fh.name)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def put(self, path, data):
+        fh = self.create(path)
+        fh.write(data)
+        fh.close()
+        self.commit(fh, path)
+
+class Unclosed(object):
+    # a database connection that commits instead of closing
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def close(self):
+        self.db.commit()
+
+class PostStore(object):
+    # The listing of every post (its title, bodytext, url and description),
+    # in a sqlite database next to the manifest rather than in memory, so
+    # building a calendar of any size takes about the same memory. Each run
+    # marks the posts it finds or adds; close() drops the rest. Archives
+    # hold the row ids of their posts and read the listings back a page at
+    # a time. Listings are marshalled so str and unicode come back as they
+    # went in.
+    def __init__(self, db):
+        self.db = db
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, key TEXT UNIQUE, digest TEXT, listing BLOB, seen INTEGER)")
+        db.execute("UPDATE posts SET seen = 0")
+
+    def find(self, key, digest):
+        # the row id and listing of an unchanged post, or None
+        row = self.db.execute("SELECT id, listing FROM posts WHERE key = ? AND digest = ?", (key, digest)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE posts SET seen = 1 WHERE id = ?", (row[0],))
+        return row[0], marshal.loads(str(row[1]))
+
+    def add(self, key, digest, listing):
+        cursor = self.db.execute("INSERT OR REPLACE INTO posts (key, digest, listing, seen) VALUES (?, ?, ?, 1)",
+                                 (key, digest, sqlite3.Binary(marshal.dumps(listing))))
+        return cursor.lastrowid
+
+    def listings(self, ids):
+        # in the order of ids, a few hundred at a time to stay under
+        # sqlite's limit on query parameters
+        found = {}
+        unique = list(set(ids))
+        for start in xrange(0, len(unique), 500):
+            chunk = unique[start:start+500]
+            found.update(self.db.execute("SELECT id, listing FROM posts WHERE id IN (%s)" % ",".join("?" * len(chunk)), chunk))
+        return [marshal.loads(str(found[i])) for i in ids]
+
+    def close(self):
+        self.db.execute("DELETE FROM posts WHERE seen = 0")
+        self.db.commit()
+        self.db.close()
+        self.db = None
+
+    def abandon(self):
+        # after a failed build, with nothing it did kept
+        if self.db is not None:
+            self.db.rollback()
+            self.db.close()
+            self.db = None
+
+class MemoryFile(StringIO.StringIO):
+    # keeps what was written once it is closed
+    def close(self):
+        self.data = self.getvalue()
+        StringIO.StringIO.close(self)
+
+class MemoryOutput(object):
+    # Keeps the site in files, a dict of path relative to the site folder to
+    # its contents, and the manifest apart from it in state. Build into the
+    # same MemoryOutput again and only what changed is rendered, as with a
+    # folder.
+    local = False
+
+    def __init__(self, files=None):
+        if files is None:
+            files = {}
+        self.files = files
+        self.state = {}
+        self.folder = None
+        self.posts = None
+
+    def start(self, folder):
+        self.folder = folder
+        return bool(self.files)
+
+    def openPosts(self, folder):
+        # kept for the next build, which closing it would lose
+        if self.posts is None:
+            self.posts = sqlite3.connect(":memory:")
+        return Unclosed(self.posts)
+
+    def readState(self, path):
+        return self.state.get(self.key(path))
+
+    def putState(self, path, data):
+        self.state[self.key(path)] = data
+
+    def finish(self):
+        pass
+
+    def key(self, path):
+        return os.path.relpath(path, self.folder)
+
+    def makedirs(self, path):
+        pass
+
+    def exists(self, path):
+        return self.key(path) in self.files
+
+    def size(self, path):
+        data = self.files.get(self.key(path))
+        if data is None:
+            return None
+        return len(data)
+
+    def digest(self, path):
+        return hashlib.sha1(self.files[self.key(path)]).hexdigest()
+
+    def read(self, path):
+        return self.files.get(self.key(path))
+
+    def create(self, path):
+        return MemoryFile()
+
+    def commit(self, fh, path):
+        self.put(path, fh.data)
+
+    def discard(self, fh):
+        pass
+
+    def remove(self, path):
+        self.files.pop(self.key(path), None)
+
+    def put(self, path, data):
+        self.files[self.key(path)] = data
+
+class TarOutput(MemoryOutput):
+    # Streams the site as a tar archive, each file added as soon as it is
+    # written, to target: a file name, a file object, or stdout if None.
+    # Names in the archive are relative to the site folder. Nothing is read
+    # back, so every build writes the whole site.
+    def __init__(self, target=None):
+        MemoryOutput.__init__(self)
+        self.target = target
+        if target is None:
+            self.target = sys.stdout
+        self.tar = None
+
+    def start(self, folder):
+        self.folder = folder
+        self.files = {}
+        if isinstance(self.target, basestring):
+            self.fh = open(self.target, "wb")
+        else:
+            self.fh = self.target
+        self.tar = tarfile.open(fileobj=self.fh, mode="w|")
+        return False
+
+    def finish(self):
+        self.tar.close()
+        if self.fh is not self.target:
+            self.fh.close()
+        else:
+            self.fh.flush()
+
+    def openPosts(self, folder):
+        # a temporary file, deleted when it is closed
+        return sqlite3.connect("")
+
+    def readState(self, path):
+        return None
+
+    def putState(self, path, data):
+        # the manifest would only end up being served with the site
+        pass
+
+    def size(self, path):
+        return None
+
+    def read(self, path):
+        return None
+
+    def put(self, path, data):
+        info = tarfile.TarInfo(self.key(path))
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0644
+        self.tar.addfile(info, StringIO.StringIO(data))
+        # only the name is kept, so exists() still works
+        self.files[info.name] = True
+
+def caseless(word):
+    # a pattern for word in any case; much quicker than re.I
+    return ''.join(c.isalpha() and '[%s%s]' % (c.lower(), c.upper()) or c for c in word)
+
+# what --minify leaves as it is, and the tags any white space can go from in
+# front of without changing how a page looks; anywhere else white space
+# between two tags only needs to be one space
+MINIFY_KEEP = re.compile('(%s)' % '|'.join([r'<%s\b.*?</%s\s*>' % (caseless(tag), caseless(tag))
+    for tag in ('pre', 'script', 'style', 'textarea')]), re.S)
+MINIFY_COMMENT = re.compile(r'<!--.*?-->', re.S)
+MINIFY_INDENT = re.compile(r'\n\s+')
+MINIFY_GAP = re.compile(r'>\s\s+<')
+MINIFY_BLOCK_TAGS = '</?(?:%s)\\b' % '|'.join([caseless(tag) for tag in ('html head body title meta link base div p ul ol li '
+    'dl dt dd h1 h2 h3 h4 h5 h6 table thead tbody tfoot tr td th header footer nav section article aside form fieldset '
+    'blockquote hr br center noscript').split()])
+# white space is only looked for after a line break or a tag, which is
+# much quicker than trying \s+ at every space in the text
+MINIFY_BLOCK = re.compile(r'\n(?=%s)' % MINIFY_BLOCK_TAGS)
+MINIFY_TAG_BLOCK = re.compile(r'>\s+(?=%s)' % MINIFY_BLOCK_TAGS)
+
+def minifyHTML(data):
+    # Drops comments, except IE's conditional ones, and the indenting and
+    # blank lines after every line break, then line breaks in front of block
+    # tags and white space between another tag and a block tag, like the
+    # tabs grabData puts between items; what is left between two tags comes
+    # down to one space. <pre>, <script>, <style> and <textarea> are left
+    # alone.
+    parts = MINIFY_KEEP.split(data)
+    # split() gives text, then a kept block, then text again and so on
+    for i in range(0, len(parts), 2):
+        text = parts[i]
+        if '<!--' in text:
+            text = MINIFY_COMMENT.sub(keepConditional, text)
+        text = MINIFY_INDENT.sub('\n', text)
+        text = MINIFY_BLOCK.sub('', MINIFY_TAG_BLOCK.sub('>', text))
+        parts[i] = MINIFY_GAP.sub('> <', text)
+    return ''.join(parts)
+
+def keepConditional(match):
+    comment = match.group()
+    if '[if' in comment or '[endif]' in comment:
+        return comment
+    return ''
+
+class OutputWriter(object):
+    # Everything parse() writes goes through here, to output (a folder
+    # unless given another). Text is always stored as UTF-8. A file is only
+    # rewritten when its size or digest differs from what is already there.
+    # changed lists every file actually written. With an uploader, files the
+    # upload target does not have yet are handed to it as soon as they are
+    # on disk, and with a compressor files that changed are handed to it to
+    # be compressed. With minify, HTML is minified before anything else
+    # happens to it and minified keeps its size before and after.
+    def __init__(self, manifest=None, uploader=None, output=None, compressor=None, minify=False):
+        self.manifest = manifest
+        self.uploader = uploader
+        self.output = output or FolderOutput()
+        self.compressor = compressor
+        self.minify = minify
+        self.minified = [0, 0]
+        self.changed = []
+        self.unchanged = 0
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    def write(self, file_name, data):
+        start = time.time()
+        try:
+            return self.writeData(file_name, data)
+        finally:
+            self.seconds += time.time() - start
+
+    def writeData(self, file_name, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if self.minify and os.path.splitext(file_name)[1] in ('', '.html'):
+            self.minified[0] += len(data)
+            data = minifyHTML(data)
+            self.minified[1] += len(data)
+        digest = hashlib.sha1(data).hexdigest()
+        if self.isCurrent(file_name, len(data), digest):
+            self.unchanged += 1
+            self.publish(file_name, digest)
+            self.compress(file_name, data, False, digest)
+            return False
+        self.output.put(file_name, data)
+        if self.manifest is not None:
+            self.manifest.setFileDigest(file_name, digest)
+        self.changed.append(file_name)
+        self.bytes_written += len(data)
+        self.publish(file_name, digest)
+        self.compress(file_name, data, True, digest)
+        return True
+
+    def stream(self, file_name, produce):
+        # For output that is serialized straight to a file: produce() writes
+        # to a temp file, which is dropped if it matches what is there.
+        start = time.time()
+        try:
+            return self.streamData(file_name, produce)
+        finally:
+            self.seconds += time.time() - start
+
+    def streamData(self, file_name, produce):
+        fh = DigestFile(self.output.create(file_name), self.compressor is not None)
+        try:
+            produce(fh)
+        finally:
+            fh.close()
+        digest = fh.digest.hexdigest()
+        if self.isCurrent(file_name, fh.size, digest):
+            self.output.discard(fh.fh)
+            self.unchanged += 1
+            self.publish(file_name, digest)
+            self.compress(file_name, ''.join(fh.kept or []), False, digest)
+            return False
+        self.output.commit(fh.fh, file_name)
+        if self.manifest is not None:
+            self.manifest.setFileDigest(file_name, digest)
+        self.changed.append(file_name)
+        self.bytes_written += fh.size
+        self.publish(file_name, digest)
+        self.compress(file_name, ''.join(fh.kept or []), True, digest)
+        return True
+
+    def publish(self, file_name, digest):
+        if self.uploader is None or self.manifest is None:
+            return
+        if self.manifest.uploadedDigest(self.uploader.target.name, file_name) != digest:
+            self.uploader.submit(file_name, self.manifest.relative(file_name), digest)
+
+    def publishPending(self):
+        # files that were never written this run, like pages the manifest skipped
+        if self.manifest is not None:
+            for key, digest in self.manifest.seen_files.items():
+                self.publish(os.path.join(self.manifest.folder, key), digest)
+
+    def compress(self, file_name, data=None, changed=True, digest=None):
+        # a file that did not change only needs compressing again if its
+        # compressed copies are missing, as on the first run with them, or
+        # were not made from it, as after a run without a compressor. One
+        # written again with other data this run is compressed again too.
+        if self.compressor is None or os.path.splitext(file_name)[1] in SIDECARS:
+            return
+        if digest is None and self.manifest is not None:
+            digest = self.manifest.fileDigest(file_name)
+        if file_name in self.compressor.submitted:
+            if self.compressor.submitted[file_name] == digest:
+                return
+        elif not changed and self.compressor.hasSidecars(self.output, file_name):
+            if self.manifest is None:
+                return
+            if digest is not None and self.manifest.compressedDigest(file_name) == digest:
+                self.manifest.setCompressed(file_name, digest)
+                return
+        if data is None:
+            data = self.output.read(file_name)
+        if data is not None:
+            self.compressor.submit(file_name, data, digest)
+            if self.manifest is not None and digest is not None:
+                self.manifest.setCompressed(file_name, digest)
+
+    def compressPending(self):
+        # files that were never written this run, like pages the manifest
+        # skipped, then every compressed copy the compressor made
+        if self.compressor is None:
+            return
+        if self.manifest is not None:
+            for key, digest in self.manifest.seen_files.items():
+                self.compress(os.path.join(self.manifest.folder, key), None, False, digest)
+        for file_name, data in self.compressor.finish():
+            self.write(file_name, data)
+
+    def isCurrent(self, file_name, size, digest):
+        if self.output.size(file_name) != size:
+            return False
+        old_digest = None
+        if self.manifest is not None:
+            old_digest = self.manifest.fileDigest(file_name)
+        if old_digest is None:
+            old_digest = self.output.digest(file_name)
+        if old_digest != digest:
+            return False
+        if self.manifest is not None:
+            self.manifest.setFileDigest(file_name, digest)
+        return True
+
+class Uploader(object):
+    # The upload stage. Files are put to target on a few threads while the
+    # rest of the site is still rendering; done maps each uploaded file to
+    # its digest and failed lists (file, error) for the ones that were not.
+    # A file is only ever being put once at a time: one written again while
+    # it is going up is put again after, so what lands is its last version.
+    def __init__(self, target, jobs=UPLOAD_JOBS):
+        self.target = target
+        self.jobs = jobs
+        self.pool = None
+        self.lock = threading.Lock()
+        # the last (path, digest) submitted for each key, and the keys
+        # being put now
+        self.submitted = {}
+        self.uploading = set()
+        self.done = {}
+        self.failed = []
+
+    def submit(self, file_name, key, digest):
+        self.lock.acquire()
+        try:
+            if key in self.submitted and self.submitted[key][1] == digest:
+                return
+            self.submitted[key] = (os.path.abspath(file_name), digest)
+            if key in self.uploading:
+                return
+            self.uploading.add(key)
+        finally:
+            self.lock.release()
+        if self.pool is None:
+            self.pool = ThreadPool(self.jobs)
+        self.pool.apply_async(self.upload, (key,))
+
+    def upload(self, key):
+        digest = None
+        while True:
+            self.lock.acquire()
+            try:
+                if self.submitted[key][1] == digest:
+                    self.uploading.discard(key)
+                    return
+                path, digest = self.submitted[key]
+            finally:
+                self.lock.release()
+            try:
+                self.target.put(path, key)
+            except Exception, e:
+                self.lock.acquire()
+                self.failed.append((key, e))
+                self.lock.release()
+            else:
+                # an earlier version that failed to go up no longer matters
+                self.lock.acquire()
+                self.done[key] = digest
+                self.failed = [failed for failed in self.failed if failed[0] != key]
+                self.lock.release()
+
+    def finish(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        done, failed = self.done, self.failed
+        self.submitted, self.done, self.failed = {}, {}, []
+        return done, failed
+
+class Compressor(object):
+    # The precompress stage. Files are gzipped, and compressed with brotli
+    # too when the brotli module is there, on a few threads while the rest
+    # of the site is still rendering. finish() hands back each compressed
+    # copy to be written beside its file, file.gz and file.br, for a static
+    # server to send as it is.
+    def __init__(self, jobs=1, level=9):
+        self.jobs = jobs
+        self.level = level
+        self.pool = None
+        # the digest of what was last submitted for each file
+        self.submitted = {}
+        self.pending = []
+        self.done = []
+
+    def sidecars(self, file_name):
+        if brotli is None:
+            return [file_name + SIDECARS[0]]
+        return [file_name + suffix for suffix in SIDECARS]
+
+    def hasSidecars(self, output, file_name):
+        for sidecar in self.sidecars(file_name):
+            if not output.exists(sidecar):
+                return False
+        return True
+
+    def submit(self, file_name, data, digest=None):
+        self.submitted[file_name] = digest
+        if self.pool is None:
+            self.pool = ThreadPool(self.jobs)
+        self.pending.append(self.pool.apply_async(self.compress, (file_name, data)))
+        # with a few files queued, wait for the oldest so pages are not held
+        # in memory faster than they can be compressed
+        while len(self.pending) > self.jobs * 4:
+            self.done.extend(self.pending.pop(0).get())
+
+    def compress(self, file_name, data):
+        buf = StringIO.StringIO()
+        # no name or time in the header, so the same file always gives the
+        # same bytes and an unchanged copy is not written again
+        fh = gzip.GzipFile('', 'wb', self.level, buf, mtime=0)
+        fh.write(data)
+        fh.close()
+        compressed = [buf.getvalue()]
+        if brotli is not None:
+            compressed.append(brotli.compress(data))
+        return zip(self.sidecars(file_name), compressed)
+
+    def finish(self):
+        # every (sidecar, data) for the files submitted since the last finish,
+        # from the last data submitted for a file that was submitted again
+        sidecars = self.done
+        for result in self.pending:
+            sidecars.extend(result.get())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.submitted, self.pending, self.done = {}, [], []
+        last = dict((sidecar, i) for i, (sidecar, data) in enumerate(sidecars))
+        return [(sidecar, data) for i, (sidecar, data) in enumerate(sidecars) if last[sidecar] == i]
+
+class FolderTarget(object):
+    # Uploads by copying into another folder, like a web server's document
+    # root or a stand-in for S3 when testing.
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.name = "folder:%s" % self.folder
+
+    def put(self, path, key):
+        file_name = os.path.join(self.folder, key)
+        mkdir_p(os.path.dirname(file_name))
+        temp_path = "%s.%s.tmp" % (file_name, threading.current_thread().ident)
+        shutil.copyfile(path, temp_path)
+        os.rename(temp_path, file_name)
+
+class S3Target(object):
+    # Uploads to an S3 bucket with boto, one connection per upload thread.
+    # endpoint points it at an S3-compatible server, e.g. http://localhost:9000
+    def __init__(self, profile, bucket, endpoint=None):
+        import boto
+        self.profile = profile
+        self.bucket_name = bucket
+        self.endpoint = endpoint
+        self.name = "s3:%s" % bucket
+        self.local = threading.local()
+
+    def bucket(self):
+        if not hasattr(self.local, 'bucket'):
+            import boto, boto.s3.connection
+            options = {}
+            if self.profile and self.profile != "Credentials":
+                options['profile_name'] = self.profile
+            if self.endpoint:
+                url = urlparse.urlparse(self.endpoint)
+                options.update(host=url.hostname, port=url.port, is_secure=url.scheme == 'https',
+                               calling_format=boto.s3.connection.OrdinaryCallingFormat())
+            self.local.bucket = boto.connect_s3(**options).get_bucket(self.bucket_name, validate=False)
+        return self.local.bucket
+
+    def put(self, path, key):
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.bucket().new_key(key).set_contents_from_filename(path, headers={'Content-Type': content_type}, policy='public-read')
+
+class DigestFile(object):
+    # A file that keeps the size and sha1 of everything written to it, and
+    # with keep, what was written too
+    def __init__(self, fh, keep=False):
+        self.fh = fh
+        self.digest = hashlib.sha1()
+        self.size = 0
+        self.kept = None
+        if keep:
+            self.kept = []
+
+    def write(self, data):
+        self.fh.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        if self.kept is not None:
+            self.kept.append(data)
+
+    def close(self):
+        self.fh.close()
+
+class Feed(object):
+    # Keeps the newest size feed items in a heap, each post's date parsed
+    # once. Posts with the same date keep their outline order.
+    date_format = "%a, %d %b %Y %H:%M:%S %Z"
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.order = itertools.count()
+
+    def add(self, title, link, description, created):
+        if not self.size:
+            return
+        item = (datetime.datetime.strptime(created, self.date_format), -next(self.order), (title, link, description, created))
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, item)
+        else:
+            heapq.heappushpop(self.heap, item)
+
+    def entries(self):
+        return [entry for created, order, entry in sorted(self.heap, reverse=True)]
+
+    def items(self):
+        return [PyRSS2Gen.RSSItem(title = title, link = link, description = description, guid = link, pubDate = created)
+                for title, link, description, created in self.entries()]
+
+class Stats(object):
+    # What a build spent its time on. lap() ends the phase that is running
+    # and starts the next, so every moment of the build belongs to exactly
+    # one phase. Render times come from the renderer, per page, post and
+    # archive, and are summed across processes so with --jobs they can add
+    # up to more than the wall time of the phases that ran them.
+    def __init__(self, top=10, memory=False):
+        self.top = top
+        self.phases = []
+        self.phase = None
+        self.units = []
+        self.fetched = 0
+        self.sources = 0
+        self.skipped = 0
+        self.memory = memory and tracemalloc is not None
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.started = (time.time(), time.clock())
+        self.total = None
+
+    def lap(self, phase=None):
+        now, cpu = time.time(), time.clock()
+        if self.phase is not None:
+            name, start, start_cpu = self.phase
+            self.phases.append((name, now - start, cpu - start_cpu))
+        self.phase = None
+        if phase is not None:
+            self.phase = (phase, now, cpu)
+
+    def stop(self):
+        self.lap()
+        start, start_cpu = self.started
+        self.total = (time.time() - start, time.clock() - start_cpu)
+
+    def fetch(self, content, received=True):
+        # only what was downloaded counts as fetched, not a cached copy
+        if content is not None:
+            if received:
+                self.fetched += len(content)
+            self.sources += 1
+
+    def rendered(self, label, timings):
+        self.units.append((timings.get('total', 0.0), label, timings))
+
+    def report(self, writer=None):
+        if self.total is None:
+            self.stop()
+        phases = {}
+        for name, wall, cpu in self.phases:
+            wall_total, cpu_total = phases.get(name, (0.0, 0.0))
+            phases[name] = (wall_total + wall, cpu_total + cpu)
+        report = {
+            'phases': dict((name, {'wall': wall, 'cpu': cpu}) for name, (wall, cpu) in phases.items()),
+            'total': {'wall': self.total[0], 'cpu': self.total[1]},
+            'fetch': {'bytes': self.fetched, 'sources': self.sources},
+            'render': {
+                'units': len(self.units),
+                'skipped': self.skipped,
+                'seconds': sum(timings.get('total', 0.0) for total, label, timings in self.units),
+                'outline': sum(timings.get('outline', 0.0) for total, label, timings in self.units),
+                'glossary': sum(timings.get('glossary', 0.0) for total, label, timings in self.units),
+                'slowest': [{'unit': label, 'seconds': total} for total, label, timings in heapq.nlargest(self.top, self.units)],
+            },
+        }
+        if writer is not None:
+            report['files'] = {'written': len(writer.changed), 'unchanged': writer.unchanged,
+                'bytes_written': writer.bytes_written, 'seconds': writer.seconds}
+            if writer.minify:
+                report['files']['minified'] = {'before': writer.minified[0], 'after': writer.minified[1]}
+        # ru_maxrss is in kilobytes on Linux and bytes on a Mac
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+        report['memory'] = {'peak_rss': peak}
+        if self.memory:
+            report['memory']['peak_traced'] = tracemalloc.get_traced_memory()[1]
+        return report
+
+def archivePage(frame, listings):
+    # one page of an archive, its listings joined once into the frame
+    bodytext = ''.join(["<h2><a href=\"%s\">%s</a></h2>\n%s\n" % (page_url, title, page_data) for title, page_data, page_url, page_desc in listings])
+    return bodytext.join(frame) + "\n"
+
+def unitDigest(node, *context):
+    # node may also be given as its nodeDigest()
+    digest = hashlib.sha1(MANIFEST_VERSION)
+    if isinstance(node, basestring):
+        digest.update(node)
+    elif node is not None:
+        digest.update(nodeDigest(node))
+    for part in context:
+        if isinstance(part, Template):
+            part = part.text
+        elif isinstance(part, Glossary):
+            part = part.digest
+        digest.update(json.dumps(part))
+    return digest.hexdigest()
 
 def addCalendar(b,o,t,calendars):
     if b in calendars:
@@ -329,14 +2345,100 @@ def addCalendar(b,o,t,calendars):
         calendars[b] = [[o],t]
     return calendars
 
-def zipdir(folder):
-    zipp = zipfile.ZipFile('%s.zip' % folder, 'w')
+def zipEntry(path, level):
+    # reads one file for zipdir, deflated unless level is 0
+    data = open(path, "rb").read()
+    crc = zlib.crc32(data) & 0xffffffff
+    size = len(data)
+    if level:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    return crc, size, data
+
+def zipReadRaw(zipp, zinfo):
+    # the still compressed bytes of an entry in an existing zip
+    zipp.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, zipp.fp.read(zipfile.sizeFileHeader))
+    zipp.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    return zipp.fp.read(zinfo.compress_size)
+
+def zipWriteRaw(zipp, zinfo, raw):
+    # what ZipFile.writestr does, for bytes that are already compressed
+    zinfo.header_offset = zipp.fp.tell()
+    zinfo.compress_size = len(raw)
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zipp.fp.write(zinfo.FileHeader(zip64))
+    zipp.fp.write(raw)
+    zipp.filelist.append(zinfo)
+    zipp.NameToInfo[zinfo.filename] = zinfo
+    zipp._didModify = True
+
+def zipPath(folder):
+    return '%s.zip' % folder
+
+def zipdir(folder, level=0, jobs=1, changed=()):
+    # Entries for files with the same size and time as in the last zip are
+    # copied over still compressed, everything else is compressed again on
+    # jobs threads. Level 0 stores files without compressing them.
+    zip_path = zipPath(folder)
+    comment = "fargo2html level=%d" % level
+    compress_type = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+    changed = set(os.path.normpath(file_name) for file_name in changed)
+    try:
+        old = zipfile.ZipFile(zip_path)
+        if old.comment != comment:
+            old.close()
+            old = None
+    except (IOError, zipfile.BadZipfile):
+        old = None
+
+    # entries are named from the folder's parent down, e.g. data/mysite/index.html
+    top = os.path.dirname(os.path.dirname(os.path.abspath(folder)))
+    entries = []
     for root, dirs, files in os.walk("%s/" % folder):
         for file in files:
-            zipp.write(os.path.join(root,file))
+            if file in (MANIFEST_NAME, POSTS_NAME): continue
+            path = os.path.join(root,file)
+            st = os.stat(path)
+            # a zip keeps times to two seconds, so an odd second never matches
+            date_time = time.localtime(st.st_mtime)[0:6]
+            date_time = date_time[:5] + (date_time[5] // 2 * 2,)
+            zinfo = zipfile.ZipInfo(os.path.relpath(os.path.abspath(path), top), date_time)
+            zinfo.external_attr = (st[0] & 0xFFFF) << 16L
+            zinfo.compress_type = compress_type
+            zinfo.file_size = st.st_size
+            reuse = None
+            if old is not None and os.path.normpath(path) not in changed:
+                try:
+                    reuse = old.getinfo(zinfo.filename)
+                except KeyError:
+                    pass
+                if reuse is not None and (reuse.file_size, reuse.date_time) != (zinfo.file_size, zinfo.date_time):
+                    reuse = None
+            entries.append((path, zinfo, reuse))
+
+    pool = ThreadPool(max(jobs, 1))
+    compressed = pool.imap(lambda path: zipEntry(path, level), [path for path, zinfo, reuse in entries if reuse is None])
+    temp_path = "%s.%s.tmp" % (zip_path, os.getpid())
+    zipp = zipfile.ZipFile(temp_path, 'w', compress_type, allowZip64=True)
+    reused = 0
+    for path, zinfo, reuse in entries:
+        if reuse is None:
+            zinfo.CRC, zinfo.file_size, raw = compressed.next()
+        else:
+            zinfo.CRC = reuse.CRC
+            raw = zipReadRaw(old, reuse)
+            reused += 1
+        zipWriteRaw(zipp, zinfo, raw)
+    zipp.comment = comment
     zipp.close()
+    pool.close()
+    if old is not None:
+        old.close()
+    os.rename(temp_path, zip_path)
+    return len(entries) - reused, reused
 
-def buildFeed(feed_title, feed_link, feed_desc, feed_posts, feed_path):
+def buildFeed(feed_title, feed_link, feed_desc, feed_posts, feed_path, writer=None):
     rss = PyRSS2Gen.RSS2(
     title = feed_title,
     link = feed_link,
@@ -344,423 +2446,510 @@ def buildFeed(feed_title, feed_link, feed_desc, feed_posts, feed_path):
     lastBuildDate = datetime.datetime.now(),
     items = feed_posts
     )
-    rss.write_xml(open(feed_path + "/rss.xml", "w+"))
+    writer = writer or OutputWriter()
+    writer.stream(feed_path + "/rss.xml", lambda fh: rss.write_xml(fh, "utf-8"))
 
-def parse(outline_url, my_folder, my_home_index_page):
+def parse(outline_url, my_folder, my_home_index_page, stream=False, fetch_jobs=FETCH_JOBS, cache=None, force=False, writer=None, jobs=1, manifest=None, stats=None, lazy=None, zipping=False):
     global DEBUG
     OPTIONS = {}
     TEMPLATES = {}
     PAGES = {}
-    FILENAMES = []
+    FILENAMES = FileNames()
     GLOSSARY_COMPLETE = False
     CALENDARS = {}
     GLOSSARY = DEFAULT_GLOSSARY.copy()
-    data_folder, my_folder = os.path.split(my_folder)
-    working_dir, DATA_FOLDER = os.path.split(data_folder)
-    os.chdir(working_dir)
-    base_folder = "%s/%s" % (DATA_FOLDER, my_folder)
-
-    mkdir_p(base_folder)
-    outline_url = re.sub('www','dl',outline_url)
-    if 'usercontent' not in outline_url:
-        outline_url = re.sub('dropbox','dropboxusercontent', outline_url)
-    outline = list(opml.from_string(requests.get(outline_url).content))
-
-
-    for i, node in enumerate(outline):
-        if node.text == '#glossary':
-            GLOSSARY.update(grabChildren(outline.pop(i)))
-        elif node.text == '#templates':
-            TEMPLATES.update(grabChildren(outline.pop(i)))
+    # paths are built on the folder as given; parse never changes directory
+    # so several sites can be built side by side
+    base_folder = os.path.normpath(my_folder)
+    if stats is None:
+        stats = Stats()
+    stats.lap('fetch')
+
+    if writer is None:
+        writer = OutputWriter()
+    had_output = writer.output.start(base_folder)
+    if manifest is None:
+        # only options that are on, so a manifest from before they existed
+        # still matches
+        settings = {}
+        if writer.minify:
+            settings['minify'] = True
+        if lazy:
+            settings['lazy'] = list(lazy)
+        if my_home_index_page:
+            settings['index'] = my_home_index_page
+        manifest = Manifest(base_folder, force, writer.output, settings)
+    writer.manifest = manifest
+    store = PostStore(writer.output.openPosts(base_folder))
+    renderer = Renderer(jobs, stats)
+    try:
+        outline_url = outlineUrl(outline_url)
+        session = makeSession(fetch_jobs)
+        if cache is not None:
+            cache.reset()
+        def received(url):
+            return cache is None or url not in cache.served
+        if stream:
+            # top level nodes are handled as they arrive, #glossary and
+            # #templates included, and includes once they are fetched, with
+            # BottomUp settling what the default order would have made of them
+            source = openOutline(outline_url, session, cache)
+            outline = streamOutline(CountingReader(source, stats, received(outline_url)))
+            outline = prefetchIncludes(outline, session, fetch_jobs, cache)
+            glossary_values = DEFAULT_GLOSSARY.copy()
         else:
-            first_word = node.text.split(' ')[0]
-            if first_word in GLOSSARY_OPTIONS:
-                try:
-                    value = OPTIONS[first_word[1:]]
-                except:
-                    value = node.text
-                GLOSSARY.update(GLOSSARY_FUNCTIONS[first_word](value))
-
-    for k,v in GLOSSARY.items():
-        if type(v[0]) == type([]):
-            GLOSSARY[k] = ''.join(v[1])
-
-    for k,v in TEMPLATES.items():
-        if type(v[0]) == type([]):
-            TEMPLATES[k] = (v[0],''.join(v[1]))
-
-    GLOSSARY_COMPLETE = True
-
-    while outline:
-        next_node = outline.pop()
-        try:
-            if next_node.type == 'include':
-                real_url = re.sub('dropbox','dropboxusercontent',next_node.url)
-                real_url = re.sub('https','http',real_url)
-                include = list(opml.from_string(requests.get(real_url).content))
-                nodes = include
-            else:
+            content = fetchOutline(outline_url, session, cache)
+            stats.fetch(content, received(outline_url))
+            # with a cache, an outline that has not changed is not parsed again
+            outline, GLOSSARY, templates = readMainOutline(outline_url, content, cache)
+            includes = fetchIncludes(outline, session, fetch_jobs, cache)
+            for url, include in includes.items():
+                stats.fetch(include, received(url))
+            sources = sourcesDigest(content, includes)
+            manifest.setSources(sources)
+            target = None
+            if writer.uploader is not None:
+                target = writer.uploader.target.name
+            # the cache may be shared with other folders built from the same
+            # outline, so what this one was last built from is in its manifest
+            if cache is not None and had_output and manifest.current(writer.compressor is not None, sources, target, zipping):
+                cache.commit()
+                raise NothingToDo("%s has not changed, nothing to do" % outline_url)
+
+            stats.lap('settings')
+            TEMPLATES.update(templates)
+
+            # the outline has always been rendered from the bottom up
+            outline.reverse()
+            outline = [(position, node, None) for position, node in enumerate(outline)]
+
+        GLOSSARY = compileGlossary(GLOSSARY)
+        GLOSSARY_COMPLETE = True
+        renderer.setup(TEMPLATES, GLOSSARY)
+        # in stream mode this includes reading the outline as it downloads
+        stats.lap('pages')
+
+        def writePage(v, file_name, rendered):
+            split, new_data = rendered
+            unit = {'digest': v['digest']}
+            if split:
+                unit['split'] = []
+            for ec_id, fragment in split:
+                fragment_name = "%s.%s.html" % (file_name, ec_id)
+                writer.write(fragment_name, fragment + "\n")
+                unit['split'].append(manifest.relative(fragment_name))
+            manifest.add("page:%s" % v['name'], unit, file_name)
+            changed = writer.write(file_name, new_data + "\n")
+            if os.path.basename(file_name) == my_home_index_page:
+                if changed:
+                    print file_name
+                # copied whenever it is rendered, which it is when -i changes
+                writer.write(os.path.join(os.path.split(file_name)[0], "index.html"), new_data + "\n")
+
+        # A streamed page is rendered as soon as it arrives, taking the glossary
+        # and templates to be what has arrived so far and the blogHomeTitle
+        # below it to be the default, and written as soon as it is rendered,
+        # with at most jobs of them in flight. Its node is kept in a spool file,
+        # and once the whole outline is in, a page for which any of that turned
+        # out wrong is rendered again from there.
+        order = BottomUp()
+        streamed, kept, in_flight = [], {}, []
+        spool = None
+        if stream:
+            spool = tempfile.TemporaryFile()
+
+        def flushPages(limit):
+            while len(in_flight) > limit:
+                record, file_name, result = in_flight.pop(0)
+                v = record['page']
+                if result is None:
+                    manifest.add("page:%s" % v['name'], v['unit'], file_name)
+                    record['skipped'] = True
+                    stats.skipped += 1
+                else:
+                    writePage(v, file_name, result.get())
+
+        def streamPage(record, title, node=None):
+            page = record['page']
+            rules, template = TEMPLATES[record['type']]
+            digest = unitDigest(record['node'], template, rules, GLOSSARY, title, '/', record['desc'], my_home_index_page)
+            if digest == record['digest']:
+                return
+            if record.get('skipped'):
+                record['skipped'] = False
+                stats.skipped -= 1
+            page['digest'] = record['digest'] = digest
+            file_name = "%s/%s" % (base_folder, page['name'])
+            if file_name not in FILENAMES:
+                FILENAMES.allocate(file_name)
+            page['unit'] = manifest.get("page:%s" % page['name'], digest, file_name)
+            result = None
+            if page['unit'] is None:
+                if node is None:
+                    offset, size = record['spool']
+                    spool.seek(offset)
+                    node = opml.OutlineElement(etree.fromstring(spool.read(size)))
+                values = {'blogHomeTitle': title, 'pageTitle': page['text'], 'pageDescription': record['desc']}
+                split = None
+                if lazy:
+                    split = tuple(lazy) + ("%s." % os.path.basename(page['name']),)
+                result = renderer.submit(('page', nodeElement(node), record['type'], values, title, '/', split))
+            in_flight.append((record, file_name, result))
+            flushPages(max(jobs, 1) - 1)
+
+        # the node after each #glossary and #templates is not looked at for
+        # settings, which is how readSettings() has always read them
+        skip_position = None
+        for position, next_node, include in outline:
+            if stream:
+                first_word = next_node.text.split(' ')[0]
+                if position == skip_position:
+                    pass
+                elif next_node.text in ('#glossary', '#templates'):
+                    if next_node.text == '#glossary':
+                        glossary_values.update(readGlossary(next_node))
+                    else:
+                        TEMPLATES.update(readTemplates(next_node))
+                    GLOSSARY = compileGlossary(glossary_values)
+                    renderer.setup(TEMPLATES, GLOSSARY)
+                    skip_position = position + 1
+                    continue
+                elif first_word in GLOSSARY_OPTIONS:
+                    glossary_values.update(GLOSSARY_FUNCTIONS[first_word](next_node.text))
+                    GLOSSARY = compileGlossary(glossary_values)
+                    renderer.setup(TEMPLATES, GLOSSARY)
+            try:
+                if next_node.type == 'include':
+                    if stream:
+                        stats.fetch(include, received(includeUrl(next_node)))
+                        nodes = readOutline(includeUrl(next_node), include, cache)
+                    else:
+                        nodes = readOutline(includeUrl(next_node), includes[includeUrl(next_node)], cache)
+                else:
+                    nodes = [next_node]
+            except:
                 nodes = [next_node]
-        except:
-            nodes = [next_node]
 
-        for node in nodes:
-            try:
-                if node.icon == 'calendar':
+            # the blogHomeTitle set earlier in the same include
+            title = None
+            for place, node in enumerate(nodes):
+                try:
+                    if node.icon == 'calendar':
+                        try:
+                            i_title = node.name
+                        except:
+                            i_title = node.text
+                        if stream:
+                            order.calendar(position, place, ('Home', node, i_title))
+                        else:
+                            CALENDARS = addCalendar('Home',node,i_title, CALENDARS)
+                        continue
+                except:
+                    pass
+                try:
+                    if node[0].icon == 'calendar':
+                        try:
+                            i_title = node[0].name
+                        except:
+                            i_title = node.text
+                        if stream:
+                            order.calendar(position, place, (node.text, node[0], i_title))
+                        else:
+                            CALENDARS = addCalendar(node.text,node[0],i_title, CALENDARS)
+                        continue
+                except:
+                    pass
+                if node.text[0] == '#':
+                    key, value = readOption(node.text)
+                    if stream:
+                        order.option(position, place, key, value, OPTIONS)
+                        if key == 'blogHomeTitle':
+                            title = value
+                    else:
+                        OPTIONS[key] = value
+                else:
+                    brandLink = '/'
+                    page = {}
                     try:
-                        i_title = node.name
+                        this_type = node.type
                     except:
-                        i_title = node.text
-                    CALENDARS = addCalendar('Home',node,i_title, CALENDARS)
-                    continue
-            except:
-                pass
-            try:
-                if node[0].icon == 'calendar':
+                        this_type = 'outline'
+                    page.update(nodeItems(node))
+                    page_desc = page.get('pageDescription', ' ')
+                    if 'name' not in page:
+                        page['name'] = makeName(page['text'])
+                    if 'url' not in page:
+                        page['url'] = "/%s" % page['name']
+                    if stream:
+                        if order.keep(page['name'], position, place):
+                            xml = etree.tostring(nodeElement(node)._root)
+                            spool.seek(0, 2)
+                            record = {'page': page, 'type': this_type, 'desc': page_desc, 'position': position,
+                                      'title': title, 'node': nodeDigest(node), 'spool': (spool.tell(), len(xml)), 'digest': None}
+                            spool.write(xml)
+                            streamed.append(record)
+                            kept[page['name']] = record
+                            if this_type in TEMPLATES:
+                                streamPage(record, title or 'Home', node)
+                        continue
+                    blogHomeTitle = OPTIONS.get('blogHomeTitle','Home')
                     try:
-                        i_title = node[0].name
-                    except:
-                        i_title = node.text
-                    CALENDARS = addCalendar(node.text,node[0],i_title, CALENDARS)
-                    continue
-            except:
-                pass
-            if node.text[0] == '#':
-                option = node.text[1:].rstrip().lstrip()
-                parts = option.split(' ')
-                if len(parts) < 2:
-                    OPTIONS[option] = True
-                else:
-                    key, value = parts[0], ' '.join(parts[1:])
-                    if value[0] == '[':
-                        value = random.choice([v.strip() for v in value[1:-1].split(',')])
-                    elif value[0] == '"':
-                        value = value[1:-1]
-                    if value.lower() in ['true','false']:
-                        OPTIONS[key] = bool(value)
+                        rules, template = TEMPLATES[this_type]
+                    except Exception as e:
+                        raise Usage("#templates node required until I pull default templates from Trex. \n\n%s" % e.message)
+                    # page names are unique, so a page always gets base_folder/name
+                    page['digest'] = unitDigest(node, template, rules, GLOSSARY, blogHomeTitle, brandLink, page_desc, my_home_index_page)
+                    page['unit'] = manifest.get("page:%s" % page['name'], page['digest'], "%s/%s" % (base_folder, page['name']))
+                    if page['unit'] is None:
+                        values = {'blogHomeTitle': blogHomeTitle, 'pageTitle': page['text'], 'pageDescription': page_desc}
+                        # split out subtrees sit beside the page, named after it
+                        split = None
+                        if lazy:
+                            split = tuple(lazy) + ("%s." % os.path.basename(page['name']),)
+                        page['job'] = ('page', nodeElement(node), this_type, values, blogHomeTitle, brandLink, split)
                     else:
-                        try:
-                            OPTIONS[key] = int(value)
-                        except:
-                            OPTIONS[key] = value
+                        stats.skipped += 1
+                    PAGES[page['name']] = page
+
+        if stream:
+            # now that everything below each page is known
+            flushPages(0)
+            for record in streamed:
+                if kept[record['page']['name']] is not record:
+                    continue
+                if record['type'] not in TEMPLATES:
+                    raise Usage("#templates node required until I pull default templates from Trex. \n\n%s" % record['type'])
+                title = record['title']
+                if title is None:
+                    title = order.title(record['position'], 'Home')
+                streamPage(record, title)
+            flushPages(0)
+            spool.close()
+            for args in order.orderedCalendars():
+                CALENDARS = addCalendar(*(args + (CALENDARS,)))
+
+        # pages are rendered as they are written, one at a time or a few ahead
+        # on the pool, rather than all being held until the last is done
+        rendering = []
+        for k, v in PAGES.items():
+            file_name = FILENAMES.allocate("%s/%s" % (base_folder,v['name']))
+            if 'job' in v:
+                rendering.append((v, file_name))
             else:
-                brandLink = '/'
-                blogHomeTitle = OPTIONS.get('blogHomeTitle','Home')
-                page = {}
+                manifest.add("page:%s" % v['name'], v['unit'], file_name)
+        rendered = renderer.map([v.pop('job') for v, file_name in rendering])
+        for (v, file_name), result in itertools.izip(rendering, rendered):
+            writePage(v, file_name, result)
+
+        stats.lap('posts')
+        blogHomeTitle = OPTIONS.get('blogHomeTitle','Home')
+        posts = {"Home": array.array('l')}
+        # the digest of every post by row id, which is all an archive page needs
+        # to tell whether its listings changed
+        post_digests = {}
+        feed = Feed(OPTIONS.get('feedCount',20))
+        domain = "http://%s" % OPTIONS.get('domainName','')
+        disqusGroupName = OPTIONS.get('disqusGroupName', False)
+        for base, calendar_stuff in CALENDARS.items():
+            ycals, index_title = calendar_stuff
+            # lay out every post in the calendar before rendering any of them so
+            # each post knows its neighbours, and so its digest can be checked
+            entries = []
+            while ycals:
+                ycal = ycals.pop()
                 try:
-                    this_type = node.type
+                    index_desc = ycal.description
                 except:
-                    this_type = 'outline'
-                try:
-                    rules, template = TEMPLATES[this_type]
-                except Exception as e:
-                    raise Usage("#templates node required until I pull default templates from Trex. \n\n%s" % e.message)
-                template = ''.join(template)
-                for k,v in node._root.items():
-                    template = re.sub('<%%%s%%>' % k,v,template)
-                    page[k] = v
-                page_desc = page.get('pageDescription', ' ')
-                template = re.sub('<%blogHomeTitle%>', blogHomeTitle, template)
-                template = re.sub('<%pageTitle%>', page['text'], template)
-                template = re.sub('<%pageDescription%>', page_desc, template)
-                if 'name' not in page:
-                    page['name'] = makeName(page['text'])
-                if 'url' not in page:
-                    page['url'] = "/%s" % page['name']
-                waste, bodytext = grabData(node, rules, this_type)
-                bodytext.append('</div>') # not sure why we need this - something's not right
-                bodytext = ''.join(bodytext)
-                data = re.sub('<%bodytext%>',bodytext,template)
-                page['bodytext'] = bodytext
-                template = subData(data, GLOSSARY)
-                template = re.sub('<%BRANDMENU%>', '<a class="brand" href="<%BRANDLINK%>"><%BRAND%></a>', template)
-                template = re.sub('<%BRAND%>', blogHomeTitle, template)
-                template = re.sub('<%BRANDLINK%>', brandLink, template)
-
-                page['data'] = template
-                PAGES[page['name']] = page
-
-    for k, v in PAGES.items():
-        file_name = getFileName("%s/%s" % (base_folder,v['name']),FILENAMES)
-        FILENAMES.append(file_name)
-        save_file = False
-        new_data = v['data']
-
-        if os.path.exists(file_name):
-            fh = open(file_name)
-            file_data = fh.read()[:-1]
-            fh.close()
-            save_file = (file_data != new_data)
-        else:
-            save_file = True
-        if save_file:
-            fh = open(file_name, "w+")
-            print >>fh, new_data
-            fh.close()
-            if os.path.basename(file_name) == my_home_index_page:
-                print file_name
-                fh = open(os.path.join(os.path.split(file_name)[0], "index.html"), "w+")
-                print >>fh, new_data
-                fh.close()
-
-    blogHomeTitle = OPTIONS.get('blogHomeTitle','Home')
-    posts = {"Home": []}
-    feedcount = OPTIONS.get('feedCount',20)
-    domain = "http://%s" % OPTIONS.get('domainName','')
-    feed_posts = []
-    for base, calendar_stuff in CALENDARS.items():
-        ycals, index_title = calendar_stuff
-        page_data, path_name = None, None
-        this_post_data, this_path_name = None, None
-        while ycals:
-            if this_post_data:
-                file_name = getFileName("%s/%s" % (base_folder, this_path_name), FILENAMES)
-                FILENAMES.append(file_name)
-                save_file = False
-                new_data = re.sub('<nextprev>', getPrevNextLinks(prev_path_name, path_name), this_post_data)
-                if os.path.exists(file_name):
-                    fh = open(file_name)
-                    file_data = fh.read()[:-1]
-                    fh.close()
-                    save_file = (file_data != new_data)
+                    index_desc = ''
+                year_title = ycal.text
+                year_name = ycal.text
+                year_num = ycal.text
+                if base == 'Home':
+                    brandLink = '/'
+                    sub_folder = ''
+                    root_folder = base_folder
+                    year_path = year_num
+                    blog_key = "Home"
                 else:
-                    save_file = True
-                if save_file:
-                    fh = open(file_name, "w+")
-                    print >>fh, new_data
-                    fh.close()
-            ycal = ycals.pop()
-            try:
-                index_desc = ycal.description
-            except:
-                index_desc = ''
-            year_title = ycal.text
-            year_name = ycal.text
-            year_num = ycal.text
-            if base == 'Home':
-                brandLink = '/'
-                sub_folder = ''
-                root_folder = base_folder
-                year_path = year_num
-            else:
-                sub_folder = makeName(base)
-                brandLink = "/%s" % sub_folder
-                root_folder = "%s/%s" % (base_folder,sub_folder)
-                if not os.path.exists(root_folder): os.mkdir(root_folder)
-                year_path = "%s/%s" % (sub_folder, year_num)
-                if (sub_folder,index_title) not in posts: posts[(sub_folder,index_title)] = []
-            year_folder = "%s/%s" % (base_folder, year_path)
-            try:
-                if not os.path.exists(year_folder): os.mkdir(year_folder)
-            except:
-                mkdir_p(year_folder)
-            for mcal in ycal:
-                month_title = mcal.text
-                month_name = month_title.split(' ')[0]
-                month_num = MONTHS[month_name]
-                month_path = "%s/%s" % (year_path, month_num)
-                month_folder = "%s/%s" % (year_folder, month_num)
-                if not os.path.exists(month_folder): os.mkdir(month_folder)
-                for dcal in mcal:
-                    day_title = dcal.text
-                    day_name = dcal.text
-                    day_num = "%02d" % float(day_title.split(' ')[1])
-                    day_path = "%s/%s" % (month_path, day_num)
-                    day_folder = "%s/%s" % (month_folder, day_num)
-                    if not os.path.exists(day_folder): os.mkdir(day_folder)
-                    trail = [(year_path,year_title),(month_path,month_title),(day_path,day_title)]
-                    trail_links = """
+                    sub_folder = makeName(base)
+                    brandLink = "/%s" % sub_folder
+                    root_folder = "%s/%s" % (base_folder,sub_folder)
+                    writer.output.makedirs(root_folder)
+                    year_path = "%s/%s" % (sub_folder, year_num)
+                    blog_key = (sub_folder,index_title)
+                    if blog_key not in posts: posts[blog_key] = array.array('l')
+                year_folder = "%s/%s" % (base_folder, year_path)
+                writer.output.makedirs(year_folder)
+                for mcal in ycal:
+                    month_title = mcal.text
+                    month_name = month_title.split(' ')[0]
+                    month_num = MONTHS[month_name]
+                    month_path = "%s/%s" % (year_path, month_num)
+                    month_folder = "%s/%s" % (year_folder, month_num)
+                    writer.output.makedirs(month_folder)
+                    for dcal in mcal:
+                        day_title = dcal.text
+                        day_name = dcal.text
+                        day_num = "%02d" % float(day_title.split(' ')[1])
+                        day_path = "%s/%s" % (month_path, day_num)
+                        day_folder = "%s/%s" % (month_folder, day_num)
+                        writer.output.makedirs(day_folder)
+                        trail = [(year_path,year_title),(month_path,month_title),(day_path,day_title)]
+                        trail_links = """
                     <nextprev>
                     <div class="breadcrumbs"><a href="/%s">%s</a> / %s</div>
                     """ % (sub_folder, base, " / ".join(['<a href="/%s/">%s</a>' % (l,n) for l,n in trail]))
+                        archives = [blog_key] + trail
+
+                        for node in dcal:
+                            page = dict(nodeItems(node))
+                            if 'name' not in page:
+                                page['name'] = makeName(page['text'])
+                            path_name = "%s/%s" % (day_path,page['name'])
+                            entries.append((node, page, path_name, index_desc, brandLink, trail_links, archives))
+
+            # using page below because it matches above
+            laid_out, jobs = [], []
+            for i, entry in enumerate(entries):
+                node, page, path_name, index_desc, brandLink, trail_links, archives = entry
+                # the post laid out just before this one is "Next", the one after it "Prev"
+                next_path_name = prev_path_name = None
+                if i > 0: next_path_name = entries[i-1][2]
+                if i + 1 < len(entries): prev_path_name = entries[i+1][2]
+                file_name = FILENAMES.allocate("%s/%s" % (base_folder, path_name))
+                try:
+                    this_type = node.type
+                except:
+                    this_type = 'outline'
+                rules, template = TEMPLATES[this_type]
+                page_desc = page.get('pageDescription', index_desc)
+                page['url'] = "/%s" % path_name
+                digest = unitDigest(node, template, rules, GLOSSARY, blogHomeTitle, index_title, brandLink,
+                    trail_links, page_desc, disqusGroupName, outline_url, next_path_name, prev_path_name)
+                unit_key = "post:%s" % path_name
+                unit = manifest.get(unit_key, digest, file_name)
+                if unit is not None:
+                    unit = store.find(manifest.relative(file_name), digest)
+                if unit is None:
+                    # Do this after listing so comments don't show on index pages
+                    commentsString = ''
+                    if disqusGroupName:
+                        uniq_id = outline_url + node.created
+                        commentsString = """
+                    <script>var disqus_identifier = '%s';</script><a onclick="showHideComments ()"><span id="idShowHideComments" style="cursor: pointer;"></span></a><div class="divDisqusComments" id="idDisqusComments" style="visibility: visible;" ><div id="disqus_thread"></div></div><script type="text/javascript" src="http://disqus.com/forums/%s/embed.js"></script></div>
+                    """ % (uniq_id, disqusGroupName)
+                    values = {'blogHomeTitle': blogHomeTitle, 'pageTitle': page['text'], 'pageDescription': page_desc}
+                    jobs.append(('post', nodeElement(node), this_type, values, index_title, brandLink, (trail_links, commentsString)))
+                laid_out.append((node, page, file_name, page_desc, digest, unit_key, unit, next_path_name, prev_path_name, archives))
+
+            rendered = renderer.map(jobs)
+            for node, page, file_name, page_desc, digest, unit_key, unit, next_path_name, prev_path_name, archives in laid_out:
+                if unit is not None:
+                    row, listing = unit
+                    stats.skipped += 1
+                else:
+                    bodytext, page_data = rendered.next()
+                    listing = page['text'], bodytext, page['url'], page_desc
+                    new_data = page_data.replace('<nextprev>', getPrevNextLinks(next_path_name, prev_path_name))
+                    writer.write(file_name, new_data + "\n")
+                    row = store.add(manifest.relative(file_name), digest, listing)
+                manifest.add(unit_key, {'digest': digest}, file_name)
+                post_digests[row] = digest
 
-                    # using page below because it matches above
-                    for node in dcal:
-                        prev_post_data = this_post_data
-                        prev_path_name = this_path_name
-                        this_post_data = page_data
-                        this_path_name = path_name
-                        page = {}
-                        try:
-                            this_type = node.type
-                        except:
-                            this_type = 'outline'
-                        rules, template = TEMPLATES[this_type]
-                        template = ''.join(template)
-                        for k,v in node._root.items():
-                            template = re.sub('<%%%s%%>' % k,v,template)
-                            page[k] = v
-                        page_desc = page.get('pageDescription', index_desc)
-                        template = re.sub('<%blogHomeTitle%>', blogHomeTitle, template)
-                        template = re.sub('<%pageTitle%>', page['text'], template)
-                        template = re.sub('<%pageDescription%>', page_desc, template)
-                        if 'name' not in page:
-                            page['name'] = makeName(page['text'])
-                        if 'url' not in page:
-                            page['url'] = "/%s" % page['name']
-                        waste, bodytext = grabData(node, rules, this_type)
-                        bodytext.append('</div><!--FIX-->') # not sure why we need this - something's not right
-
-
-
-                        bodytext = '\n'.join(bodytext)
-                        data = re.sub('<%bodytext%>',bodytext,template)
-                        page['bodytext'] = bodytext
-                        template = re.sub('</h1>', '</h1>%s' % trail_links, subData(data, GLOSSARY))
-
-                        template = re.sub('<%BRANDMENU%>', '<a class="brand" href="<%BRANDLINK%>"><%BRAND%></a>', template)
-                        template = re.sub('<%BRAND%>', index_title, template)
-                        template = re.sub('<%BRANDLINK%>', brandLink, template)
-
-                        path_name = "%s/%s" % (day_path,page['name'])
-                        page['url'] = "/%s" % path_name
-                        listing = page['text'], page['bodytext'], page['url'], page_desc
-                        if feedcount:
-                            try:
-                                if node.isFeedItem == 'true':
-                                    feed_posts.append(
-                                        PyRSS2Gen.RSSItem(
-                                        title = page['text'],
-                                        link = domain + page['url'],
-                                        description = page['bodytext'],
-                                        guid = domain + page['url'],
-                                        pubDate = page['created']
-                                        )
-                                    )
-                                    feedcount -= 1
-                            except:
-                                pass
-
-                        # Do this after listing so comments don't show on index pages
-                        disqusGroupName = OPTIONS.get('disqusGroupName', False)
-                        commentsString = ''
-                        if disqusGroupName:
-                            uniq_id = outline_url + node.created
-                            commentsString = """
-                            <script>var disqus_identifier = '%s';</script><a onclick="showHideComments ()"><span id="idShowHideComments" style="cursor: pointer;"></span></a><div class="divDisqusComments" id="idDisqusComments" style="visibility: visible;" ><div id="disqus_thread"></div></div><script type="text/javascript" src="http://disqus.com/forums/%s/embed.js"></script></div>
-                            """ % (uniq_id, disqusGroupName)
-
-                        page_data = re.sub('<!-- COMMENTS -->', commentsString, template)
-                        page['data'] = page_data
-
-                        if sub_folder:
-                            posts[(sub_folder,index_title)].append(listing)
-                        else:
-                            posts["Home"].append(listing)
-                        for path_info in [(year_path, year_title), (month_path, month_title), (day_path, day_title)]:
-                            if not path_info[0]: continue
-                            if path_info not in posts:
-                                if sub_folder:
-                                    path_info = path_info[0], path_info[1]
-                                posts[path_info] = []
-                            posts[path_info].append(listing)
-                        if this_post_data:
-                            file_name = getFileName("%s/%s" % (base_folder, this_path_name), FILENAMES)
-                            FILENAMES.append(file_name)
-                            save_file = False
-                            new_data = re.sub('<nextprev>', getPrevNextLinks(prev_path_name, path_name), this_post_data)
-                            if os.path.exists(file_name):
-                                fh = open(file_name)
-                                file_data = fh.read()[:-1]
-                                fh.close()
-                                save_file = (file_data != new_data)
-                            else:
-                                save_file = True
-                            if save_file:
-                                fh = open(file_name, "w+")
-                                print >>fh, new_data.encode('utf-16')
-                                fh.close()
-
-            if not ycals:
-                prev_post_data = this_post_data
-                prev_path_name = this_path_name
-                this_post_data = page_data
-                this_path_name = path_name
-                path_name = None
-                if this_post_data:
-                    file_name = getFileName("%s/%s" % (base_folder, this_path_name), FILENAMES)
-                    FILENAMES.append(file_name)
-                    save_file = False
-                    new_data = re.sub('<nextprev>', getPrevNextLinks(prev_path_name, path_name), this_post_data)
-                    if os.path.exists(file_name):
-                        fh = open(file_name)
-                        file_data = fh.read()[:-1]
-                        fh.close()
-                        save_file = (file_data != new_data)
-                    else:
-                        save_file = True
-                    if save_file:
-                        fh = open(file_name, "w+")
-                        print >>fh, new_data
-                        fh.close()
-
-    # Generate Feed
-    date_format = "%a, %d %b %Y %H:%M:%S %Z"
-    feed_posts.sort(key=lambda x: datetime.datetime.strptime(x.pubDate, date_format), reverse=True)
-    buildFeed(OPTIONS['rssTitle'], domain, page_desc, feed_posts, base_folder)
-
-    # iterate over posts
-    for path_info, these_posts in posts.items():
+                try:
+                    if node.isFeedItem == 'true':
+                        feed.add(page['text'], domain + page['url'], listing[1], page['created'])
+                except:
+                    pass
+
+                for path_info in archives:
+                    if path_info not in posts:
+                        posts[path_info] = array.array('l')
+                    posts[path_info].append(row)
+
+        # Generate Feed, unless its items are the same as last time
+        stats.lap('feed')
+        feed_file = base_folder + "/rss.xml"
+        feed_digest = hashlib.sha1(json.dumps([OPTIONS['rssTitle'], domain, page_desc, feed.entries()])).hexdigest()
+        if manifest.get("feed", feed_digest, feed_file) is None:
+            buildFeed(OPTIONS['rssTitle'], domain, page_desc, feed.items(), base_folder, writer)
+        manifest.add("feed", {'digest': feed_digest}, feed_file)
+
+        # iterate over posts, rendering the frame of each archive once. Each
+        # page of an archive is built from its frame and the posts listed on it,
+        # so a page is only rebuilt when one of those changed; an archive whose
+        # pages are all current is not rendered at all.
+        stats.lap('archives')
         count = OPTIONS.get('bloghomeItemCount',20)
-
-        chunks=[these_posts[x:x+count] for x in xrange(0, len(these_posts), count)]
-        for i,chunk in enumerate(chunks):
+        archives, jobs = [], []
+        rules, template = TEMPLATES.get('bloghome', (None, None))
+        for path_info, these_posts in posts.items():
             try:
-                pageDescription = chunks[0][0][-1]
+                pageDescription = store.listings(these_posts[:1])[0][-1]
             except:
                 pageDescription = OPTIONS.get('pageDescription',' ')
             blogHomeDescription = OPTIONS.get('blogHomeDescription', pageDescription)
-            if not i:
-                page_name = "index"
-            else:
-                page_name = str(i+1)
             if path_info == "Home":
                 brandLink = '/'
                 page_title = blogHomeTitle
                 page_desc = blogHomeDescription
-                file_name = getFileName("%s/%s.html" % (base_folder, page_name), FILENAMES)
-                FILENAMES.append(file_name)
+                folder = base_folder
             else:
                 path, page_title = path_info
                 brandLink = "/%s" % path.split('/')[0]
                 page_desc = pageDescription
-                file_name = getFileName("%s/%s/%s.html" % (base_folder, path, page_name), FILENAMES)
-                FILENAMES.append(file_name)
-            rules, template = TEMPLATES['bloghome']
-            template = ''.join(template)
-
-            # do the title and desc first to avoid overwriting with home title
-            template = re.sub("<\%blogHomeTitle\%>", page_title, template)
-            template = re.sub("<\%blogHomeDescription\%>", page_desc, template)
-            template = re.sub("<\%pageTitle\%>", page_title, template)
-            template = re.sub("<\%pageDescription\%>", page_desc, template)
-            template = subData(template, GLOSSARY)
-
-            template = re.sub('<%BRANDMENU%>', '<a class="brand" href="<%BRANDLINK%>"><%BRAND%></a>', template)
-            template = re.sub('<%BRAND%>', page_title, template)
-            template = re.sub('<%BRANDLINK%>', brandLink, template)
-
-            bodytext = ''
-            for title, page_data, page_url, page_desc in chunk:
-                bodytext += "<h2><a href=\"%s\">%s</a></h2>\n%s\n" % (page_url, title, page_data)
-            save_file = False
-            new_data = re.sub('<%bodytext%>', bodytext, template)
-            if os.path.exists(file_name):
-                fh = open(file_name)
-                file_data = fh.read()[:-1]
-                fh.close()
-                save_file = (file_data != new_data)
-            else:
-                save_file = True
-            if save_file:
-                fh = open(file_name, "w+")
-                print >>fh, new_data.encode('utf-16')
-                fh.close()
-            fh.close()
-
-    return base_folder
-
-def render(url, folder, ura, zipit=False, upload=None, s3profile=None, s3bucket=None, index_file=None):
+                folder = "%s/%s" % (base_folder, path)
+            values = {'blogHomeTitle': page_title, 'blogHomeDescription': page_desc, 'pageTitle': page_title, 'pageDescription': page_desc}
+            frame_digest = unitDigest(None, template, rules, GLOSSARY, sorted(values.items()), page_title, brandLink)
+            pages = []
+            for i, start in enumerate(xrange(0, len(these_posts), count)):
+                if not i:
+                    page_name = "index"
+                else:
+                    page_name = str(i+1)
+                file_name = FILENAMES.allocate("%s/%s.html" % (folder, page_name))
+                rows = these_posts[start:start+count]
+                digest = hashlib.sha1(frame_digest + ''.join(post_digests[row] for row in rows)).hexdigest()
+                unit_key = "archive:%s" % manifest.relative(file_name)
+                if manifest.get(unit_key, digest, file_name) is None:
+                    pages.append((file_name, rows))
+                else:
+                    stats.skipped += 1
+                manifest.add(unit_key, {'digest': digest}, file_name)
+            if pages:
+                archives.append(pages)
+                jobs.append(('index', None, 'bloghome', values, page_title, brandLink, None))
+
+        for pages, (waste, frame) in itertools.izip(archives, renderer.map(jobs)):
+            for file_name, rows in pages:
+                writer.write(file_name, archivePage(frame, store.listings(rows)))
+
+        renderer.close()
+        if writer.compressor is not None:
+            stats.lap('compress')
+            writer.compressPending()
+        stats.lap('manifest')
+        manifest.prune()
+        manifest.save()
+        store.close()
+        if cache is not None:
+            cache.saveParsed()
+            cache.commit()
+        stats.stop()
+        return base_folder
+    except:
+        # nothing a failed build did to the posts database is kept, so the
+        # next one, as with --watch, does not find it locked
+        renderer.terminate()
+        store.abandon()
+        raise
+    finally:
+        writer.output.finish()
+
+def render(url, folder, ura, zipit=False, upload=None, s3profile=None, s3bucket=None, index_file=None, stream=False, fetch_jobs=None, cache=None, force=False, list_changed=False, jobs=None, zip_level=None, upload_jobs=None, s3endpoint=None, report=None, stats=None, stats_top=None, stats_memory=False, output=None, precompress=False, minify=False, lazy=None, lazy_size=None):
+    # stats, if given, is called with the report --stats would save, once
+    # for every build. output is where the site goes, a MemoryOutput or
+    # TarOutput say, instead of the folder.
     if ura not in ["ABORT", "REPLACE", "UPDATE"]:
         raise Usage("second argument must be one of ABORT, REPLACE, or UPDATE")
     args = []
@@ -770,16 +2959,133 @@ def render(url, folder, ura, zipit=False, upload=None, s3profile=None, s3bucket=
     if s3profile: args.append("-p%s" % s3profile)
     if s3bucket: args.append("-b%s" % s3bucket)
     if index_file: args.append("-i%s" % index_file)
+    if stream: args.append("--stream")
+    if fetch_jobs: args.append("--fetch-jobs=%s" % fetch_jobs)
+    if cache is True: args.append("--cache")
+    elif cache: args.append("--cache-dir=%s" % cache)
+    if force: args.append("--force")
+    if list_changed: args.append("--changed")
+    if jobs: args.append("--jobs=%s" % jobs)
+    if zip_level is not None: args.append("--zip-level=%s" % zip_level)
+    if upload_jobs: args.append("--upload-jobs=%s" % upload_jobs)
+    if s3endpoint: args.append("--s3endpoint=%s" % s3endpoint)
+    if stats_top: args.append("--stats-top=%s" % stats_top)
+    if stats_memory: args.append("--stats-memory")
+    if precompress: args.append("--precompress")
+    if minify: args.append("--minify")
+    if lazy: args.append("--lazy=%s" % lazy)
+    if lazy_size: args.append("--lazy-size=%s" % lazy_size)
     args += [url, ura]
-    main(args)
+    return main(args, report, stats, output)
 
 
-def renderFromConfigFile():
+def buildSiteOnce(o_url, folder, home_index_page, stream, fetch_jobs, cache, force, jobs, list_changed, zipIt, zip_level, uploader, report, manifest=None, stats=None, output=None, compressor=None, minify=False, lazy=None):
+    # parse, zip and upload one site; returns the exit code and the writer;
+    # the caller stops stats once it returns
+    writer = OutputWriter(uploader=uploader, output=output, compressor=compressor, minify=minify)
+    if stats is None:
+        stats = Stats()
+    try:
+        folder_parsed = parse(o_url, folder, home_index_page, stream, fetch_jobs, cache, force, writer, jobs, manifest, stats, lazy, zipIt)
+    except NothingToDo, msg:
+        print msg.message
+        report['outcome'] = 'nothing to do'
+        return 0, writer
+    report['outcome'] = 'ok'
+    report['written'] = len(writer.changed)
+    report['unchanged'] = writer.unchanged
+    if list_changed:
+        for file_name in writer.changed:
+            print file_name
+    if minify and writer.minified[0]:
+        before, after = writer.minified
+        print "minified %d bytes of HTML to %d, %.1f%% smaller" % (before, after, 100.0 * (before - after) / before)
+    if zipIt:
+        stats.lap('zip')
+        zipdir(folder_parsed, zip_level, jobs, writer.changed)
+        writer.manifest.setZipped()
+        writer.manifest.save()
+    if uploader:
+        # only what is left once parse is done; most files go up while it runs
+        stats.lap('upload')
+        writer.publishPending()
+        done, failed = uploader.finish()
+        writer.manifest.setUploaded(uploader.target.name, done)
+        writer.manifest.save()
+        print "uploaded %d files to %s" % (len(done), uploader.target.name)
+        for key, error in failed:
+            print >> sys.stderr, "could not upload %s: %s" % (key, error)
+        if failed:
+            report['outcome'] = 'upload failed'
+            return 1, writer
+    return 0, writer
+
+def watch(url, cache, interval, fetch_jobs, build):
+    # Rebuilds the site whenever the outline or one of its includes changes.
+    # Every interval seconds they are all polled with conditional requests
+    # over one kept-alive session. The fetched outlines stay in PREFETCHED
+    # so a rebuild downloads nothing again, and the compiled templates and
+    # glossary and the manifest stay in memory from one build to the next.
+    # build has to use cache too, so what it fetches is polled from then on.
+    url = outlineUrl(url)
+    session = makeSession(fetch_jobs)
+    pool = ThreadPool(max(1, fetch_jobs))
+    def poll(source):
+        try:
+            content = cache.fetch(source, session)
+            PREFETCHED[(cache.folder, source)] = (content, source in cache.changed)
+        except Exception, e:
+            print >> sys.stderr, "could not fetch %s: %s" % (source, e)
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    previous = signal.signal(signal.SIGTERM, stop)
+    sources = [url]
+    manifest = None
+    first = True
+    try:
+        while True:
+            start = time.time()
+            cache.reset()
+            pool.map(poll, sources)
+            if first or cache.changed:
+                if (cache.folder, url) in PREFETCHED:
+                    try:
+                        sources = [url] + includeUrls(opml.from_string(PREFETCHED[(cache.folder, url)][0]))
+                    except Exception:
+                        pass
+                # includes that were dropped from the outline
+                for key in PREFETCHED.keys():
+                    if key[0] == cache.folder and key[1] not in sources:
+                        del PREFETCHED[key]
+                try:
+                    code, writer = build(manifest)
+                except Exception, e:
+                    # a half uploaded outline say; the cache keeps the copy
+                    # the last good build used, so the next poll tries again
+                    print >> sys.stderr, "could not build %s: %s" % (url, getattr(e, 'message', None) or e)
+                else:
+                    if writer.manifest is not None and writer.manifest.seen:
+                        manifest = writer.manifest.following()
+                    else:
+                        manifest = None
+                    if not first:
+                        print "%s changed, %d files written in %.2fs" % (", ".join(sorted(cache.changed)), len(writer.changed), time.time() - start)
+                first = False
+            time.sleep(max(0, interval - (time.time() - start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        pool.close()
+    return 0
+
+def readConfigFile():
+    # the settings of every section, as keyword arguments for render()
     config_settings = ConfigParser()
     config_settings.read("/etc/fargo2html.cfg")
     config_settings.read(os.path.join(os.environ["HOME"], ".fargo2htmlrc"))
+    sites = []
     for section in config_settings.sections():
-        print section
         outline_url = config_settings.get(section, "outline")
         try:
             folder = config_settings.get(section, "folder")
@@ -805,31 +3111,187 @@ def renderFromConfigFile():
             index_file = config_settings.get(section, "index_file")
         except:
             index_file = None
-        render(outline_url, folder, "UPDATE", zipIt, upload, s3profile, s3bucket, index_file)
-
-
-def main(argv=None):
+        try:
+            stream = bool(config_settings.get(section, "stream"))
+        except:
+            stream = False
+        try:
+            fetch_jobs = int(config_settings.get(section, "fetch_jobs"))
+        except:
+            fetch_jobs = None
+        try:
+            cache = config_settings.get(section, "cache")
+            if cache.lower() == "true": cache = True
+        except:
+            cache = None
+        try:
+            jobs = int(config_settings.get(section, "jobs"))
+        except:
+            jobs = None
+        try:
+            zip_level = int(config_settings.get(section, "zip_level"))
+        except:
+            zip_level = None
+        try:
+            upload_jobs = int(config_settings.get(section, "upload_jobs"))
+        except:
+            upload_jobs = None
+        try:
+            s3endpoint = config_settings.get(section, "s3endpoint")
+        except:
+            s3endpoint = None
+        try:
+            precompress = bool(config_settings.get(section, "precompress"))
+        except:
+            precompress = False
+        try:
+            minify = bool(config_settings.get(section, "minify"))
+        except:
+            minify = False
+        try:
+            lazy = int(config_settings.get(section, "lazy"))
+        except:
+            lazy = None
+        try:
+            lazy_size = int(config_settings.get(section, "lazy_size"))
+        except:
+            lazy_size = None
+        sites.append((section, dict(url=outline_url, folder=folder, ura="UPDATE", zipit=zipIt, upload=upload,
+            s3profile=s3profile, s3bucket=s3bucket, index_file=index_file, stream=stream, fetch_jobs=fetch_jobs,
+            cache=cache, jobs=jobs, zip_level=zip_level, upload_jobs=upload_jobs, s3endpoint=s3endpoint,
+            precompress=precompress, minify=minify, lazy=lazy, lazy_size=lazy_size)))
+    return sites
+
+def cacheFolder(cache):
+    # the cache setting of a site (True, a folder or None) as a folder
+    if cache is True:
+        return CACHE_FOLDER
+    return cache or None
+
+def defaultFolder(url):
+    return os.path.join(os.environ["HOME"], "fargo_outlines/%s" % url.split('/')[-1].split('.')[0])
+
+def buildSite(name, settings, results):
+    print name
+    report = {'outcome': 'failed'}
+    start = time.time()
+    try:
+        render(report=report, **settings)
+    except BaseException, e:
+        report['outcome'] = 'failed'
+        # Usage and NothingToDo keep their reason in message alone
+        report['error'] = str(getattr(e, 'message', None) or e)
+    report['seconds'] = time.time() - start
+    results.put((name, report))
+
+def buildSites(sites, jobs):
+    # Builds each site in its own process, jobs of them at a time, and
+    # returns a report for each. Sites that write to the same folder are
+    # never built at the same time.
+    results = multiprocessing.Queue()
+    pending, running, reports = list(sites), [], {}
+    def collect(timeout):
+        try:
+            name, report = results.get(True, timeout)
+            reports[name] = report
+        except Exception:
+            pass
+    while pending or running:
+        busy = [folder for name, folder, process in running]
+        for site in pending[:]:
+            if len(running) >= jobs:
+                break
+            name, settings = site
+            folder = os.path.abspath(settings['folder'] or defaultFolder(settings['url']))
+            if folder in busy:
+                continue
+            pending.remove(site)
+            process = multiprocessing.Process(target=buildSite, args=(name, settings, results))
+            process.start()
+            running.append((name, folder, process))
+            busy.append(folder)
+        collect(0.5)
+        for name, folder, process in running[:]:
+            if not process.is_alive():
+                process.join()
+                running.remove((name, folder, process))
+                if name not in reports:
+                    collect(1)
+                if name not in reports:
+                    reports[name] = {'outcome': 'failed', 'error': 'exit code %s' % process.exitcode, 'seconds': 0}
+    return [(name, reports[name]) for name, settings in sites]
+
+def renderFromConfigFile(jobs=None):
+    # Builds every site in the config file, several at once. Outlines,
+    # includes and templates shared between sites are fetched and compiled
+    # once, then a summary of each site is printed.
+    sites = readConfigFile()
+    if not sites:
+        return 0
+    if jobs is None:
+        jobs = min(len(sites), multiprocessing.cpu_count())
+    prefetch([settings for name, settings in sites])
+    reports = buildSites(sites, max(1, jobs))
+    print
+    print "%-24s %-14s %9s %8s %10s" % ("site", "outcome", "time", "written", "unchanged")
+    for name, report in reports:
+        print "%-24s %-14s %8.1fs %8s %10s" % (name, report['outcome'], report['seconds'], report.get('written', '-'), report.get('unchanged', '-'))
+    for name, report in reports:
+        if report.get('error'):
+            print >> sys.stderr, "%s: %s" % (name, report['error'])
+    if [name for name, report in reports if report['outcome'] not in ('ok', 'nothing to do')]:
+        return 1
+    return 0
+
+
+
+def saveStats(path, report):
+    if path == '-':
+        fh = sys.stdout
+    else:
+        fh = open(path + ".tmp", "w")
+    json.dump(report, fh, indent=2, sort_keys=True)
+    fh.write("\n")
+    if path != '-':
+        fh.close()
+        os.rename(path + ".tmp", path)
+
+def main(argv=None, report=None, on_stats=None, output=None):
     if argv is None:
         argv = sys.argv[1:]
+    if report is None:
+        report = {}
     try:
         try:
-            opts, args = getopt.getopt(argv, "hczu:p:b:f:i:", ["help","cfg","zip","upload=", "s3profile=", "s3bucket=", "folder=", "index="])
+            opts, args = getopt.getopt(argv, "hczu:p:b:f:i:", ["help","cfg","zip","upload=", "s3profile=", "s3bucket=", "folder=", "index=", "stream", "fetch-jobs=", "cache", "cache-dir=", "force", "changed", "jobs=", "zip-level=", "upload-jobs=", "s3endpoint=", "site-jobs=", "watch", "interval=", "stats=", "stats-top=", "stats-memory", "output=", "precompress", "minify", "lazy=", "lazy-size="])
         except getopt.error, msg:
             raise Usage(msg)
         zipIt = False
         s3, s3profile, s3bucket, folder, cfg = None, None, None, None, None
         home_index_page = None
+        stream = False
+        fetch_jobs = FETCH_JOBS
+        cache_dir = None
+        force = False
+        list_changed = False
+        jobs = 1
+        zip_level = 0
+        upload_folder, upload_jobs, s3endpoint = None, UPLOAD_JOBS, None
+        site_jobs = None
+        watching, interval = False, 1.0
+        stats_file, stats_top, stats_memory = None, 10, False
+        precompress, minify = False, False
+        lazy_depth, lazy_size = 0, 0
         for option, value in opts:
             if option in ("-h", "--help"):
                 print __doc__
                 sys.exit()
-            # if from config file, ignore everything else, bail from this function to
-            # a function that will call it repeatedly
-            if option in ("-c", "--cfg"):
-                return renderFromConfigFile()
+            # if from config file, everything else but --site-jobs is ignored
+            if option in ("-c", "--cfg"): cfg = True
             if option in ("-z", "--zip"): zipIt = True
             if option in ("-u", "--upload"):
                 if value == 's3': s3 = True
+                if value.startswith('folder:'): upload_folder = value[len('folder:'):]
             if option in ("-p", "--s3profile"):
                 s3 = True
                 s3profile = value
@@ -838,7 +3300,77 @@ def main(argv=None):
                 s3bucket = value
             if option in ("-f", "--folder"): folder = value
             if option in ("-i", "--index"): home_index_page = value
+            if option == "--stream": stream = True
+            if option == "--fetch-jobs":
+                try:
+                    fetch_jobs = int(value)
+                except ValueError:
+                    raise Usage("--fetch-jobs must be a number")
+            if option == "--cache": cache_dir = cache_dir or CACHE_FOLDER
+            if option == "--cache-dir": cache_dir = value
+            if option == "--force": force = True
+            if option == "--changed": list_changed = True
+            if option == "--jobs":
+                try:
+                    jobs = int(value)
+                except ValueError:
+                    raise Usage("--jobs must be a number")
+            if option == "--upload-jobs":
+                try:
+                    upload_jobs = int(value)
+                except ValueError:
+                    raise Usage("--upload-jobs must be a number")
+            if option == "--watch": watching = True
+            if option == "--interval":
+                try:
+                    interval = float(value)
+                except ValueError:
+                    raise Usage("--interval must be a number of seconds")
+            if option == "--site-jobs":
+                try:
+                    site_jobs = int(value)
+                except ValueError:
+                    raise Usage("--site-jobs must be a number")
+            if option == "--stats": stats_file = value
+            if option == "--stats-top":
+                try:
+                    stats_top = int(value)
+                except ValueError:
+                    raise Usage("--stats-top must be a number")
+            if option == "--stats-memory": stats_memory = True
+            if option == "--precompress": precompress = True
+            if option == "--minify": minify = True
+            if option == "--lazy":
+                try:
+                    lazy_depth = int(value)
+                except ValueError:
+                    raise Usage("--lazy must be a number")
+            if option == "--lazy-size":
+                try:
+                    lazy_size = int(value)
+                except ValueError:
+                    raise Usage("--lazy-size must be a number")
+            if option == "--output":
+                if value == 'tar':
+                    output = TarOutput()
+                elif value.startswith('tar:'):
+                    output = TarOutput(value[len('tar:'):])
+                elif value != 'folder':
+                    raise Usage("--output must be folder, tar or tar:FILE")
+            if option == "--s3endpoint":
+                s3 = True
+                s3endpoint = value
+            if option == "--zip-level":
+                zipIt = True
+                try:
+                    zip_level = int(value)
+                except ValueError:
+                    zip_level = -1
+                if not 0 <= zip_level <= 9:
+                    raise Usage("--zip-level must be a number from 0 to 9")
 
+        if cfg:
+            return renderFromConfigFile(site_jobs)
 
         try:
             o_url = args[0]
@@ -846,11 +3378,16 @@ def main(argv=None):
             raise Usage("URL to outline required as first argument")
 
         try:
-            folder = folder or os.path.join(os.environ["HOME"], "fargo_outlines/%s" % o_url.split('/')[-1].split('.')[0])
+            folder = folder or defaultFolder(o_url)
         except:
             raise Usage("Error determining folder. Pass in with -f or --folder=")
 
-        if os.path.exists(folder):
+        if output is None:
+            output = FolderOutput()
+        if not output.local and (zipIt or s3 or upload_folder or watching):
+            raise Usage("--zip, --watch and uploading need the site written to a folder")
+
+        if output.local and os.path.exists(folder):
             try:
                 URA = args[1]
             except Exception, e:
@@ -866,19 +3403,62 @@ Type any other keys and press enter to quit.
             elif URA not in ["", "UPDATE"]:
                 sys.exit(1)
 
-        folder_parsed = parse(o_url, folder, home_index_page)
-        if zipIt: zipdir(folder_parsed)
+        cache = None
+        if cache_dir: cache = OutlineCache(cache_dir)
+        uploader = None
         if s3:
             s3profile = s3profile or "Credentials"
             s3bucket = s3bucket or os.path.basename(folder)
-            import folder2s3
-            folder2s3.upload(folder, s3profile, s3bucket)
-        return 0
+            try:
+                uploader = Uploader(S3Target(s3profile, s3bucket, s3endpoint), upload_jobs)
+            except ImportError:
+                raise Usage("uploading to S3 requires boto")
+        elif upload_folder:
+            uploader = Uploader(FolderTarget(upload_folder), upload_jobs)
+        if stats_memory and tracemalloc is None:
+            print >> sys.stderr, "tracemalloc is not available, only peak RSS will be reported"
+        compressor = None
+        if precompress:
+            compressor = Compressor(max(jobs, 1))
+        lazy = None
+        if lazy_depth or lazy_size:
+            lazy = (lazy_depth, lazy_size)
+        # watching polls through a cache, which builds have to share
+        if watching and cache is None:
+            cache = OutlineCache()
+        def build(manifest=None):
+            stats = Stats(stats_top, stats_memory)
+            result = None
+            try:
+                result = buildSiteOnce(o_url, folder, home_index_page, stream, fetch_jobs, cache, force, jobs,
+                                       list_changed, zipIt, zip_level, uploader, report, manifest, stats, output, compressor, minify, lazy)
+                return result
+            finally:
+                stats.stop()
+                if stats_file or on_stats:
+                    stats_report = stats.report(result and result[1])
+                    stats_report['outcome'] = report.get('outcome')
+                    if stats_file:
+                        saveStats(stats_file, stats_report)
+                    if on_stats:
+                        on_stats(stats_report)
+        if watching:
+            return watch(o_url, cache, interval, fetch_jobs, build)
+        if getattr(output, 'target', None) is sys.stdout:
+            # the tar has stdout to itself, everything else goes to stderr
+            sys.stdout = sys.stderr
+            try:
+                return build()[0]
+            finally:
+                sys.stdout = output.target
+        return build()[0]
 
     except Usage, err:
         error_message = sys.argv[0].split("/")[-1] + ": " + str(err.message)
         print >> sys.stderr, error_message
         print >> sys.stderr, "for help use --help"
+        report['outcome'] = 'failed'
+        report['error'] = str(err.message)
         return 2
 
 
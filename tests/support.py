@@ -0,0 +1,153 @@
+"""
+support.py
+
+What the tests share: a small outline of plain pages, written into a folder
+that a local HTTP server stands in for Dropbox with, and what it takes to
+write outlines with blogs in them.
+"""
+
+import sys, os, shutil, tempfile, threading, time, StringIO
+import SimpleHTTPServer, SocketServer
+from xml.sax.saxutils import quoteattr
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import fargo2html
+
+HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<opml version="2.0"><head><title>test</title></head><body>
+<outline text="#templates"><outline text="outline"><outline text="&lt;html&gt;&lt;body&gt;&lt;h1&gt;&lt;%pageTitle%&gt;&lt;/h1&gt;&lt;%bodytext%&gt;&lt;/body&gt;&lt;/html&gt;"/></outline></outline>
+<outline text='#rssTitle "Test"'/>
+"""
+
+def makeOutline(pages):
+    # pages is a list of (title, [line, ...])
+    body = []
+    for title, lines in pages:
+        body.append('<outline text="%s">' % title)
+        body.extend(['<outline text="%s"/>' % line for line in lines])
+        body.append('</outline>')
+    return HEAD + "\n".join(body) + "\n</body></opml>\n"
+
+PAGES = [("About", ["about me"]), ("Contact", ["write to me"])]
+
+# for outlines with more than plain pages in them
+
+def node(text, children=(), **attributes):
+    # an outline element, with children already made by node()
+    attributes = ''.join(' %s=%s' % (k, quoteattr(v)) for k, v in sorted(attributes.items()))
+    return '<outline text=%s%s>%s</outline>' % (quoteattr(text), attributes, ''.join(children))
+
+def document(nodes):
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<opml version="2.0"><head><title>test</title></head><body>%s</body></opml>\n' % ''.join(nodes)
+
+BLOG_TEMPLATES = node('#templates', [
+    node('outline', [node('<html><body><h1><%pageTitle%></h1><p><%blogHomeTitle%> <%footer%></p><%bodytext%></body></html>')]),
+    node('bloghome', [node('<html><body><h1><%blogHomeTitle%></h1><%bodytext%></body></html>')])])
+
+def calendar(prefix, year):
+    # a year of posts, one on each of two days in September
+    days = []
+    for day in (3, 12):
+        post = node('%s post %d' % (prefix, day), [node('%s on the %dth' % (prefix, day))],
+                    created='Mon, %02d Sep %d 10:00:00 GMT' % (day, year), isFeedItem='true')
+        days.append(node('September %d' % day, [post]))
+    return node(str(year), [node('September %d' % year, days)], icon='calendar', name='Blog %d' % year)
+
+class QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Site(object):
+    # A temp folder with the outline in it, served on a free port. Anything
+    # a test builds goes in the same folder, which close() removes. Each
+    # request takes delay seconds, requested lists the path of every one,
+    # and most is the most that were ever being served at once. A
+    # conditional GET for a file that has not changed is answered 304, as
+    # Dropbox does.
+    def __init__(self, pages=PAGES):
+        self.work = tempfile.mkdtemp(prefix='fargotest')
+        self.source = os.path.join(self.work, 'source')
+        os.mkdir(self.source)
+        # every file put is a second newer than the last, so a file put
+        # again always has a new Last-Modified
+        self.clock = int(time.time())
+        self.write(pages)
+        self.delay = 0
+        self.requested = []
+        self.active = self.most = 0
+        self.lock = threading.Lock()
+        site = self
+        class Handler(QuietHandler):
+            def translate_path(self, path):
+                return os.path.join(site.source, path.split('?')[0].lstrip('/'))
+
+            def do_GET(self):
+                site.requested.append(self.path.split('?')[0])
+                site.serving(1)
+                try:
+                    time.sleep(site.delay)
+                    path = self.translate_path(self.path)
+                    since = self.headers.getheader('If-Modified-Since')
+                    if since and os.path.exists(path) and since == self.date_time_string(os.stat(path).st_mtime):
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    QuietHandler.do_GET(self)
+                finally:
+                    site.serving(-1)
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/main.opml' % self.server.server_address[1]
+
+    def serving(self, change):
+        self.lock.acquire()
+        self.active += change
+        self.most = max(self.most, self.active)
+        self.lock.release()
+
+    def write(self, pages):
+        self.put('main.opml', makeOutline(pages))
+
+    def put(self, name, text):
+        # any file, served as /name
+        path = os.path.join(self.source, name)
+        fh = open(path, 'w')
+        fh.write(text)
+        fh.close()
+        self.clock += 1
+        os.utime(path, (self.clock, self.clock))
+
+    def path(self, *names):
+        return os.path.join(self.work, *names)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work)
+
+class RecordingOutput(fargo2html.MemoryOutput):
+    # a MemoryOutput that keeps the names of the files put in puts, which a
+    # test empties before the build it looks at
+    def __init__(self, files=None):
+        fargo2html.MemoryOutput.__init__(self, files)
+        self.puts = []
+
+    def put(self, path, data):
+        self.puts.append(self.key(path))
+        fargo2html.MemoryOutput.put(self, path, data)
+
+def quietly(func, *args, **kwargs):
+    # runs func with what it prints kept off the test output
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO.StringIO()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
@@ -0,0 +1,73 @@
+"""
+test_archive.py
+
+Archives: the blog home and each year, month and day of a calendar, split
+into pages of bloghomeItemCount posts. Each archive's frame is rendered once
+and every page of it is that frame with its own listings joined in.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document, BLOG_TEMPLATES
+
+def blog(count, days=5):
+    posts = [node('September %d' % day, [node('Post %d' % day, [node('text of %d' % day)], created='Mon, %02d Sep 2012 10:00:00 GMT' % day)])
+             for day in range(1, days + 1)]
+    year = node('2012', [node('September 2012', posts)], icon='calendar', name='Blog')
+    return document([node('#bloghomeItemCount %d' % count), BLOG_TEMPLATES, node('#rssTitle "Test"'), year])
+
+def listed(page):
+    # the titles of the posts a page lists, in order
+    return [part.split('</a></h2>')[0].split('>')[-1] for part in page.split('<h2>')[1:]]
+
+class ArchivePageTest(unittest.TestCase):
+    def testJoinedIntoFrame(self):
+        listings = [('One', '<p>1</p>', '/one', 'first'), ('Two', '<p>2</p>', '/two', 'second')]
+        page = fargo2html.archivePage(['<h1>Home</h1>', '</body>'], listings)
+        self.assertEqual(page, '<h1>Home</h1><h2><a href="/one">One</a></h2>\n<p>1</p>\n<h2><a href="/two">Two</a></h2>\n<p>2</p>\n</body>\n')
+
+    def testEmpty(self):
+        self.assertEqual(fargo2html.archivePage(['<h1>Home</h1>', '</body>'], []), '<h1>Home</h1></body>\n')
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.output = fargo2html.MemoryOutput()
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, count):
+        self.site.put('main.opml', blog(count))
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=self.output), 0)
+        return self.output.files
+
+    def testPages(self):
+        files = self.build(2)
+        for folder, title in [('', 'Home'), ('2012/', '2012'), ('2012/09/', 'September 2012')]:
+            pages = [files[folder + name] for name in ['index.html', '2.html', '3.html']]
+            self.assertEqual([listed(page) for page in pages], [['Post 1', 'Post 2'], ['Post 3', 'Post 4'], ['Post 5']])
+            for page in pages:
+                self.assertTrue(page.startswith('<html><body><h1>%s</h1>' % title), page)
+                self.assertTrue(page.endswith('</body></html>\n'))
+            self.assertFalse(folder + '4.html' in files)
+
+    def testDays(self):
+        files = self.build(2)
+        self.assertEqual(listed(files['2012/09/03/index.html']), ['Post 3'])
+        self.assertFalse('2012/09/03/2.html' in files)
+
+    def testOnePage(self):
+        files = self.build(20)
+        self.assertEqual(listed(files['index.html']), ['Post 1', 'Post 2', 'Post 3', 'Post 4', 'Post 5'])
+        self.assertFalse('2.html' in files)
+
+    def testSamePagesAgain(self):
+        first = dict(self.build(2))
+        self.assertEqual(self.build(2), first)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+test_bench.py
+
+The benchmark's synthetic site: the same settings and seed always write the
+same outlines, which build into the pages and posts asked for, and a
+benchmark run times a cold build and a warm one that writes nothing.
+
+    python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+
+from support import HERE, fargo2html, quietly
+sys.path.insert(0, os.path.join(HERE, '..', 'bench'))
+import synthetic, bench_site
+
+SMALL = {'pages': 4, 'years': 1, 'months': 2, 'days': 2, 'posts': 2, 'depth': 2, 'fanout': 2, 'glossary': 5, 'template_kb': 1, 'includes': 2}
+
+class SyntheticTest(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='fargotest')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def write(self, name, **overrides):
+        folder = os.path.join(self.work, name)
+        synthetic.makeSite(folder, **dict(SMALL, **overrides))
+        return dict((file_name, open(os.path.join(folder, file_name)).read()) for file_name in os.listdir(folder))
+
+    def testSettings(self):
+        values = synthetic.settings(pages='3')
+        self.assertEqual(values['pages'], 3)
+        self.assertEqual(values['posts'], synthetic.DEFAULTS['posts'])
+        self.assertRaises(KeyError, synthetic.settings, colour='blue')
+
+    def testFiles(self):
+        self.assertEqual(sorted(self.write('site')), ['include0.opml', 'include1.opml', 'main.opml'])
+
+    def testSeed(self):
+        self.assertEqual(self.write('one'), self.write('two'))
+        self.assertNotEqual(self.write('one')['main.opml'], self.write('three', seed=2)['main.opml'])
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.results = quietly(bench_site.benchmark, SMALL, memory=True)
+
+    def testBuilds(self):
+        cold, warm = self.results['cold'], self.results['warm']
+        # a page a post, and the home, year, month and day archives
+        posts = SMALL['years'] * SMALL['months'] * SMALL['days'] * SMALL['posts']
+        days = SMALL['years'] * SMALL['months'] * SMALL['days']
+        self.assertTrue(cold['written'] >= SMALL['pages'] + posts + 1 + SMALL['years'] + SMALL['years'] * SMALL['months'] + days)
+        self.assertEqual(warm['written'], 0)
+        self.assertTrue(cold['phases']['render'] > 0)
+        self.assertEqual(sorted(cold['phases']), sorted(bench_site.PHASES + ['other']))
+
+    def testSettingsRecorded(self):
+        values = synthetic.settings(**SMALL)
+        del values['base_url']
+        self.assertEqual(self.results['settings'], values)
+        self.assertEqual(self.results['output'], 'memory')
+
+    def testRestored(self):
+        # the timed stand-ins are taken out again after each build
+        self.assertFalse(fargo2html.grabData.__name__ == 'timed')
+        self.assertFalse(fargo2html.OutputWriter.__dict__['write'].__name__ == 'timed')
+
+if __name__ == '__main__':
+    unittest.main()
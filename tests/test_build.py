@@ -0,0 +1,52 @@
+"""
+test_build.py
+
+Whole builds: one that fails leaves nothing open that would stop the next
+from building the same folder, and says why it failed.
+
+    python -m unittest discover tests
+"""
+
+import sys, Queue, unittest
+
+from support import fargo2html, Site, quietly, node, document, calendar, BLOG_TEMPLATES
+
+def blog(page_type='outline'):
+    return document([node('#rssTitle "Test"'), BLOG_TEMPLATES,
+        node('About', [node('about me')], type=page_type), calendar('home', 2013)])
+
+class FailedBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.folder = self.site.path('site')
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self):
+        return quietly(fargo2html.parse, self.site.url, self.folder, None)
+
+    def testNextBuildInSameProcess(self):
+        self.site.put('main.opml', blog())
+        self.build()
+        # a page with no template for it fails once the posts are open;
+        # the traceback is held on to, as --watch does while it reports it
+        self.site.put('main.opml', blog('missing'))
+        try:
+            self.build()
+        except fargo2html.Usage:
+            failed = sys.exc_info()
+        else:
+            self.fail("built without a template")
+        self.site.put('main.opml', blog())
+        self.assertEqual(self.build(), self.folder)
+
+    def testReason(self):
+        results = Queue.Queue()
+        settings = {'url': self.site.url, 'folder': self.folder, 'ura': 'MAYBE'}
+        quietly(fargo2html.buildSite, 'test', settings, results)
+        name, report = results.get()
+        self.assertEqual(report['error'], "second argument must be one of ABORT, REPLACE, or UPDATE")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+test_changed.py
+
+A build after an edit renders and writes only what the edit reaches: a
+changed post, and the archive pages that list it, its day, month, year and
+home page. Archive pages listing only other posts are neither joined nor
+written, and an archive with nothing stale is not rendered at all.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, RecordingOutput, quietly, node, document, calendar, BLOG_TEMPLATES
+from test_archive import blog
+
+class ChangedTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.output = RecordingOutput()
+        self.build(blog(2))
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, text):
+        # the render report, with only this build's files in puts
+        self.site.put('main.opml', text)
+        self.output.puts = []
+        reports = []
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=self.output, on_stats=reports.append), 0)
+        return reports[0]['render']
+
+    def testOnePost(self):
+        # post 3 is on the second page of each archive with two to a page
+        render = self.build(blog(2).replace('text of 3', 'edited'))
+        self.assertEqual(sorted(self.output.puts), ['2.html', '2012/09/03/index.html', '2012/09/03/post3', '2012/09/2.html', '2012/2.html'])
+        # the post and the frames of home, year, month and day
+        self.assertEqual(render['units'], 5)
+        self.assertTrue('edited' in self.output.files['2.html'])
+
+    def testNothing(self):
+        render = self.build(blog(2))
+        self.assertEqual(self.output.puts, [])
+        self.assertEqual(render['units'], 0)
+
+    def testArchiveTemplate(self):
+        # every archive page, and none of the posts
+        self.build(blog(2).replace('&lt;h1&gt;&lt;%blogHomeTitle%&gt;', '&lt;h1 class=&quot;home&quot;&gt;&lt;%blogHomeTitle%&gt;'))
+        self.assertEqual(sorted(self.output.puts), sorted(name for name in self.output.files if name.endswith('.html')))
+
+class IndexChangedTest(unittest.TestCase):
+    # with -i and a Home blog the page's copy goes over the blog's
+    # index.html, and the archive page has to be written back every build
+    def setUp(self):
+        self.site = Site()
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, about, output=None):
+        self.site.put('main.opml', document([node('#rssTitle "Test"'), BLOG_TEMPLATES,
+            node('About', [node(about)]), calendar('home', 2013)]))
+        if output is None:
+            output = fargo2html.MemoryOutput()
+        argv = ['-i', 'about', '-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        return output
+
+    def testSameAsFresh(self):
+        output = self.build('about me')
+        self.build('about you', output)
+        fresh = self.build('about you')
+        self.assertEqual(output.files['index.html'], fresh.files['index.html'])
+        self.assertTrue('about you' in output.files['about'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+test_compress.py
+
+--precompress: every file gets file.gz beside it, made from what the file
+holds at the end of the build, and an unchanged file is not compressed
+again.
+
+    python -m unittest discover tests
+"""
+
+import gzip, StringIO, unittest
+
+from support import fargo2html, Site, quietly, node, document, calendar, BLOG_TEMPLATES
+
+FOLDER = '/site'
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+class CompressTest(unittest.TestCase):
+    def setUp(self):
+        self.output = fargo2html.MemoryOutput()
+        self.output.start(FOLDER)
+        self.manifest = fargo2html.Manifest(FOLDER, output=self.output)
+
+    def writer(self):
+        return fargo2html.OutputWriter(self.manifest, output=self.output, compressor=fargo2html.Compressor(2))
+
+    def testSidecar(self):
+        writer = self.writer()
+        writer.write(FOLDER + '/about', 'about me')
+        writer.compressPending()
+        self.assertEqual(gunzip(self.output.files['about.gz']), 'about me')
+
+    def testWrittenTwice(self):
+        writer = self.writer()
+        writer.write(FOLDER + '/index.html', 'the first')
+        writer.write(FOLDER + '/index.html', 'the second')
+        writer.compressPending()
+        self.assertEqual(gunzip(self.output.files['index.html.gz']), 'the second')
+
+    def testWrittenBackAgain(self):
+        writer = self.writer()
+        writer.write(FOLDER + '/index.html', 'the first')
+        writer.compressPending()
+        self.manifest = self.manifest.following()
+        writer = self.writer()
+        writer.write(FOLDER + '/index.html', 'the second')
+        writer.write(FOLDER + '/index.html', 'the first')
+        writer.compressPending()
+        self.assertEqual(gunzip(self.output.files['index.html.gz']), 'the first')
+
+    def testUnchangedNotCompressedAgain(self):
+        writer = self.writer()
+        writer.write(FOLDER + '/about', 'about me')
+        writer.compressPending()
+        self.manifest = self.manifest.following()
+        writer = self.writer()
+        writer.write(FOLDER + '/about', 'about me')
+        self.assertFalse(writer.compressor.submitted)
+
+class IndexTest(unittest.TestCase):
+    # with -i and a Home blog, index.html is written twice in one build
+    def setUp(self):
+        self.site = Site()
+        self.site.put('main.opml', document([node('#rssTitle "Test"'), BLOG_TEMPLATES,
+            node('About', [node('about me')]), calendar('home', 2013)]))
+
+    def tearDown(self):
+        self.site.close()
+
+    def testLastIndexCompressed(self):
+        output = fargo2html.MemoryOutput()
+        argv = ['--precompress', '-i', 'about', '-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        for name in ('index.html', 'about', '2013/09/03/homePost3'):
+            self.assertEqual(gunzip(output.files[name + '.gz']), output.files[name], name)
+
+if __name__ == '__main__':
+    unittest.main()
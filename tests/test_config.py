@@ -0,0 +1,90 @@
+"""
+test_config.py
+
+Building every site in ~/.fargo2htmlrc: each site in its own process,
+several at once but never two into the same folder, with outlines and
+includes the sites share fetched once beforehand.
+
+    python -m unittest discover tests
+"""
+
+import os, unittest
+
+from support import fargo2html, Site, quietly, node, document, makeOutline, PAGES
+
+class ConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.home = os.environ['HOME']
+        os.environ['HOME'] = self.site.path()
+        self.include_url = self.site.url.replace('main.opml', 'include.opml')
+        self.site.put('include.opml', document([node('Included', [node('included text')])]))
+        self.site.put('main.opml', makeOutline(PAGES).replace('</body>', node('Include', type='include', url=self.include_url) + '</body>'))
+        self.site.put('other.opml', makeOutline([("Other", ["another site"])]))
+
+    def tearDown(self):
+        os.environ['HOME'] = self.home
+        fargo2html.PREFETCHED.clear()
+        self.site.close()
+
+    def config(self, sections):
+        # sections is a list of (name, [(option, value), ...])
+        lines = []
+        for name, options in sections:
+            lines.append('[%s]' % name)
+            lines.extend('%s = %s' % option for option in options)
+        open(self.site.path('.fargo2htmlrc'), 'w').write('\n'.join(lines) + '\n')
+        return fargo2html.readConfigFile()
+
+    def section(self, name, outline='main.opml', folder=None):
+        return (name, [('outline', self.site.url.replace('main.opml', outline)), ('folder', self.site.path(folder or name))])
+
+    def read(self, folder, name):
+        return open(self.site.path(folder, name)).read()
+
+    def testReadConfigFile(self):
+        (name, settings), = self.config([('blog', [('outline', self.site.url), ('jobs', '3'), ('minify', 'yes'), ('cache', 'True')])])
+        self.assertEqual(name, 'blog')
+        self.assertEqual((settings['url'], settings['folder'], settings['ura']), (self.site.url, None, 'UPDATE'))
+        self.assertEqual((settings['jobs'], settings['minify'], settings['cache'], settings['zipit']), (3, True, True, False))
+
+    def testEverySite(self):
+        sites = self.config([self.section('one'), self.section('two', 'other.opml')])
+        reports = quietly(fargo2html.buildSites, sites, 2)
+        self.assertEqual([(name, report['outcome']) for name, report in reports], [('one', 'ok'), ('two', 'ok')])
+        self.assertTrue('about me' in self.read('one', 'about'))
+        self.assertTrue('included text' in self.read('one', 'included'))
+        self.assertTrue('another site' in self.read('two', 'other'))
+
+    def testFailedSite(self):
+        sites = self.config([self.section('one'), self.section('two', 'missing.opml')])
+        reports = dict(quietly(fargo2html.buildSites, sites, 2))
+        self.assertEqual(reports['one']['outcome'], 'ok')
+        self.assertEqual(reports['two']['outcome'], 'failed')
+        self.assertTrue(reports['two']['error'])
+
+    def testTogether(self):
+        self.site.delay = 0.5
+        sites = self.config([self.section('one'), self.section('two', 'other.opml')])
+        quietly(fargo2html.buildSites, sites, 2)
+        self.assertEqual(self.site.most, 2)
+
+    def testSameFolderOneAtATime(self):
+        self.site.delay = 0.5
+        sites = self.config([self.section('one', folder='site'), self.section('two', 'other.opml', folder='site')])
+        reports = quietly(fargo2html.buildSites, sites, 2)
+        self.assertEqual([report['outcome'] for name, report in reports], ['ok', 'ok'])
+        self.assertEqual(self.site.most, 1)
+
+    def testSharedFetchedOnce(self):
+        self.config([self.section('one'), self.section('two')])
+        self.assertEqual(quietly(fargo2html.renderFromConfigFile), 0)
+        self.assertEqual(sorted(self.site.requested), ['/include.opml', '/main.opml'])
+        self.assertEqual(self.read('one', 'about'), self.read('two', 'about'))
+
+    def testFailedOutcome(self):
+        self.config([self.section('one'), self.section('two', 'missing.opml')])
+        self.assertEqual(quietly(fargo2html.renderFromConfigFile), 1)
+
+if __name__ == '__main__':
+    unittest.main()
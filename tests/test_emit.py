@@ -0,0 +1,156 @@
+"""
+test_emit.py
+
+Outlines are rendered by walking them once and closing lists by depth. The
+markup has to be what the closings-stack grabData it replaced made, down to
+the tabs, which is kept here as it was to check against.
+
+    python -m unittest discover tests
+"""
+
+import unittest, opml
+from lxml import etree
+
+from support import fargo2html, Site, quietly, node, makeOutline
+
+def legacyGrabData(outline,base_rules=None,format=''):
+    FORMATS = fargo2html.FORMATS
+    if len(outline) == 0:
+        return []
+    data = [node.get('text') for node in outline._root.iterdescendants()]
+    if '<rules>' in data:
+        start,end = data.index('<rules>'),data.index('</rules>')
+        rules = data[start+1:end]
+    else:
+        rules = []
+        end = 0
+    if not format:
+        try:
+            content = data[:start] + data[end+1:]
+        except:
+            content = data
+    else:
+        rules = fargo2html.processRules(base_rules,rules)
+        level = 1
+        closings = [None]
+        content = [FORMATS[format]['body_open'] % rules[level],FORMATS[format]['list_open'] % rules[level]]
+        for i,node in enumerate(outline._root.iterdescendants()):
+            try:
+                if node.get('type')== 'link':
+                        if '<a' not in node.get('text'):
+                            node.set('text','<a href="%s">%s</a>' % (node.get('url'), node.get('text')))
+            except:
+                pass
+            if i < end: continue
+            count = len(node)
+            for c in range(level):
+                closing = closings.pop()
+                if closing is not None:
+                    level -= 1
+                    try:
+                        this_closing = level*"\t" + closing % rules[level]
+                    except:
+                        this_closing = level*"\t" + closing
+                    content.append(this_closing)
+            if count > 0:
+                rules[level]['ID'] = "T%s" % i
+                content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['list_header_open'] % rules[level], node.get('text'), FORMATS[format]['list_header_close']))
+                if rules[level]['expanded']:
+                    show = 'show'
+                else:
+                    show = 'hide'
+                content.append('''<div class="%s" id="T%s" name="T%s">''' % (show, i, i))
+                content.append(level*"\t" + FORMATS[format]['list_open'] % rules[level])
+                closings.append(level*"\t" + "%s\n%s" % (FORMATS[format]['list_close'] % rules[level], "</div>"))
+                for c in range(count*level):
+                    closings.append(None)
+                if count: closings.append(None)
+                level += 1
+            else:
+                content.append("%s%s%s%s" % (level * "\t", FORMATS[format]['item_open'] % rules[level], node.get('text'), FORMATS[format]['item_close']))
+                closings.append(None)
+        for closing in closings:
+            if closing:
+                content.append(closing)
+        content.append(FORMATS[format]['body_close'] % rules[level])
+    return rules, content
+
+def outline(text):
+    # a fresh element each time, links are rewritten in place
+    return opml.OutlineElement(etree.fromstring(text))
+
+RAGGED = node('page', [
+    node('one'),
+    node('two', [node('two a', [node('two a i', [node('deepest')])]), node('two b')]),
+    node('three', [node('three a', [node('three a i')])]),
+    node('four')])
+
+RULES = node('page', [
+    node('<rules>'),
+    node('<rule level="1" to="3">'),
+    node('<expanded>true</expanded>'),
+    node('<outline-indent>2em</outline-indent>'),
+    node('</rule>'),
+    node('</rules>'),
+    node('shown', [node('under it', [node('and under that')])]),
+    node('last')])
+
+LINKS = node('page', [
+    node('a site', type='link', url='http://example.com/'),
+    node('<a href="http://example.org/">already a link</a>', type='link', url='http://example.net/'),
+    node('links', [node('deeper', type='link', url='http://example.com/deeper')])])
+
+class EmitTest(unittest.TestCase):
+    def assertSame(self, text, format='outline', base_rules=None):
+        # a ruleset compares as itself, so only the markup is checked
+        result, legacy = fargo2html.grabData(outline(text), base_rules, format), legacyGrabData(outline(text), base_rules, format)
+        if format:
+            result, legacy = result[1], legacy[1]
+        self.assertEqual(result, legacy)
+
+    def testFlat(self):
+        self.assertSame(node('page', [node('one'), node('two'), node('three')]))
+
+    def testRagged(self):
+        # several lists closing at once, at more than one depth
+        self.assertSame(RAGGED)
+
+    def testEndsDeep(self):
+        self.assertSame(node('page', [node('one', [node('two', [node('three', [node('four')])])])]))
+
+    def testRules(self):
+        self.assertSame(RULES)
+        self.assertSame(RAGGED, base_rules=['<rule level="2" to="3">', '<expanded>true</expanded>', '</rule>'])
+
+    def testLinks(self):
+        self.assertSame(LINKS)
+
+    def testFormats(self):
+        for format in fargo2html.FORMATS:
+            self.assertSame(RAGGED, format)
+
+    def testWithoutFormat(self):
+        # glossary and template nodes are read as their lines of text
+        self.assertSame(RAGGED, '')
+        self.assertSame(RULES, '')
+
+    def testEmpty(self):
+        self.assertEqual(fargo2html.grabData(outline(node('page'))), [])
+
+class EmitPageTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site([("About", ["about me"])])
+
+    def tearDown(self):
+        self.site.close()
+
+    def testPage(self):
+        self.site.put('main.opml', makeOutline([]).replace('</body>', RAGGED.replace('"page"', '"About"') + '</body>'))
+        output = fargo2html.MemoryOutput()
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        rules, content = legacyGrabData(outline(RAGGED), [], 'outline')
+        self.assertTrue(''.join(content) + '</div>' in output.files['about'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+test_feed.py
+
+The feed keeps the newest feedCount feed items in a heap, newest first,
+with posts of the same date in outline order. rss.xml is only written again
+when its items change.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, RecordingOutput, quietly, node, document, BLOG_TEMPLATES
+
+def created(day, hour=10):
+    return 'Mon, %02d Sep 2012 %02d:00:00 GMT' % (day, hour)
+
+class FeedTest(unittest.TestCase):
+    def titles(self, feed):
+        return [title for title, link, description, date in feed.entries()]
+
+    def testNewestFirst(self):
+        feed = fargo2html.Feed(3)
+        for day in [4, 1, 5, 2, 3]:
+            feed.add('Post %d' % day, '/post%d' % day, '', created(day))
+        self.assertEqual(self.titles(feed), ['Post 5', 'Post 4', 'Post 3'])
+
+    def testSameDateInOutlineOrder(self):
+        feed = fargo2html.Feed(3)
+        for title in ['first', 'second', 'third', 'fourth']:
+            feed.add(title, '/' + title, '', created(3))
+        self.assertEqual(self.titles(feed), ['first', 'second', 'third'])
+
+    def testNone(self):
+        feed = fargo2html.Feed(0)
+        feed.add('Post', '/post', '', created(3))
+        self.assertEqual(feed.entries(), [])
+
+    def testItems(self):
+        feed = fargo2html.Feed(20)
+        feed.add('Post', 'http://example.com/post', '<p>post</p>', created(3))
+        item, = feed.items()
+        self.assertEqual((item.title, item.link, item.guid, item.description, item.pubDate),
+                         ('Post', 'http://example.com/post', 'http://example.com/post', '<p>post</p>', created(3)))
+
+def blog(texts, count):
+    # a post a day, each in the feed
+    posts = [node('September %d' % day, [node('Post %d' % day, [node(text)], created=created(day), isFeedItem='true')])
+             for day, text in enumerate(texts, 1)]
+    year = node('2012', [node('September 2012', posts)], icon='calendar', name='Blog')
+    return document([node('#feedCount %d' % count), BLOG_TEMPLATES, node('#rssTitle "Test"'), year])
+
+class FeedBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.output = RecordingOutput()
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, texts, count=2):
+        self.site.put('main.opml', blog(texts, count))
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=self.output), 0)
+        return self.output.files['rss.xml']
+
+    def testNewest(self):
+        rss = self.build(['one', 'two', 'three'])
+        self.assertEqual(rss.count('<item>'), 2)
+        self.assertTrue(rss.index('Post 3') < rss.index('Post 2'))
+        self.assertFalse('Post 1' in rss)
+
+    def testUnchangedNotWritten(self):
+        # an edit to a post the feed leaves out, so the feed is not put again
+        self.build(['one', 'two', 'three'])
+        self.output.puts = []
+        self.build(['one again', 'two', 'three'])
+        self.assertTrue('2012/09/01/post1' in self.output.puts)
+        self.assertFalse('rss.xml' in self.output.puts)
+
+    def testChanged(self):
+        self.build(['one', 'two', 'three'])
+        self.assertTrue('three again' in self.build(['one', 'two', 'three again']))
+
+if __name__ == '__main__':
+    unittest.main()
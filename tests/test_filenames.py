@@ -0,0 +1,58 @@
+"""
+test_filenames.py
+
+FileNames hands out output paths. A path that is taken gets the next free
+number after it, foo2, foo3 and so on, as do posts with the same title on
+the same day.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document, BLOG_TEMPLATES
+
+class FileNamesTest(unittest.TestCase):
+    def testFree(self):
+        names = fargo2html.FileNames()
+        self.assertEqual(names.allocate('/site/about'), '/site/about')
+        self.assertTrue('/site/about' in names)
+        self.assertFalse('/site/contact' in names)
+
+    def testTaken(self):
+        names = fargo2html.FileNames()
+        allocated = [names.allocate('/site/about') for i in range(4)]
+        self.assertEqual(allocated, ['/site/about', '/site/about2', '/site/about3', '/site/about4'])
+        self.assertEqual(len(names), 4)
+
+    def testNumberedNameTaken(self):
+        # about2 was a name in its own right, so the second about skips it
+        names = fargo2html.FileNames()
+        names.allocate('/site/about2')
+        names.allocate('/site/about')
+        self.assertEqual(names.allocate('/site/about'), '/site/about3')
+        self.assertEqual(names.allocate('/site/about2'), '/site/about22')
+
+class SameTitleTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        posts = [node('Hello', [node('hello number %d' % i)], created='Mon, 03 Sep 2012 1%d:00:00 GMT' % i)
+                 for i in range(3)]
+        day = node('September 3', posts)
+        year = node('2012', [node('September 2012', [day])], icon='calendar', name='Blog')
+        self.site.put('main.opml', document([node('#rssTitle "Test"'), BLOG_TEMPLATES, year]))
+
+    def tearDown(self):
+        self.site.close()
+
+    def testNumbered(self):
+        output = fargo2html.MemoryOutput()
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        posts = sorted(name for name in output.files if name.startswith('2012/09/03/hello'))
+        self.assertEqual(posts, ['2012/09/03/hello', '2012/09/03/hello2', '2012/09/03/hello3'])
+        texts = sorted(output.files[name].split('hello number ')[1][0] for name in posts)
+        self.assertEqual(texts, ['0', '1', '2'])
+
+if __name__ == '__main__':
+    unittest.main()
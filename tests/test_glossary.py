@@ -0,0 +1,79 @@
+"""
+test_glossary.py
+
+The glossary is compiled once into a single pattern and a page is expanded
+in one scan: longer keys first, macros that use other macros resolved
+whatever order they come in, and ones that use themselves left as they are.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document
+
+class GlossaryTest(unittest.TestCase):
+    def testExpand(self):
+        glossary = fargo2html.Glossary({'<%footer%>': '<p>footer</p>'})
+        self.assertEqual(glossary.expand('<div><%footer%></div>'), '<div><p>footer</p></div>')
+
+    def testLongerKeyFirst(self):
+        glossary = fargo2html.Glossary({'ran': 'Ran', 'random': 'Random'})
+        self.assertEqual(glossary.expand('random ran'), 'Random Ran')
+
+    def testMacrosUsingMacros(self):
+        # whichever order the keys would be substituted in
+        glossary = fargo2html.Glossary({'<%a%>': '[<%b%>]', '<%b%>': '(<%c%>)', '<%c%>': 'c'})
+        self.assertEqual(glossary.expand('<%a%>'), '[(c)]')
+        glossary = fargo2html.Glossary({'<%c%>': '(<%b%>)', '<%b%>': '[<%a%>]', '<%a%>': 'a'})
+        self.assertEqual(glossary.expand('<%c%>'), '([a])')
+
+    def testSelfReferenceKept(self):
+        glossary = fargo2html.Glossary({'<%loop%>': 'again <%loop%>', '<%one%>': '<%two%>', '<%two%>': '<%one%>',
+                                        '<%uses%>': 'x <%loop%>'})
+        self.assertEqual(glossary.expand('<%loop%>'), 'again <%loop%>')
+        self.assertEqual(glossary.expand('<%one%>'), '<%two%>')
+        self.assertEqual(glossary.expand('<%uses%>'), 'x <%loop%>')
+
+    def testPageValues(self):
+        # a macro can hold per page values, filled in on the same scan
+        glossary = fargo2html.Glossary({'<%navbar%>': '<nav><%BRANDMENU%></nav>'})
+        extra = fargo2html.brandValues('Home', '/')
+        self.assertEqual(glossary.expand('<%navbar%><%BRAND%><%other%>', extra),
+                         '<nav><a class="brand" href="/">Home</a></nav>Home<%other%>')
+
+    def testSameAsSubData(self):
+        values = {'<%footer%>': '<p>footer</p>', '<%comments%>': '<!-- c -->'}
+        text = '<%footer%> and <%comments%> twice <%footer%>'
+        expected = text
+        for k, v in values.items():
+            expected = expected.replace(k, v)
+        self.assertEqual(fargo2html.subData(text, values), expected)
+
+    def testCompiledOnce(self):
+        values = {'<%a%>': 'a'}
+        self.assertTrue(fargo2html.compileGlossary(values) is fargo2html.compileGlossary(dict(values)))
+
+class GlossaryPageTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        templates = node('#templates', [node('outline', [node('<html><body><%bodytext%><%footer%></body></html>')])])
+        glossary = node('#glossary', [node('<%footer%>', [node('<p><%credit%></p>')]),
+                                      node('<%credit%>', [node('by me')])])
+        # the node after #glossary or #templates is never read for settings
+        self.site.put('main.opml', document([glossary, node('#rssTitle "Test"'), templates,
+                                             node('About', [node('see <%credit%>')])]))
+
+    def tearDown(self):
+        self.site.close()
+
+    def testExpanded(self):
+        output = fargo2html.MemoryOutput()
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        page = output.files['about']
+        self.assertTrue('see by me' in page, page)
+        self.assertTrue(page.endswith('<p>by me</p></body></html>\n'), page)
+
+if __name__ == '__main__':
+    unittest.main()
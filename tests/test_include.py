@@ -0,0 +1,64 @@
+"""
+test_include.py
+
+Includes are fetched a few at a time, --fetch-jobs of them, before the pages
+are rendered, or with --stream while the outline streams in. One that cannot
+be fetched is rendered as a page of its own, as it always was.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document
+
+# the include node falls back on the include template
+TEMPLATES = node('#templates', [
+    node('outline', [node('<html><body><h1><%pageTitle%></h1><%bodytext%></body></html>')]),
+    node('include', [node('<html><body><h1><%pageTitle%> is missing</h1><%bodytext%></body></html>')])])
+
+INCLUDES = ['first', 'second', 'third', 'fourth']
+
+class IncludeTest(unittest.TestCase):
+    options = []
+
+    def setUp(self):
+        self.site = Site()
+        base = self.site.url.replace('main.opml', '')
+        includes = []
+        for name in INCLUDES:
+            self.site.put(name + '.opml', document([node('%s page' % name.capitalize(), [node('from %s' % name)])]))
+            includes.append(node(name, type='include', url=base + name + '.opml'))
+        includes.append(node('Missing', type='include', url=base + 'missing.opml'))
+        self.site.put('main.opml', document([node('#rssTitle "Test"'), TEMPLATES] + includes))
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, *options):
+        output = fargo2html.MemoryOutput()
+        argv = self.options + list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        return output.files
+
+    def testFetchedTogether(self):
+        self.site.delay = 0.2
+        files = self.build()
+        self.assertTrue(self.site.most > 1)
+        for name in INCLUDES:
+            self.assertTrue('from %s' % name in files['%sPage' % name], name)
+
+    def testFetchJobs(self):
+        self.site.delay = 0.1
+        self.build('--fetch-jobs=1')
+        self.assertEqual(self.site.most, 1)
+
+    def testMissingRenderedAsPage(self):
+        files = self.build()
+        self.assertTrue('Missing is missing' in files['missing'])
+
+class StreamIncludeTest(IncludeTest):
+    options = ['--stream']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+test_jobs.py
+
+With --jobs, pages, posts and archive pages are rendered on a pool of
+processes. The site has to come out the same as with one.
+
+    python -m unittest discover tests
+"""
+
+import re, unittest
+
+from support import fargo2html, Site, quietly, node, document, calendar, BLOG_TEMPLATES
+
+class JobsTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.site.put('main.opml', document([
+            node('#glossary', [node('<%footer%>', [node('the footer')])]),
+            node('#rssTitle "Test"'), node('#blogHomeTitle "Jobs"'), BLOG_TEMPLATES,
+            node('About', [node('one', [node('under one')]), node('two')]),
+            node('Contact', [node('write to me')]),
+            calendar('home', 2012), calendar('home', 2013),
+            node('Recipes', [calendar('recipe', 2013)])]))
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, *options):
+        output = fargo2html.MemoryOutput()
+        argv = list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        # the feed says when it was built
+        return dict((name, re.sub('<lastBuildDate>.*?</lastBuildDate>', '', data)) for name, data in output.files.items())
+
+    def testSameAsSerial(self):
+        serial = self.build()
+        self.assertTrue('the footer' in serial['about'])
+        self.assertTrue('2013/09/12/homePost12' in serial)
+        self.assertEqual(self.build('--jobs=4'), serial)
+
+    def testSameAsSerialSplit(self):
+        serial = self.build('--lazy=1')
+        self.assertEqual(self.build('--lazy=1', '--jobs=4'), serial)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+test_lazy.py
+
+--lazy writes the hidden subtrees of a page to files of their own beside
+it. Those of a page that is gone, renamed or no longer split are removed
+on the next build, compressed copies and all.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document, BLOG_TEMPLATES
+
+def outline(title):
+    return document([node('#rssTitle "Test"'), BLOG_TEMPLATES,
+        node(title, [node('one', [node('under one')]), node('two', [node('under two')])]),
+        node('Contact', [node('write to me')])])
+
+class LazyTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.site.put('main.opml', outline('About'))
+        self.output = fargo2html.MemoryOutput()
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, *options):
+        argv = list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=self.output), 0)
+
+    def fragments(self, page):
+        # page.ID.html, and page.ID.html.gz with --precompress
+        return sorted(name for name in self.output.files if name.startswith(page + '.') and '.html' in name)
+
+    def testSplit(self):
+        self.build('--lazy=1')
+        fragments = self.fragments('about')
+        self.assertEqual(len(fragments), 2)
+        for name in fragments:
+            self.assertTrue(name[len('about.'):-len('.html')] in self.output.files['about'])
+        self.assertTrue('under one' in ''.join(self.output.files[name] for name in fragments))
+        self.assertFalse('under one' in self.output.files['about'])
+
+    def testRenamed(self):
+        self.build('--lazy=1', '--precompress')
+        self.assertTrue(self.fragments('about'))
+        self.site.put('main.opml', outline('Biography'))
+        self.build('--lazy=1', '--precompress')
+        self.assertEqual(self.fragments('about'), [])
+        self.assertEqual(len(self.fragments('biography')), 4)
+
+    def testNoLongerSplit(self):
+        self.build('--lazy=1')
+        self.build()
+        self.assertEqual(self.fragments('about'), [])
+        self.assertTrue('under one' in self.output.files['about'])
+
+if __name__ == '__main__':
+    unittest.main()
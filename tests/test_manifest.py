@@ -0,0 +1,321 @@
+"""
+test_manifest.py
+
+What lets an unchanged site skip work: the Manifest of what each page was
+built from, the OutputWriter that leaves files alone when they have not
+changed, and the OutlineCache that only lets a changed outline through, and
+only keeps it once a build from it has finished.
+
+    python -m unittest discover tests
+"""
+
+import os, shutil, tempfile, unittest
+
+from support import fargo2html, Site, quietly
+
+FOLDER = '/site'
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.output = fargo2html.MemoryOutput()
+        self.output.start(FOLDER)
+
+    def lastRun(self, settings=None):
+        # one page written and saved, as a build leaves it
+        manifest = fargo2html.Manifest(FOLDER, output=self.output, settings=settings)
+        writer = fargo2html.OutputWriter(manifest, output=self.output)
+        writer.write(FOLDER + '/about', 'about me')
+        manifest.add('page:about', {'digest': 'd1'}, FOLDER + '/about')
+        manifest.save()
+
+    def manifest(self, force=False, settings=None):
+        return fargo2html.Manifest(FOLDER, force, self.output, settings)
+
+    def testUnchangedUnitIsSkipped(self):
+        self.lastRun()
+        unit = self.manifest().get('page:about', 'd1', FOLDER + '/about')
+        self.assertEqual(unit['file'], 'about')
+        self.assertTrue(self.manifest().current())
+
+    def testChangedDigest(self):
+        self.lastRun()
+        self.assertEqual(self.manifest().get('page:about', 'd2', FOLDER + '/about'), None)
+
+    def testDeletedOutput(self):
+        self.lastRun()
+        del self.output.files['about']
+        manifest = self.manifest()
+        self.assertEqual(manifest.get('page:about', 'd1', FOLDER + '/about'), None)
+        self.assertFalse(manifest.current())
+
+    def testForce(self):
+        self.lastRun()
+        manifest = self.manifest(force=True)
+        self.assertEqual(manifest.get('page:about', 'd1', FOLDER + '/about'), None)
+        self.assertFalse(manifest.current())
+
+    def testSettingsChanged(self):
+        self.lastRun()
+        manifest = self.manifest(settings={'minify': True})
+        self.assertEqual(manifest.get('page:about', 'd1', FOLDER + '/about'), None)
+        self.assertFalse(manifest.current())
+        # the files are still known, so unchanged ones are not written again
+        self.assertEqual(manifest.fileDigest(FOLDER + '/about'), self.output.digest(FOLDER + '/about'))
+        self.assertTrue(self.manifest(settings={}).current())
+
+    def testWrittenOverThisRun(self):
+        # like the home page's copy of itself over index.html
+        self.lastRun()
+        manifest = self.manifest()
+        fargo2html.OutputWriter(manifest, output=self.output).write(FOLDER + '/about', 'something else')
+        self.assertEqual(manifest.get('page:about', 'd1', FOLDER + '/about'), None)
+
+    def testNotCompressed(self):
+        self.lastRun()
+        self.assertFalse(self.manifest().current(True))
+
+    def testFollowing(self):
+        manifest = self.manifest()
+        fargo2html.OutputWriter(manifest, output=self.output).write(FOLDER + '/about', 'about me')
+        manifest.add('page:about', {'digest': 'd1'}, FOLDER + '/about')
+        self.assertEqual(manifest.following().get('page:about', 'd1', FOLDER + '/about')['digest'], 'd1')
+
+class OutputWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.output = fargo2html.MemoryOutput()
+        self.output.start(FOLDER)
+
+    def writer(self):
+        return fargo2html.OutputWriter(fargo2html.Manifest(FOLDER, output=self.output), output=self.output)
+
+    def testUnchangedIsNotWritten(self):
+        writer = self.writer()
+        self.assertTrue(writer.write(FOLDER + '/about', 'about me'))
+        writer.manifest.save()
+        writer = self.writer()
+        self.assertFalse(writer.write(FOLDER + '/about', 'about me'))
+        self.assertEqual(writer.changed, [])
+        self.assertEqual(writer.unchanged, 1)
+
+    def testChangedIsWritten(self):
+        writer = self.writer()
+        writer.write(FOLDER + '/about', 'about me')
+        writer.manifest.save()
+        writer = self.writer()
+        self.assertTrue(writer.write(FOLDER + '/about', 'about you'))
+        self.assertEqual(writer.changed, [FOLDER + '/about'])
+        self.assertEqual(self.output.files['about'], 'about you')
+
+    def testWithoutManifest(self):
+        writer = fargo2html.OutputWriter(output=self.output)
+        writer.write(FOLDER + '/about', u'caf\xe9')
+        self.assertFalse(writer.write(FOLDER + '/about', u'caf\xe9'))
+        self.assertEqual(self.output.files['about'], 'caf\xc3\xa9')
+
+class FakeResponse(object):
+    def __init__(self, status_code, content='', etag=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+        if etag:
+            self.headers['etag'] = etag
+
+class FakeSession(object):
+    # hands back responses in turn and keeps the headers each request sent
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, headers=None, stream=False):
+        self.sent.append(headers)
+        return self.responses.pop(0)
+
+URL = 'http://example.com/main.opml'
+
+class OutlineCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='fargotest')
+        self.cache = fargo2html.OutlineCache(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testChangedCopyIsStaged(self):
+        session = FakeSession(FakeResponse(200, 'one', 'e1'))
+        self.assertEqual(self.cache.fetch(URL, session), 'one')
+        self.assertEqual(self.cache.changed, set([URL]))
+        self.assertFalse(os.path.exists(self.cache.paths(URL)[0]))
+        self.assertEqual(self.cache.headers(URL), {})
+        self.cache.commit()
+        self.assertEqual(open(self.cache.paths(URL)[0]).read(), 'one')
+        self.assertEqual(self.cache.headers(URL), {'If-None-Match': 'e1'})
+
+    def testNotModified(self):
+        session = FakeSession(FakeResponse(200, 'one', 'e1'), FakeResponse(304))
+        self.cache.fetch(URL, session)
+        self.cache.commit()
+        self.cache.reset()
+        self.assertEqual(self.cache.fetch(URL, session), 'one')
+        self.assertEqual(self.cache.changed, set())
+        self.assertEqual(session.sent[-1], {'If-None-Match': 'e1'})
+
+    def testUncommittedCopyIsFetchedAgain(self):
+        # the build from 'two' failed, so it is not what the cache has
+        session = FakeSession(FakeResponse(200, 'one', 'e1'), FakeResponse(200, 'two', 'e2'), FakeResponse(200, 'two', 'e2'))
+        self.cache.fetch(URL, session)
+        self.cache.commit()
+        self.cache.reset()
+        self.cache.fetch(URL, session)
+        self.cache.reset()
+        self.assertEqual(self.cache.fetch(URL, session), 'two')
+        self.assertEqual(session.sent[-1], {'If-None-Match': 'e1'})
+        self.assertEqual(self.cache.changed, set([URL]))
+
+    def testSameContentWithNewHeaders(self):
+        session = FakeSession(FakeResponse(200, 'one', 'e1'), FakeResponse(200, 'one', 'e2'))
+        self.cache.fetch(URL, session)
+        self.cache.commit()
+        self.cache.reset()
+        self.cache.fetch(URL, session)
+        self.assertEqual(self.cache.changed, set())
+        self.assertEqual(self.cache.headers(URL), {'If-None-Match': 'e2'})
+
+class FailingOutput(fargo2html.MemoryOutput):
+    # with failing set, cannot save the manifest, like a build that dies at
+    # the end
+    failing = False
+
+    def putState(self, path, data):
+        if self.failing:
+            raise IOError("disk full")
+        fargo2html.MemoryOutput.putState(self, path, data)
+
+class ShortcutTest(unittest.TestCase):
+    # whole builds of a small site into memory, through a cache
+    def setUp(self):
+        self.site = Site()
+        self.cache = fargo2html.OutlineCache(self.site.path('cache'))
+        self.output = FailingOutput()
+        self.folder = self.site.path('site')
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, force=False, minify=False):
+        self.writer = fargo2html.OutputWriter(output=self.output, minify=minify)
+        self.stats = fargo2html.Stats()
+        quietly(fargo2html.parse, self.site.url, self.folder, None, cache=self.cache, force=force, writer=self.writer, stats=self.stats)
+
+    def assertNothingToDo(self, **kwargs):
+        self.assertRaises(fargo2html.NothingToDo, self.build, **kwargs)
+
+    def testUnchanged(self):
+        self.build()
+        self.assertEqual(sorted(self.output.files), ['about', 'contact', 'rss.xml'])
+        self.assertNothingToDo()
+
+    def testForce(self):
+        self.build()
+        self.build(force=True)
+        self.assertEqual(self.stats.skipped, 0)
+        # rendered again, but the same as what is there
+        self.assertEqual(self.writer.changed, [])
+
+    def testSettingsChanged(self):
+        self.build()
+        self.build(minify=True)
+        self.assertEqual(self.stats.skipped, 0)
+        self.assertNothingToDo(minify=True)
+        self.build()
+
+    def testDeletedOutput(self):
+        self.build()
+        del self.output.files['contact']
+        self.build()
+        self.assertEqual(self.writer.changed, [self.folder + '/contact'])
+        self.assertEqual(self.stats.skipped, 1)
+
+    def testChangedPage(self):
+        self.build()
+        self.site.write([("About", ["about you"]), ("Contact", ["write to me"])])
+        self.build()
+        self.assertEqual(self.writer.changed, [self.folder + '/about'])
+        self.assertTrue('about you' in self.output.files['about'])
+        self.assertNothingToDo()
+
+    def testFailedBuildIsBuiltAgain(self):
+        self.build()
+        self.site.write([("About", ["about you"]), ("Contact", ["write to me"])])
+        self.output.failing = True
+        self.assertRaises(IOError, self.build)
+        self.output.failing = False
+        self.build()
+        self.assertEqual(self.stats.skipped, 1)
+        self.assertTrue('about you' in self.output.files['about'])
+
+    def testSharedCache(self):
+        # another folder built from the same outline, through the same cache
+        other = fargo2html.MemoryOutput()
+        self.build()
+        quietly(fargo2html.parse, self.site.url, self.site.path('other'), None, cache=self.cache, writer=fargo2html.OutputWriter(output=other))
+        self.site.write([("About", ["about you"]), ("Contact", ["write to me"])])
+        self.build()
+        quietly(fargo2html.parse, self.site.url, self.site.path('other'), None, cache=self.cache, writer=fargo2html.OutputWriter(output=other))
+        self.assertTrue('about you' in other.files['about'])
+
+class FolderShortcutTest(unittest.TestCase):
+    # whole builds into a folder through main(), for what happens after
+    # parse: zipping and uploading
+    def setUp(self):
+        self.site = Site()
+        self.folder = self.site.path('site')
+        self.failing = set()
+        self.put_keys = []
+        put = self.put = fargo2html.FolderTarget.put
+        test = self
+        def failingPut(target, path, key):
+            test.put_keys.append(key)
+            if key in test.failing:
+                raise IOError("no room for %s" % key)
+            put(target, path, key)
+        fargo2html.FolderTarget.put = failingPut
+
+    def tearDown(self):
+        fargo2html.FolderTarget.put = self.put
+        self.site.close()
+
+    def build(self, *options):
+        report = {}
+        argv = ['--cache-dir=' + self.site.path('cache'), '-f', self.folder] + list(options) + [self.site.url, 'UPDATE']
+        quietly(fargo2html.main, argv, report)
+        return report['outcome']
+
+    def testFailedUploadIsRetried(self):
+        upload = '--upload=folder:' + self.site.path('target')
+        self.failing.add('contact')
+        self.assertEqual(self.build(upload), 'upload failed')
+        self.failing.clear()
+        self.put_keys = []
+        self.assertEqual(self.build(upload), 'ok')
+        self.assertEqual(self.put_keys, ['contact'])
+        self.assertEqual(self.build(upload), 'nothing to do')
+
+    def testZip(self):
+        zip_path = self.folder + '.zip'
+        self.assertEqual(self.build(), 'ok')
+        self.assertEqual(self.build('--zip'), 'ok')
+        self.assertTrue(os.path.exists(zip_path))
+        self.assertEqual(self.build('--zip'), 'nothing to do')
+        os.remove(zip_path)
+        self.assertEqual(self.build('--zip'), 'ok')
+        self.assertTrue(os.path.exists(zip_path))
+
+    def testIndexChanged(self):
+        self.assertEqual(self.build(), 'ok')
+        self.assertEqual(self.build('-iabout'), 'ok')
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'index.html')))
+        self.assertEqual(self.build('-iabout'), 'nothing to do')
+        self.assertEqual(self.build(), 'ok')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+test_minify.py
+
+--minify: HTML goes through minifyHTML in the writer, which drops comments
+and the white space a browser would not show, leaving <pre>, <script>,
+<style> and <textarea> as they are. Other files are written untouched.
+
+    python -m unittest discover tests
+"""
+
+import re, unittest
+
+from support import fargo2html, Site, RecordingOutput, quietly, node, document, calendar, BLOG_TEMPLATES
+
+class MinifyTest(unittest.TestCase):
+    def assertMinified(self, data, minified):
+        self.assertEqual(fargo2html.minifyHTML(data), minified)
+
+    def testBlockTags(self):
+        self.assertMinified('<div>\n\t\t<p>a  b</p>\n</div>\n', '<div><p>a  b</p></div>\n')
+        self.assertMinified('<div class="divOutlineList">\t<p>one</p>\t<p>two</p></div>', '<div class="divOutlineList"><p>one</p><p>two</p></div>')
+
+    def testInlineTags(self):
+        # the space between them shows, so one is kept
+        self.assertMinified('<b>a</b>   <i>b</i>', '<b>a</b> <i>b</i>')
+        self.assertMinified('<b>a</b>\n   <i>b</i>', '<b>a</b>\n<i>b</i>')
+        self.assertMinified('<span>one\n   two</span>', '<span>one\ntwo</span>')
+
+    def testComments(self):
+        self.assertMinified('<p>x</p><!-- a\ncomment --><!--[if IE]>y<![endif]-->', '<p>x</p><!--[if IE]>y<![endif]-->')
+
+    def testKept(self):
+        for tag in ('pre', 'script', 'style', 'textarea', 'PRE', 'Script'):
+            kept = '<%s>\n  <!-- a -->\n\n  x\n</%s>' % (tag, tag.lower())
+            self.assertMinified('<p>a</p>\n  ' + kept + '\n  <p>b</p>', '<p>a</p>\n' + kept + '<p>b</p>')
+
+def text(page):
+    # what a reader sees, near enough
+    return ' '.join(re.sub('<[^>]*>', ' ', page).split())
+
+def undated(feed):
+    # the feed says when it was built
+    return re.sub('<lastBuildDate>.*?</lastBuildDate>', '', feed)
+
+class MinifyBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.site.put('main.opml', document([
+            node('#rssTitle "Test"'), BLOG_TEMPLATES,
+            node('About', [node('one', [node('under one')]), node('two')]),
+            calendar('home', 2013)]))
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, output, *options):
+        reports = []
+        argv = list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output, on_stats=reports.append), 0)
+        return reports[0]['files']
+
+    def testPages(self):
+        plain, minified = fargo2html.MemoryOutput(), fargo2html.MemoryOutput()
+        self.build(plain)
+        files = self.build(minified, '--minify')
+        self.assertEqual(sorted(minified.files), sorted(plain.files))
+        for name in ('about', 'index.html', '2013/09/03/homePost3'):
+            self.assertTrue(len(minified.files[name]) < len(plain.files[name]), name)
+            self.assertEqual(text(minified.files[name]), text(plain.files[name]))
+            self.assertFalse('\t' in minified.files[name])
+        before, after = files['minified']['before'], files['minified']['after']
+        self.assertTrue(after < before)
+
+    def testFeedLeftAlone(self):
+        plain, minified = fargo2html.MemoryOutput(), fargo2html.MemoryOutput()
+        self.build(plain)
+        self.build(minified, '--minify')
+        self.assertEqual(undated(minified.files['rss.xml']), undated(plain.files['rss.xml']))
+
+    def testRebuild(self):
+        output = RecordingOutput()
+        self.build(output, '--minify')
+        output.puts = []
+        self.site.put('main.opml', open(self.site.path('source', 'main.opml')).read().replace('under one', 'under it'))
+        self.build(output, '--minify')
+        self.assertEqual(output.puts, ['about'])
+
+if __name__ == '__main__':
+    unittest.main()
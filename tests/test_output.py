@@ -0,0 +1,86 @@
+"""
+test_output.py
+
+Where a site goes: a folder, a MemoryOutput or a tar archive. Each has to
+come out as the same site, with the manifest and post listings kept only
+where they can be read back, never among the files of the site.
+
+    python -m unittest discover tests
+"""
+
+import os, re, tarfile, unittest
+
+from support import fargo2html, Site, RecordingOutput, quietly, node, document, calendar, BLOG_TEMPLATES
+
+def readFolder(folder):
+    files = {}
+    for path, dirs, names in os.walk(folder):
+        for name in names:
+            file_name = os.path.join(path, name)
+            files[os.path.relpath(file_name, folder)] = open(file_name, 'rb').read()
+    return files
+
+def readTar(file_name):
+    tar = tarfile.open(file_name)
+    try:
+        return dict((info.name, tar.extractfile(info).read()) for info in tar)
+    finally:
+        tar.close()
+
+def undated(files):
+    # the feed says when it was built
+    return dict((name, re.sub('<lastBuildDate>.*?</lastBuildDate>', '', data)) for name, data in files.items())
+
+class OutputTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.site.put('main.opml', document([
+            node('#rssTitle "Test"'), BLOG_TEMPLATES,
+            node('About', [node('one', [node('under one')]), node('two')]),
+            calendar('home', 2013)]))
+        self.folder = self.site.path('site')
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, *options, **kwargs):
+        argv = list(options) + ['-f', self.folder, self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, **kwargs), 0)
+
+    def folderSite(self):
+        self.build()
+        files = readFolder(self.folder)
+        self.assertTrue(fargo2html.MANIFEST_NAME in files)
+        del files[fargo2html.MANIFEST_NAME]
+        del files[fargo2html.POSTS_NAME]
+        return undated(files)
+
+    def testMemory(self):
+        output = fargo2html.MemoryOutput()
+        self.build(output=output)
+        self.assertEqual(undated(output.files), self.folderSite())
+        self.assertTrue(output.state)
+
+    def testTar(self):
+        file_name = self.site.path('site.tar')
+        self.build('--output=tar:' + file_name)
+        self.assertFalse(os.path.exists(self.folder))
+        self.assertEqual(undated(readTar(file_name)), self.folderSite())
+
+    def testTarWholeSiteEveryTime(self):
+        file_name = self.site.path('site.tar')
+        self.build('--output=tar:' + file_name)
+        first = readTar(file_name)
+        self.build('--output=tar:' + file_name)
+        self.assertEqual(sorted(readTar(file_name)), sorted(first))
+
+    def testMemoryRebuild(self):
+        output = RecordingOutput()
+        self.build(output=output)
+        self.assertTrue('about' in output.puts)
+        output.puts = []
+        self.build(output=output)
+        self.assertEqual(output.puts, [])
+
+if __name__ == '__main__':
+    unittest.main()
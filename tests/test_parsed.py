@@ -0,0 +1,144 @@
+"""
+test_parsed.py
+
+With a cache, each outline is also kept parsed, keyed by a hash of its
+bytes. The same bytes are read back without parsing their XML, unless a
+node has to be rendered, and a site built from the parsed copy is the same
+as one built from the XML.
+
+    python -m unittest discover tests
+"""
+
+import re, unittest, opml
+
+from support import fargo2html, Site, quietly, node, document, calendar, BLOG_TEMPLATES
+
+MAIN = document([
+    node('#glossary', [node('<%footer%>', [node('the footer')])]),
+    node('#rssTitle "Test"'), BLOG_TEMPLATES,
+    node('About', [node('one', [node('under one')]), node('two')]),
+    calendar('home', 2013)])
+
+class ParsedTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.url = self.site.url
+
+    def tearDown(self):
+        self.site.close()
+
+    def cache(self):
+        return fargo2html.OutlineCache(self.site.path('cache'))
+
+    def keep(self, content):
+        cache = self.cache()
+        nodes, glossary, templates = fargo2html.readMainOutline(self.url, content, cache)
+        cache.saveParsed()
+        return nodes, glossary, templates
+
+    def testReadBack(self):
+        nodes, glossary, templates = self.keep(MAIN)
+        cache = self.cache()
+        cached, cached_glossary, cached_templates = fargo2html.readMainOutline(self.url, MAIN, cache)
+        self.assertEqual(cached_glossary, glossary)
+        self.assertEqual(sorted(cached_templates), sorted(templates))
+        self.assertEqual([(n.text, len(n)) for n in cached], [(n.text, len(n)) for n in nodes])
+        outline, = cache.outlines
+        self.assertEqual(outline.parsed, None)
+        # the XML is parsed for the first node that is rendered
+        about = cached[1]
+        self.assertEqual(fargo2html.nodeDigest(about), fargo2html.nodeDigest(nodes[1]))
+        self.assertNotEqual(outline.parsed, None)
+        self.assertEqual(etreeText(about), etreeText(nodes[1]))
+
+    def testOtherBytes(self):
+        self.keep(MAIN)
+        changed = MAIN.replace('under one', 'under it')
+        self.assertEqual(self.cache().parsed(self.url, changed), None)
+        self.assertNotEqual(self.cache().parsed(self.url, MAIN), None)
+
+    def testDigestKept(self):
+        # worked out once, and saved with the entry for next time
+        nodes, glossary, templates = self.keep(MAIN)
+        cache = self.cache()
+        cached = fargo2html.readMainOutline(self.url, MAIN, cache)[0]
+        digest = fargo2html.nodeDigest(cached[1])
+        cache.saveParsed()
+        cache = self.cache()
+        cached = fargo2html.readMainOutline(self.url, MAIN, cache)[0]
+        self.assertEqual(cached[1].record[1], digest)
+
+    def testBroken(self):
+        self.keep(MAIN)
+        open(self.cache().paths(self.url)[0].replace('.opml', '.parsed'), 'wb').write('not marshalled')
+        self.assertEqual(self.cache().parsed(self.url, MAIN), None)
+
+    def testInclude(self):
+        include = document([node('Included', [node('included text')])])
+        cache = self.cache()
+        nodes = fargo2html.readOutline(self.url, include, cache)
+        cache.saveParsed()
+        cached = fargo2html.readOutline(self.url, include, self.cache())
+        self.assertEqual([(n.text, len(n)) for n in cached], [(n.text, len(n)) for n in nodes])
+        self.assertTrue(isinstance(cached[0], fargo2html.CachedNode))
+
+def etreeText(node):
+    return fargo2html.etree.tostring(fargo2html.nodeElement(node)._root)
+
+class ParsedBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.include_url = self.site.url.replace('main.opml', 'include.opml')
+        self.put('included text')
+        self.parsed = []
+        self.from_string = opml.from_string
+        test = self
+        def countedFromString(content):
+            test.parsed.append(content)
+            return test.from_string(content)
+        opml.from_string = countedFromString
+
+    def tearDown(self):
+        opml.from_string = self.from_string
+        self.site.close()
+
+    def put(self, text):
+        self.site.put('include.opml', document([node('Included', [node(text)])]))
+        self.site.put('main.opml', MAIN.replace('</body>', node('Include', type='include', url=self.include_url) + '</body>'))
+
+    def build(self, output, *options):
+        self.parsed = []
+        argv = list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        # the feed says when it was built
+        return dict((name, re.sub('<lastBuildDate>.*?</lastBuildDate>', '', data)) for name, data in output.files.items())
+
+    def testOnlyIncludeParsed(self):
+        cached = fargo2html.MemoryOutput()
+        options = ['--cache-dir', self.site.path('cache')]
+        self.build(cached, *options)
+        self.put('included again')
+        files = self.build(cached, *options)
+        self.assertEqual(len(self.parsed), 1)
+        self.assertTrue('included again' in self.parsed[0])
+        self.assertEqual(files, self.build(fargo2html.MemoryOutput()))
+
+    def testNothingParsed(self):
+        # downloaded again with the same bytes and nothing to render, no XML
+        # is parsed at all
+        cached = fargo2html.MemoryOutput()
+        options = ['--cache-dir', self.site.path('cache')]
+        self.build(cached, *options)
+        self.site.put('main.opml', open(self.site.path('source', 'main.opml')).read())
+        self.build(cached, *options)
+        self.assertEqual(self.parsed, [])
+
+    def testSameSite(self):
+        # every node rendered from the parsed copy
+        options = ['--cache-dir', self.site.path('cache')]
+        self.build(fargo2html.MemoryOutput(), *options)
+        files = self.build(fargo2html.MemoryOutput(), *options)
+        self.assertEqual(files, self.build(fargo2html.MemoryOutput()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+test_posts.py
+
+The PostStore: post listings kept in sqlite by output file rather than in
+memory, found again for posts that have not changed and dropped for posts
+a build no longer has. Archives read them back by row id.
+
+    python -m unittest discover tests
+"""
+
+import os, sqlite3, unittest
+
+from support import fargo2html, Site, quietly, node, document, BLOG_TEMPLATES
+
+LISTING = ('Hello', '<p>hello</p>', '/2012/09/03/hello', 'a post')
+
+class PostStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.store = fargo2html.PostStore(fargo2html.Unclosed(self.db))
+
+    def tearDown(self):
+        self.db.close()
+
+    def testFind(self):
+        row = self.store.add('2012/09/03/hello', 'd1', LISTING)
+        self.assertEqual(self.store.find('2012/09/03/hello', 'd1'), (row, LISTING))
+        self.assertEqual(self.store.find('2012/09/03/hello', 'd2'), None)
+        self.assertEqual(self.store.find('2012/09/04/hello', 'd1'), None)
+
+    def testStrAndUnicode(self):
+        listing = (u'Caf\xe9', '<p>caf\xc3\xa9</p>', '/cafe', u'')
+        row = self.store.add('cafe', 'd1', listing)
+        found = self.store.listings([row])[0]
+        self.assertEqual(found, listing)
+        self.assertEqual([type(part) for part in found], [unicode, str, str, unicode])
+
+    def testListingsInOrder(self):
+        rows = [self.store.add('post%d' % i, 'd', ('Post %d' % i, '', '/post%d' % i, '')) for i in range(1200)]
+        wanted = list(reversed(rows)) + rows[:3]
+        self.assertEqual([listing[0] for listing in self.store.listings(wanted)],
+                         ['Post %d' % i for i in reversed(range(1200))] + ['Post 0', 'Post 1', 'Post 2'])
+
+    def testUnseenDropped(self):
+        self.store.add('old', 'd1', LISTING)
+        self.store.add('kept', 'd1', LISTING)
+        self.store.close()
+        store = fargo2html.PostStore(fargo2html.Unclosed(self.db))
+        row, listing = store.find('kept', 'd1')
+        store.close()
+        self.assertEqual(self.db.execute("SELECT id, key FROM posts").fetchall(), [(row, u'kept')])
+
+    def testAbandon(self):
+        self.store.add('kept', 'd1', LISTING)
+        self.store.close()
+        store = fargo2html.PostStore(fargo2html.Unclosed(self.db))
+        store.add('new', 'd1', LISTING)
+        store.abandon()
+        self.assertEqual(store.db, None)
+        self.assertEqual(self.db.execute("SELECT key FROM posts").fetchall(), [(u'kept',)])
+
+def blog(days):
+    posts = [node('September %d' % day, [node('Post %d' % day, [node(text)], created='Mon, %02d Sep 2012 10:00:00 GMT' % day)])
+             for day, text in days]
+    year = node('2012', [node('September 2012', posts)], icon='calendar', name='Blog')
+    return document([node('#rssTitle "Test"'), BLOG_TEMPLATES, year])
+
+class PostsBuildTest(unittest.TestCase):
+    # builds into a folder, where the store is a file next to the manifest
+    def setUp(self):
+        self.site = Site()
+        self.folder = self.site.path('site')
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, days):
+        self.site.put('main.opml', blog(days))
+        argv = ['-f', self.folder, self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv), 0)
+        return open(os.path.join(self.folder, 'index.html')).read()
+
+    def keys(self):
+        db = sqlite3.connect(os.path.join(self.folder, fargo2html.POSTS_NAME))
+        try:
+            return sorted(key for key, in db.execute("SELECT key FROM posts"))
+        finally:
+            db.close()
+
+    def testKept(self):
+        self.build([(1, 'one'), (2, 'two')])
+        self.assertEqual(self.keys(), ['2012/09/01/post1', '2012/09/02/post2'])
+
+    def testUnchangedListedFromStore(self):
+        self.build([(1, 'one'), (2, 'two')])
+        home = self.build([(1, 'one'), (2, 'two again')])
+        self.assertTrue('one' in home)
+        self.assertTrue('two again' in home)
+
+    def testRemovedPost(self):
+        self.build([(1, 'one'), (2, 'two')])
+        home = self.build([(2, 'two')])
+        self.assertFalse('Post 1' in home)
+        self.assertEqual(self.keys(), ['2012/09/02/post2'])
+
+if __name__ == '__main__':
+    unittest.main()
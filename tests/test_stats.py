@@ -0,0 +1,54 @@
+"""
+test_stats.py
+
+The --stats report. Bytes fetched are only what was downloaded: an outline
+or include that the cache answered for with a 304 is counted as a source
+but adds nothing.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly, node, document
+
+TEMPLATES = node('#templates', [node('outline', [node('<html><body><%bodytext%></body></html>')])])
+
+class FetchStatsTest(unittest.TestCase):
+    options = []
+
+    def setUp(self):
+        self.site = Site()
+        self.include = document([node('Included', [node('from the include')])])
+        self.site.put('include.opml', self.include)
+        self.put('about me')
+        self.output = fargo2html.MemoryOutput()
+
+    def tearDown(self):
+        self.site.close()
+
+    def put(self, text):
+        self.main = document([node('#rssTitle "Test"'), TEMPLATES, node('About', [node(text)]),
+            node('Include', type='include', url=self.site.url.replace('main.opml', 'include.opml'))])
+        self.site.put('main.opml', self.main)
+
+    def build(self):
+        reports = []
+        argv = self.options + ['--cache-dir', self.site.path('cache'), '-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, on_stats=reports.append, output=self.output), 0)
+        return reports[0]['fetch']
+
+    def testDownloaded(self):
+        self.assertEqual(self.build(), {'bytes': len(self.main) + len(self.include), 'sources': 2})
+
+    def testCachedNotCounted(self):
+        self.build()
+        self.put('about you')
+        self.assertEqual(self.build(), {'bytes': len(self.main), 'sources': 2})
+        self.assertTrue('about you' in self.output.files['about'])
+
+class StreamFetchStatsTest(FetchStatsTest):
+    options = ['--stream']
+
+if __name__ == '__main__':
+    unittest.main()
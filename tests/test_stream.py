@@ -0,0 +1,72 @@
+"""
+test_stream.py
+
+--stream renders pages as the outline downloads, from the top down, where
+the default build reads all of it first and renders from the bottom up.
+Both have to give the same site, whatever order the settings, calendars and
+pages come in.
+
+    python -m unittest discover tests
+"""
+
+import re, unittest
+
+from support import fargo2html, Site, quietly, node, document, calendar, BLOG_TEMPLATES
+
+def blog(include_url):
+    # settings above and below the pages, two calendars for the home page and
+    # another for Recipes, two pages named About and an include
+    return document([
+        node('#blogHomeTitle "Top"'),
+        node('#rssTitle "Test"'),
+        node('About', [node('the first about')]),
+        BLOG_TEMPLATES,
+        node('Contact', [node('write to me')]),
+        node('#blogHomeTitle "Middle"'),
+        calendar('home', 2012),
+        node('About', [node('the second about')]),
+        node('#glossary', [node('<%footer%>', [node('the footer')])]),
+        calendar('home', 2013),
+        node('Recipes', [calendar('recipe', 2013)]),
+        node('Included', type='include', url=include_url),
+        node('Last', [node('at the bottom')]),
+        node('#blogHomeTitle "Bottom"')])
+
+INCLUDE = document([
+    node('Included Page', [node('from the include')]),
+    node('#blogHomeTitle "Included"'),
+    node('After', [node('after the title')]),
+    node('After', [node('the second after')])])
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site()
+        self.site.put('include.opml', INCLUDE)
+        self.site.put('main.opml', blog(self.site.url.replace('main.opml', 'include.opml')))
+
+    def tearDown(self):
+        self.site.close()
+
+    def build(self, *options):
+        output = fargo2html.MemoryOutput()
+        argv = list(options) + ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        return output.files
+
+    def assertSameSite(self, *options):
+        default = self.build()
+        streamed = self.build('--stream', *options)
+        self.assertEqual(sorted(streamed), sorted(default))
+        for name in default:
+            # the feed says when it was built
+            self.assertEqual(re.sub('<lastBuildDate>.*?</lastBuildDate>', '', streamed[name]),
+                             re.sub('<lastBuildDate>.*?</lastBuildDate>', '', default[name]), name)
+
+    def testSameSite(self):
+        self.assertSameSite()
+
+    def testSameSiteWithJobs(self):
+        self.assertSameSite('--jobs=3')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+test_template.py
+
+Templates are split once into text and <%name%> slots and filled in with a
+join. A value goes in as it is: a backslash in it stays a backslash, where
+the re.sub this replaced read it as an escape.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from support import fargo2html, Site, quietly
+
+class TemplateTest(unittest.TestCase):
+    def testSlots(self):
+        template = fargo2html.Template('<h1><%pageTitle%></h1><%bodytext%>')
+        self.assertEqual(template.render({'pageTitle': 'About', 'bodytext': '<p>me</p>'}), '<h1>About</h1><p>me</p>')
+
+    def testMissingLeftForGlossary(self):
+        template = fargo2html.Template('<%navbar%><h1><%pageTitle%></h1>')
+        self.assertEqual(template.render({'pageTitle': 'About'}), '<%navbar%><h1>About</h1>')
+
+    def testBackslash(self):
+        template = fargo2html.Template('<h1><%pageTitle%></h1>')
+        self.assertEqual(template.render({'pageTitle': r'C:\new\1 \\'}), r'<h1>C:\new\1 \\</h1>')
+
+    def testCompiledOnce(self):
+        self.assertTrue(fargo2html.compileTemplate('<%a%>') is fargo2html.compileTemplate('<%a%>'))
+
+class BackslashPageTest(unittest.TestCase):
+    def setUp(self):
+        self.site = Site([(r"C:\new", ["a page"])])
+
+    def tearDown(self):
+        self.site.close()
+
+    def testTitle(self):
+        output = fargo2html.MemoryOutput()
+        argv = ['-f', self.site.path('site'), self.site.url, 'UPDATE']
+        self.assertEqual(quietly(fargo2html.main, argv, output=output), 0)
+        page, = [data for name, data in output.files.items() if name != 'rss.xml']
+        self.assertTrue(r'<h1>C:\new</h1>' in page, page)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+test_upload.py
+
+The upload stage: the Uploader on its own with a stand-in target, then
+whole builds uploading to a folder, where only files the target does not
+have yet should be put there.
+
+    python -m unittest discover tests
+"""
+
+import os, shutil, tempfile, threading, unittest
+
+from support import fargo2html, Site, quietly
+
+class FakeTarget(object):
+    # keeps what was put, and fails for the keys in failing
+    name = 'fake'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.put_keys = []
+
+    def put(self, path, key):
+        self.put_keys.append(key)
+        if key in self.failing:
+            raise IOError("no room for %s" % key)
+
+class SlowTarget(FakeTarget):
+    # holds each put until go is set, keeping what it read from the file,
+    # and counts how many puts of one key were ever under way at once; only
+    # the first put of a key in failing fails
+    def __init__(self, failing=()):
+        FakeTarget.__init__(self, failing)
+        self.go = threading.Event()
+        self.started = threading.Event()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.most = 0
+        self.files = {}
+
+    def put(self, path, key):
+        self.lock.acquire()
+        self.active[key] = self.active.get(key, 0) + 1
+        self.most = max(self.most, self.active[key])
+        self.lock.release()
+        self.started.set()
+        self.go.wait()
+        try:
+            self.put_keys.append(key)
+            if key in self.failing:
+                self.failing.discard(key)
+                raise IOError("no room for %s" % key)
+            self.files[key] = open(path).read()
+        finally:
+            self.lock.acquire()
+            self.active[key] -= 1
+            self.lock.release()
+
+class UploaderTest(unittest.TestCase):
+    def testSameFileOnce(self):
+        target = FakeTarget()
+        uploader = fargo2html.Uploader(target, 2)
+        uploader.submit('/site/about', 'about', 'd1')
+        uploader.submit('/site/about', 'about', 'd1')
+        done, failed = uploader.finish()
+        self.assertEqual(target.put_keys, ['about'])
+        self.assertEqual(done, {'about': 'd1'})
+        self.assertEqual(failed, [])
+
+    def testChangedAgain(self):
+        target = FakeTarget()
+        uploader = fargo2html.Uploader(target, 1)
+        uploader.submit('/site/about', 'about', 'd1')
+        uploader.submit('/site/about', 'about', 'd2')
+        done, failed = uploader.finish()
+        # d2 can be picked up before d1 has started going up
+        self.assertTrue(target.put_keys in (['about'], ['about', 'about']))
+        self.assertEqual(done, {'about': 'd2'})
+
+    def testRewrittenWhileGoingUp(self):
+        work = tempfile.mkdtemp(prefix='fargotest')
+        try:
+            path = os.path.join(work, 'about')
+            target = SlowTarget(['about'])
+            uploader = fargo2html.Uploader(target, 4)
+            open(path, 'w').write('about me')
+            uploader.submit(path, 'about', 'd1')
+            target.started.wait(5)
+            open(path, 'w').write('about you')
+            uploader.submit(path, 'about', 'd2')
+            open(path, 'w').write('about them')
+            uploader.submit(path, 'about', 'd3')
+            target.go.set()
+            done, failed = uploader.finish()
+        finally:
+            shutil.rmtree(work)
+        self.assertEqual(target.most, 1)
+        self.assertEqual(target.put_keys, ['about', 'about'])
+        self.assertEqual(target.files, {'about': 'about them'})
+        self.assertEqual(done, {'about': 'd3'})
+        self.assertEqual(failed, [])
+
+    def testFailed(self):
+        uploader = fargo2html.Uploader(FakeTarget(['contact']), 2)
+        uploader.submit('/site/about', 'about', 'd1')
+        uploader.submit('/site/contact', 'contact', 'd2')
+        done, failed = uploader.finish()
+        self.assertEqual(done, {'about': 'd1'})
+        self.assertEqual([key for key, error in failed], ['contact'])
+        # finish starts the next run afresh
+        self.assertEqual(uploader.finish(), ({}, []))
+
+    def testOnlyWhatTheTargetLacks(self):
+        output = fargo2html.MemoryOutput()
+        output.start('/site')
+        manifest = fargo2html.Manifest('/site', output=output)
+        uploader = fargo2html.Uploader(FakeTarget(), 1)
+        writer = fargo2html.OutputWriter(manifest, uploader, output)
+        writer.write('/site/about', 'about me')
+        writer.write('/site/contact', 'write to me')
+        manifest.setUploaded('fake', uploader.finish()[0])
+        writer.write('/site/about', 'about you')
+        writer.write('/site/contact', 'write to me')
+        self.assertEqual(uploader.finish()[0].keys(), ['about'])
+
+class UploadTest(unittest.TestCase):
+    # whole builds into a folder, uploaded to another folder
+    def setUp(self):
+        self.site = Site()
+        self.folder = self.site.path('site')
+        self.put_keys = []
+        self.failing = set()
+        put = self.put = fargo2html.FolderTarget.put
+        test = self
+        def recordPut(target, path, key):
+            test.put_keys.append(key)
+            if key in test.failing:
+                raise IOError("no room for %s" % key)
+            put(target, path, key)
+        fargo2html.FolderTarget.put = recordPut
+
+    def tearDown(self):
+        fargo2html.FolderTarget.put = self.put
+        self.site.close()
+
+    def build(self, target='target'):
+        self.put_keys = []
+        argv = ['-f', self.folder, '--upload=folder:' + self.site.path(target), self.site.url, 'UPDATE']
+        return quietly(fargo2html.main, argv)
+
+    def testFirstBuildUploadsEverything(self):
+        self.assertEqual(self.build(), 0)
+        self.assertEqual(sorted(self.put_keys), ['about', 'contact', 'rss.xml'])
+        for key in self.put_keys:
+            self.assertEqual(open(self.site.path('target', key)).read(), open(self.site.path('site', key)).read())
+
+    def testUnchanged(self):
+        self.build()
+        self.assertEqual(self.build(), 0)
+        self.assertEqual(self.put_keys, [])
+
+    def testChangedOnly(self):
+        self.build()
+        self.site.write([("About", ["about you"]), ("Contact", ["write to me"])])
+        self.assertEqual(self.build(), 0)
+        self.assertEqual(self.put_keys, ['about'])
+        self.assertTrue('about you' in open(self.site.path('target', 'about')).read())
+
+    def testFailedIsUploadedAgain(self):
+        self.failing.add('contact')
+        self.assertEqual(self.build(), 1)
+        self.failing.clear()
+        self.assertEqual(self.build(), 0)
+        self.assertEqual(self.put_keys, ['contact'])
+
+    def testAnotherTarget(self):
+        self.build()
+        self.build('other')
+        self.assertEqual(sorted(self.put_keys), ['about', 'contact', 'rss.xml'])
+        self.build()
+        self.assertEqual(self.put_keys, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+test_zip.py
+
+zipdir copies entries for files that have not changed from the last zip of
+the folder, still compressed, and compresses the rest again.
+
+    python -m unittest discover tests
+"""
+
+import os, shutil, tempfile, time, unittest, zipfile
+
+from support import fargo2html
+
+class ZipTest(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='fargotest')
+        self.folder = os.path.join(self.work, 'site')
+        os.mkdir(self.folder)
+        # one file on an odd second, which a zip cannot keep the time of
+        when = int(time.time()) // 2 * 2
+        for name, seconds in (('about', when + 1), ('contact', when)):
+            self.put(name, 'about %s' % name, seconds)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def put(self, name, text, seconds):
+        path = os.path.join(self.folder, name)
+        fh = open(path, 'w')
+        fh.write(text)
+        fh.close()
+        os.utime(path, (seconds, seconds))
+
+    def testUnchangedIsReused(self):
+        self.assertEqual(fargo2html.zipdir(self.folder, 6), (2, 0))
+        self.assertEqual(fargo2html.zipdir(self.folder, 6), (0, 2))
+        # entries are named from the folder's parent down
+        archive = zipfile.ZipFile(fargo2html.zipPath(self.folder))
+        name = os.path.join(os.path.basename(self.work), 'site', 'about')
+        self.assertEqual(archive.read(name), 'about about')
+        archive.close()
+
+    def testChangedIsCompressedAgain(self):
+        fargo2html.zipdir(self.folder, 6)
+        self.put('about', 'about you', int(time.time()) + 10)
+        self.assertEqual(fargo2html.zipdir(self.folder, 6), (1, 1))
+        # or that the build says it wrote, whatever its time
+        self.assertEqual(fargo2html.zipdir(self.folder, 6, changed=[os.path.join(self.folder, 'contact')]), (1, 1))
+
+    def testOtherLevel(self):
+        fargo2html.zipdir(self.folder, 6)
+        self.assertEqual(fargo2html.zipdir(self.folder, 0), (2, 0))
+
+if __name__ == '__main__':
+    unittest.main()